@@ -0,0 +1,64 @@
+"""
+Compare two result files of benchmarks.run, e.g. of the base and the head commit of a change.
+
+    PYTHONPATH=.:src python -m benchmarks.compare baseline.json results.json --threshold 1.1
+"""
+
+import json
+import argparse
+from typing import Dict, Tuple
+
+# fields that are measurements rather than parameters of a benchmark
+METRICS = ('repeats', 'seconds_min', 'seconds_median', 'seconds_mean', 'tokens', 'tokens_per_second',
+           'seconds_per_call', 'requests', 'acceptance_rate', 'speedup', 'kl_mean', 'kl_max', 'prob_abs_diff_max',
+           'top1_agreement', 'positions')
+
+
+def _key(record: Dict) -> Tuple:
+    return tuple(sorted((name, value) for name, value in record.items() if name not in METRICS))
+
+
+def compare(baseline: Dict, results: Dict, threshold: float = 1.1) -> int:
+    """
+    Print the median time of every benchmark in both files and their ratio.
+
+    Returns:
+        Number of benchmarks that got slower by more than threshold
+    """
+    base = {_key(record): record for record in baseline['results']}
+    print(f"baseline {baseline['environment'].get('commit')} -> {results['environment'].get('commit')}")
+    regressions = 0
+    for record in results['results']:
+        before = base.get(_key(record))
+        params = ", ".join(f"{name}={value}" for name, value in _key(record) if name != 'benchmark')
+        if before is None:
+            print(f"  {record['benchmark']:<24} {params}: new")
+            continue
+        ratio = record['seconds_median'] / before['seconds_median'] if before['seconds_median'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = '  faster'
+        print(f"  {record['benchmark']:<24} {params}: {before['seconds_median'] * 1000:.3f} ms -> "
+              f"{record['seconds_median'] * 1000:.3f} ms (x{ratio:.2f}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('baseline')
+    parser.add_argument('results')
+    parser.add_argument('--threshold', type=float, default=1.1, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+    regressions = compare(baseline, results, args.threshold)
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Local HTTP stand-in for the Google Maps Directions API, so that the maps tools can be benchmarked
+without network access or an API key.
+"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from MobilityAgent.geodesic import haversine
+
+
+def _parse(location: str):
+    lat, lng = location.split(',')
+    return float(lat), float(lng)
+
+
+def _leg(origin, destination) -> dict:
+    # road distance ~ 1.3x the great-circle distance, driven at 30 km/h, 25% slower in traffic
+    distance = int(haversine(origin[0], origin[1], destination[0], destination[1]) * 1.3) + 1
+    duration = int(distance / (30 / 3.6)) + 1
+    return {
+        'distance': {'value': distance, 'text': f'{distance} m'},
+        'duration': {'value': duration, 'text': f'{duration} s'},
+        'duration_in_traffic': {'value': int(duration * 1.25), 'text': f'{int(duration * 1.25)} s'},
+        'start_address': f'{origin[0]:.6f},{origin[1]:.6f}',
+        'end_address': f'{destination[0]:.6f},{destination[1]:.6f}',
+        'steps': [],
+    }
+
+
+def directions_response(query: dict) -> dict:
+    """Directions API response (status, routes[0].legs) for the parsed query string of a request."""
+    try:
+        points = [_parse(query['origin'][0])]
+        if 'waypoints' in query:
+            points += [_parse(waypoint) for waypoint in query['waypoints'][0].split('|')]
+        points.append(_parse(query['destination'][0]))
+    except (KeyError, ValueError):
+        return {'status': 'INVALID_REQUEST', 'routes': []}
+    return {'status': 'OK', 'routes': [{'legs': [_leg(a, b) for a, b in zip(points[:-1], points[1:])]}]}
+
+
+class DirectionsStub:
+    """
+    Threaded HTTP server answering Directions requests on 127.0.0.1 with straight-line routes,
+    after an artificial latency per request.
+    """
+
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        """
+        Args:
+            latency: Seconds every request waits before it is answered, to mimic the network
+            port: Port to listen on (default: any free port)
+        """
+        stub = self
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps(directions_response(parse_qs(urlparse(self.path).query))).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/maps/api/directions/json'
+
+    def start(self) -> "DirectionsStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, name='directions-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
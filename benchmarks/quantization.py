@@ -0,0 +1,88 @@
+"""
+Accuracy of int8 inference (model.quantization = 'int8') against the fp32 model, on the next-segment
+distributions along held-out trajectories.
+
+    PYTHONPATH=.:src python -m benchmarks.quantization --model_path mobilitygpt/model.pt --dataset SF \
+        --trajectories held_out.txt
+
+held_out.txt has one trajectory per line, road segment IDs separated by commas or spaces, none of
+them seen in training. Without --trajectories, random walks over the road graph are used.
+"""
+
+import copy
+import json
+import argparse
+from typing import Dict, List
+
+import torch
+
+from mobilitygpt.config import get_base_config
+from mobilitygpt.quantization import quantize_model, compare_next_segment_distributions
+from MobilityAgent.mobility_inference import MobilityInference
+from .synthetic import random_walks
+
+
+def quantization_accuracy(reference, quantized, graph, trajectories: List[List[int]]) -> Dict:
+    """
+    compare_next_segment_distributions over every prefix of trajectories, each starting with the
+    end token as in generation and cut to the block size of reference.
+
+    Args:
+        reference: fp32 GPT
+        quantized: The int8 version of reference
+        graph: RoadGraph of the models
+        trajectories: Lists of road segment IDs
+
+    Returns:
+        kl_mean and top1_agreement averaged over all positions, kl_max and prob_abs_diff_max
+        over all positions, and the number of positions
+    """
+    eos = graph.num_nodes
+    totals = {'kl_mean': 0.0, 'kl_max': 0.0, 'prob_abs_diff_max': 0.0, 'top1_agreement': 0.0}
+    positions = 0
+    for trajectory in trajectories:
+        tokens = [eos] + graph.token_indices(trajectory).tolist()
+        idx = torch.tensor([tokens[:reference.block_size]], dtype=torch.long)
+        stats = compare_next_segment_distributions(reference, quantized, idx)
+        n = idx.size(1)
+        totals['kl_mean'] += stats['kl_mean'] * n
+        totals['top1_agreement'] += stats['top1_agreement'] * n
+        totals['kl_max'] = max(totals['kl_max'], stats['kl_max'])
+        totals['prob_abs_diff_max'] = max(totals['prob_abs_diff_max'], stats['prob_abs_diff_max'])
+        positions += n
+    totals['kl_mean'] /= max(positions, 1)
+    totals['top1_agreement'] /= max(positions, 1)
+    return {**totals, 'positions': positions}
+
+
+def read_trajectories(path: str) -> List[List[int]]:
+    with open(path) as f:
+        return [[int(s) for s in line.replace(',', ' ').split()] for line in f if line.strip()]
+
+
+def main():
+    config = get_base_config()
+    parser = argparse.ArgumentParser(description="Compare int8 against fp32 next-segment distributions")
+    parser.add_argument('--model_path', default="mobilitygpt/model.pt")
+    parser.add_argument('--dataset', default="SF")
+    parser.add_argument('--trajectories', default=None, help="Held-out trajectories, one per line")
+    parser.add_argument('--num', type=int, default=256, help="Trajectories evaluated (random walks without --trajectories)")
+    parser.add_argument('--seed', type=int, default=config.system.seed)
+    args = parser.parse_args()
+
+    inference = MobilityInference(model_path=args.model_path, dataset=args.dataset)
+    if inference.config.model.quantization is not None:
+        raise SystemExit("Set model.quantization = None: the checkpoint is quantized here, not on load")
+    reference = inference.model.to('cpu')
+    reference.adj_matrix = inference.graph.build_adjacency(sparse=inference.config.model.sparse_adjacency)
+    quantized = quantize_model(copy.deepcopy(reference))
+
+    if args.trajectories is not None:
+        trajectories = read_trajectories(args.trajectories)[:args.num]
+    else:
+        trajectories = random_walks(inference.graph, args.num, reference.block_size - 1, seed=args.seed)
+    print(json.dumps(quantization_accuracy(reference, quantized, inference.graph, trajectories), indent=2))
+
+
+if __name__ == '__main__':
+    main()
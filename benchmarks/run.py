@@ -0,0 +1,356 @@
+"""
+Benchmarks of road graph loading, trajectory generation (plain, speculative and int8), trajectory lengths and route quality
+evaluation, on synthetic road networks and randomly initialized models.
+
+    PYTHONPATH=.:src python -m benchmarks.run --sizes 20 50 --output results.json
+    PYTHONPATH=.:src python -m benchmarks.compare baseline.json results.json
+
+Every measurement is one JSON record (benchmark name, parameters, timings in seconds), written
+together with the commit and the library versions, so that runs on different commits can be
+compared with benchmarks.compare.
+"""
+
+import os
+import sys
+import json
+import copy
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from mobilitygpt.config import get_base_config
+from mobilitygpt.model import GPT
+from mobilitygpt.profiling import GenerationProfiler
+from mobilitygpt.quantization import quantize_model
+from MobilityAgent.roadmap import load_road_graph, load_segment_geometry
+from MobilityAgent.mobility_inference import MobilityInference
+from MobilityAgent.tools.directions_cache import DirectionsCache
+from MobilityAgent.tools.directions_client import DirectionsClient
+from MobilityAgent.tools.route_quality_tool import RouteQualityTool
+from .synthetic import generate_road_network, generate_checkpoints, model_config_for, random_walks
+from .directions_stub import DirectionsStub
+from .quantization import quantization_accuracy
+
+# model_configs entries benchmarked by default; the GPT-2 sized ones take minutes per run on a CPU
+DEFAULT_MODELS = ['gpt-nano', 'gpt-micro', 'gpt-mini', 'gpt-mobility']
+
+
+def measure(fn: Callable, repeats: int, warmup: int = 1, setup: Optional[Callable] = None) -> Dict:
+    """
+    Time fn over repeats runs after warmup untimed ones. setup (untimed) runs before every call.
+    When fn returns a number of tokens, the throughput is reported as well.
+    """
+    times, tokens = [], []
+    for i in range(warmup + repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+            tokens.append(result)
+    stats = {
+        'repeats': repeats,
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+        'seconds_mean': statistics.fmean(times),
+    }
+    if all(isinstance(t, (int, float)) for t in tokens):
+        stats['tokens'] = sum(tokens) / repeats
+        stats['tokens_per_second'] = sum(tokens) / sum(times)
+    return stats
+
+
+def bench_graph_load(dataset: str, repeats: int) -> List[Dict]:
+    artifact_dir = f'{dataset}-Taxi/roadmap.compiled'
+    records = [
+        dict(benchmark='graph_load', mode='csv',
+             **measure(lambda: load_road_graph(dataset, use_cache=False), repeats)),
+        dict(benchmark='graph_load', mode='compile',
+             **measure(lambda: load_road_graph(dataset, use_cache=True), repeats,
+                       setup=lambda: shutil.rmtree(artifact_dir, ignore_errors=True))),
+        dict(benchmark='graph_load', mode='mmap',
+             **measure(lambda: load_road_graph(dataset, use_cache=True), repeats)),
+    ]
+    graph = load_road_graph(dataset, use_cache=True)
+    records.append(dict(benchmark='build_adjacency', sparse=True,
+                        **measure(lambda: graph.build_adjacency(sparse=True), repeats)))
+    return records
+
+
+def bench_generation(graph, checkpoint: str, model_type: str, batch_sizes: List[int], repeats: int,
+                     max_length: int, device: str, seed: int) -> List[Dict]:
+    """
+    generate_test (one trajectory per call) and generate_batch at every batch size. A random model
+    samples the end token early and at random, so it is not treated as the end: every trajectory is
+    decoded to max_length and the runs stay comparable.
+    """
+    config = model_config_for(model_type, graph.num_nodes + 1)
+    model = GPT(config, adj_matrix=graph.build_adjacency(sparse=get_base_config().model.sparse_adjacency, device=device))
+    model.load_state_dict(torch.load(checkpoint, map_location=device, weights_only=True))
+    model.to(device)
+    model.eval()
+    num_params = sum(p.numel() for p in model.parameters())
+    eos = graph.num_nodes
+    itos = dict(enumerate(graph.geo_ids.tolist() + ['</S>']))
+    rng = np.random.default_rng(seed)
+
+    def context(batch_size):
+        origins = rng.integers(graph.num_nodes, size=batch_size)
+        return torch.tensor([[eos, origin] for origin in origins], dtype=torch.long, device=device)
+
+    def run_test():
+        y = model.generate_test(context(1), itos=itos, end_token=None, temperature=1.0, do_sample=True,
+                                max_token=max_length)
+        return y.size(1) - 2
+
+    torch.manual_seed(seed)
+    records = [dict(benchmark='generate_test', model=model_type, params=num_params, batch_size=1,
+                    **measure(run_test, repeats))]
+    for batch_size in batch_sizes:
+        def run_batch():
+            ys = model.generate_batch(context(batch_size), end_token=None, temperature=1.0, do_sample=True,
+                                      max_token=max_length)
+            return sum(len(y) - 2 for y in ys)
+
+        torch.manual_seed(seed)
+        records.append(dict(benchmark='generate_batch', model=model_type, params=num_params, batch_size=batch_size,
+                            **measure(run_batch, repeats)))
+    return records
+
+
+def bench_speculative(graph, checkpoints: Dict[str, str], model_type: str, draft_type: str, repeats: int,
+                      max_length: int, num_draft: int, device: str, seed: int) -> List[Dict]:
+    """
+    generate_speculative with a draft_type draft model against generate_batch, one trajectory at a
+    time. Random models only agree as far as the adjacency mask leaves them few successors to choose
+    from, so the acceptance rate says more about the road network than about the draft model.
+    """
+    adj_matrix = graph.build_adjacency(sparse=get_base_config().model.sparse_adjacency, device=device)
+    models = {}
+    for name in {model_type, draft_type}:
+        models[name] = GPT(model_config_for(name, graph.num_nodes + 1), adj_matrix=adj_matrix)
+        models[name].load_state_dict(torch.load(checkpoints[name], map_location=device, weights_only=True))
+        models[name].to(device)
+        models[name].eval()
+    model, draft = models[model_type], models[draft_type]
+    eos = graph.num_nodes
+    rng = np.random.default_rng(seed)
+
+    def context():
+        return torch.tensor([[eos, int(rng.integers(graph.num_nodes))]], dtype=torch.long, device=device)
+
+    def run_batch():
+        return len(model.generate_batch(context(), end_token=None, temperature=1.0, do_sample=True,
+                                        max_token=max_length)[0]) - 2
+
+    def run_speculative():
+        return len(model.generate_speculative(context(), draft, num_draft=num_draft, end_token=None, temperature=1.0,
+                                              do_sample=True, max_token=max_length)[0]) - 2
+
+    torch.manual_seed(seed)
+    baseline = measure(run_batch, repeats)
+    profiler = GenerationProfiler(model, layer_hooks=False).attach()
+    torch.manual_seed(seed)
+    speculative = measure(run_speculative, repeats)
+    profiler.detach()
+    # the speedup is over generate_batch of the same trajectories, batch_size 1 of bench_generation
+    return [dict(benchmark='generate_speculative', model=model_type, draft=draft_type, num_draft=num_draft,
+                 batch_size=1, **speculative, acceptance_rate=profiler.stats.acceptance_rate,
+                 speedup=baseline['seconds_median'] / speculative['seconds_median'])]
+
+
+def bench_quantization(graph, checkpoint: str, model_type: str, walks: List[List[int]], batch_size: int, repeats: int,
+                       max_length: int, seed: int) -> List[Dict]:
+    """
+    int8 against fp32 on the CPU: next-segment KL and top-1 agreement along walks (see
+    benchmarks.quantization) and generate_batch time at batch_size.
+    """
+    model = GPT(model_config_for(model_type, graph.num_nodes + 1),
+                adj_matrix=graph.build_adjacency(sparse=get_base_config().model.sparse_adjacency))
+    model.load_state_dict(torch.load(checkpoint, map_location='cpu', weights_only=True))
+    model.eval()
+    quantized = quantize_model(copy.deepcopy(model))
+    accuracy = quantization_accuracy(model, quantized, graph, walks)
+    eos = graph.num_nodes
+    rng = np.random.default_rng(seed)
+
+    def timed(m):
+        def run():
+            origins = rng.integers(graph.num_nodes, size=batch_size)
+            x = torch.tensor([[eos, origin] for origin in origins], dtype=torch.long)
+            ys = m.generate_batch(x, end_token=None, temperature=1.0, do_sample=True, max_token=max_length)
+            return sum(len(y) - 2 for y in ys)
+        torch.manual_seed(seed)
+        return measure(run, repeats)
+
+    fp32 = timed(model)
+    int8 = timed(quantized)
+    return [dict(benchmark='generate_batch_int8', model=model_type, batch_size=batch_size, **int8, **accuracy,
+                 speedup=fp32['seconds_median'] / int8['seconds_median'])]
+
+
+def bench_segment_length(dataset: str, checkpoint: str, walks: List[List[int]], repeats: int) -> List[Dict]:
+    """MobilityInference.get_segment_length, one call per trajectory, and the batched get_segment_lengths."""
+    inference = MobilityInference(model_path=checkpoint, dataset=dataset)
+    per_call = measure(lambda: [inference.get_segment_length(walk) for walk in walks], repeats)
+    return [
+        dict(benchmark='get_segment_length', trajectories=len(walks), **per_call,
+             seconds_per_call=per_call['seconds_median'] / len(walks)),
+        dict(benchmark='get_segment_lengths', trajectories=len(walks),
+             **measure(lambda: inference.get_segment_lengths(walks), repeats)),
+    ]
+
+
+def bench_route_quality(dataset: str, walk: List[int], latency: float, repeats: int) -> List[Dict]:
+    """RouteQualityTool.evaluate_route_quality of one trajectory against the local Directions stand-in."""
+    points, counts = load_segment_geometry(dataset)
+    starts = np.cumsum(counts) - counts
+    trajectory = [tuple(point) for point in points[starts[walk]].tolist()]
+    os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'benchmark')
+
+    records = []
+    with DirectionsStub(latency=latency) as stub:
+        tool = RouteQualityTool(directions_cache=DirectionsCache(path=None))
+        tool.directions_client = DirectionsClient(tool.api_key, cache=DirectionsCache(path=None), base_url=stub.url,
+                                                  pool_size=tool.max_concurrent_requests)
+
+        def empty_cache():
+            tool.directions_client.cache = DirectionsCache(path=None)
+
+        for use_waypoints in (False, True):
+            tool.use_waypoints = use_waypoints
+            before = stub.requests
+            cold = measure(lambda: tool.evaluate_route_quality(trajectory), repeats, setup=empty_cache)
+            requests = (stub.requests - before) / (repeats + 1)
+            records.append(dict(benchmark='evaluate_route_quality', cache='cold', waypoints=use_waypoints,
+                                points=len(trajectory), latency=latency, requests=requests, **cold))
+        tool.use_waypoints = False
+        records.append(dict(benchmark='evaluate_route_quality', cache='warm', waypoints=False,
+                            points=len(trajectory), latency=latency,
+                            **measure(lambda: tool.evaluate_route_quality(trajectory), repeats)))
+    return records
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def run(args) -> Dict:
+    model_types = list(get_base_config().model.model_configs) if args.models == ['all'] else args.models
+    records = []
+    cwd = os.getcwd()
+    # the road graph loaders read {dataset}-Taxi/ relative to the working directory
+    os.chdir(args.work_dir)
+    try:
+        for size in args.sizes:
+            dataset = f'GRID{size}'
+            num_segments = generate_road_network(f'{dataset}-Taxi', size, seed=args.seed)
+            print(f"{dataset}: {num_segments} segments", file=sys.stderr)
+            graph_info = dict(graph=dataset, segments=num_segments)
+
+            for record in bench_graph_load(dataset, args.repeats):
+                records.append({**record, **graph_info})
+            graph = load_road_graph(dataset, use_cache=True)
+            # MobilityInference loads the model type of the base config
+            default_model = get_base_config().model.model_type
+            checkpoints = generate_checkpoints(f'checkpoints/{dataset}', graph.num_nodes + 1,
+                                               sorted(set(model_types) | {default_model, args.draft_model}),
+                                               seed=args.seed)
+
+            for model_type in model_types:
+                print(f"{dataset}: generation with {model_type}", file=sys.stderr)
+                for record in bench_generation(graph, checkpoints[model_type], model_type, args.batch_sizes,
+                                               args.repeats, args.max_length, args.device, args.seed):
+                    records.append({**record, **graph_info})
+
+            for model_type in model_types:
+                if model_type == args.draft_model:
+                    continue
+                print(f"{dataset}: speculative generation with {model_type}", file=sys.stderr)
+                for record in bench_speculative(graph, checkpoints, model_type, args.draft_model, args.repeats,
+                                                args.max_length, args.num_draft, args.device, args.seed):
+                    records.append({**record, **graph_info})
+
+            walks = random_walks(graph, args.trajectories, args.max_length - 2, seed=args.seed)
+            for model_type in model_types:
+                print(f"{dataset}: int8 generation with {model_type}", file=sys.stderr)
+                for record in bench_quantization(graph, checkpoints[model_type], model_type, walks[:args.quantization_walks],
+                                                 max(args.batch_sizes), args.repeats, args.max_length, args.seed):
+                    records.append({**record, **graph_info})
+
+            for record in bench_segment_length(dataset, checkpoints[default_model], walks, args.repeats):
+                records.append({**record, **graph_info})
+
+            walk = max(walks, key=len)[:args.route_points]
+            for record in bench_route_quality(dataset, walk, args.directions_latency, args.repeats):
+                records.append({**record, **graph_info})
+    finally:
+        os.chdir(cwd)
+    return {'environment': environment(), 'arguments': vars(args), 'results': records}
+
+
+def main():
+    config = get_base_config()
+    parser = argparse.ArgumentParser(description="Benchmark MobilityGPT and the maps tools on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 50],
+                        help="Grid sizes (intersections per side) of the synthetic road networks")
+    parser.add_argument('--models', nargs='+', default=DEFAULT_MODELS,
+                        help="model_configs entries to benchmark, or 'all'")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--draft-model', default=config.model.draft_model_type,
+                        help="model_configs entry of the draft model of the speculative decoding benchmarks")
+    parser.add_argument('--num-draft', type=int, default=config.model.num_draft_tokens,
+                        help="Tokens the draft model proposes per target forward pass")
+    parser.add_argument('--quantization-walks', type=int, default=64,
+                        help="Random walks along which int8 is compared against fp32")
+    parser.add_argument('--repeats', type=int, default=5, help="Timed runs per measurement")
+    parser.add_argument('--max-length', type=int, default=config.data.max_length)
+    parser.add_argument('--trajectories', type=int, default=1000, help="Trajectories of the length benchmarks")
+    parser.add_argument('--route-points', type=int, default=20, help="Points of the evaluated route")
+    parser.add_argument('--directions-latency', type=float, default=0.02,
+                        help="Seconds the Directions stand-in waits before every response")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--seed', type=int, default=config.system.seed)
+    parser.add_argument('--work-dir', default=None, help="Where the synthetic data is written (default: a temporary directory)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    temporary = args.work_dir is None
+    if temporary:
+        args.work_dir = tempfile.mkdtemp(prefix='mobility-benchmark-')
+    try:
+        report = run(args)
+    finally:
+        if temporary:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(report['results'])} results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
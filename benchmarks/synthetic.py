@@ -0,0 +1,140 @@
+"""
+Synthetic inputs for the benchmarks: road networks in the {dataset}-Taxi/roadmap.geo/.rel format and
+randomly initialized model checkpoints, so that they run without the SF-Taxi data or a trained model.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+from mobilitygpt.config import get_base_config
+from mobilitygpt.model import GPT
+from MobilityAgent.geodesic import haversine
+
+
+def generate_road_network(path: str,
+                          rows: int,
+                          cols: Optional[int] = None,
+                          spacing: float = 0.002,
+                          drop: float = 0.1,
+                          seed: int = 0,
+                          origin: tuple = (37.70, -122.50)) -> int:
+    """
+    Write a jittered grid of streets as roadmap.geo and roadmap.rel into path.
+
+    Every pair of neighbouring intersections is joined by one segment per direction, a fraction drop
+    of the segments is removed at random, and a segment connects to every segment leaving its end
+    intersection except the U-turn back.
+
+    Args:
+        path: Dataset directory, e.g. "GRID-Taxi" to load it as dataset "GRID"
+        rows: Intersections from south to north
+        cols: Intersections from west to east (default: rows)
+        spacing: Distance between neighbouring intersections in degrees
+        drop: Fraction of segments removed
+        seed: Random seed
+        origin: (latitude, longitude) of the south-west corner
+
+    Returns:
+        Number of road segments
+    """
+    cols = cols if cols is not None else rows
+    rng = np.random.default_rng(seed)
+    i, j = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    lat = origin[0] + i.ravel() * spacing + rng.normal(0, spacing / 10, rows * cols)
+    lng = origin[1] + j.ravel() * spacing + rng.normal(0, spacing / 10, rows * cols)
+    node = np.arange(rows * cols).reshape(rows, cols)
+
+    # directed segments between horizontal and vertical neighbours, both ways
+    pairs = np.concatenate((
+        np.stack((node[:, :-1].ravel(), node[:, 1:].ravel()), axis=1),
+        np.stack((node[:-1, :].ravel(), node[1:, :].ravel()), axis=1),
+    ))
+    pairs = np.concatenate((pairs, pairs[:, ::-1]))
+    pairs = pairs[rng.random(len(pairs)) >= drop]
+    start, end = pairs[:, 0], pairs[:, 1]
+    lengths = haversine(lat[start], lng[start], lat[end], lng[end]) * rng.uniform(1.0, 1.3, len(pairs))
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'roadmap.geo'), 'w') as f:
+        f.write('geo_id,type,coordinates,highway,lanes,length\n')
+        for geo_id, (a, b, length) in enumerate(zip(start, end, lengths)):
+            f.write(f'{geo_id},LineString,"[[{lng[a]:.7f}, {lat[a]:.7f}], [{lng[b]:.7f}, {lat[b]:.7f}]]",'
+                    f'primary,2,{length:.3f}\n')
+
+    # successors: segments leaving the end intersection, except the U-turn
+    order = np.argsort(start, kind='stable')
+    indptr = np.searchsorted(start[order], np.arange(rows * cols + 1))
+    counts = indptr[end + 1] - indptr[end]
+    origins = np.repeat(np.arange(len(pairs)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    destinations = order[np.repeat(indptr[end], counts) + offsets]
+    keep = end[destinations] != start[origins]
+    with open(os.path.join(path, 'roadmap.rel'), 'w') as f:
+        f.write('rel_id,type,origin_id,destination_id\n')
+        for rel_id, (a, b) in enumerate(zip(origins[keep], destinations[keep])):
+            f.write(f'{rel_id},geo,{a},{b}\n')
+    return len(pairs)
+
+
+def generate_checkpoints(path: str,
+                         vocab_size: int,
+                         model_types: Optional[List[str]] = None,
+                         seed: int = 0) -> Dict[str, str]:
+    """
+    Save a randomly initialized GPT state dict per entry of config.model.model_configs.
+
+    Args:
+        path: Output directory, one {model_type}.pt per model
+        vocab_size: Number of road segments plus one for the end token
+        model_types: Entries of model_configs to generate (default: all of them)
+        seed: Random seed
+
+    Returns:
+        Checkpoint path of every model type
+    """
+    config = get_base_config()
+    model_types = model_types if model_types is not None else list(config.model.model_configs)
+    os.makedirs(path, exist_ok=True)
+    checkpoints = {}
+    for model_type in model_types:
+        torch.manual_seed(seed)
+        model_config = model_config_for(model_type, vocab_size)
+        checkpoints[model_type] = os.path.join(path, f'{model_type}.pt')
+        torch.save(GPT(model_config).state_dict(), checkpoints[model_type])
+    return checkpoints
+
+
+def model_config_for(model_type: str, vocab_size: int):
+    """config.model for a model_configs entry and a road network of vocab_size - 1 segments."""
+    config = get_base_config()
+    config.model.model_type = model_type
+    config.model.vocab_size = vocab_size
+    config.model.block_size = config.data.block_size
+    return config.model
+
+
+def random_walks(graph, count: int, max_length: int, seed: int = 0) -> List[List[int]]:
+    """
+    Random walks over the segments of a RoadGraph, stopping early at dead ends.
+
+    Returns:
+        count walks as lists of road segment IDs
+    """
+    rng = np.random.default_rng(seed)
+    origins, destinations = graph.token_indices(graph.origins), graph.token_indices(graph.destinations)
+    order = np.argsort(origins, kind='stable')
+    indptr = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(origins, minlength=graph.num_nodes))
+    successors = destinations[order]
+    walks = []
+    for _ in range(count):
+        token = int(rng.integers(graph.num_nodes))
+        walk = [token]
+        while len(walk) < max_length and indptr[token + 1] > indptr[token]:
+            token = int(successors[rng.integers(indptr[token], indptr[token + 1])])
+            walk.append(token)
+        walks.append(graph.geo_ids[walk].tolist())
+    return walks
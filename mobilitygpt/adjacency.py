@@ -0,0 +1,104 @@
+"""
+Compact road-graph adjacency for the GPT masking paths.
+
+The model only ever needs the successor mask of the tokens it is looking at, so instead of a
+dense (V, V) matrix we keep the graph in CSR form (row offsets plus neighbor indices), whose
+memory grows with the number of edges, and expand just the requested rows on the fly.
+"""
+
+import torch
+
+# -----------------------------------------------------------------------------
+
+class SparseAdjacency:
+    """
+    CSR adjacency matrix that can be indexed like the dense one: adj[rows] returns a dense
+    0/1 mask of shape rows.shape + (num_nodes,), so it can be passed to GPT as adj_matrix.
+    """
+
+    def __init__(self, indptr, indices, num_nodes, dtype=torch.float32):
+        self.indptr = torch.as_tensor(indptr, dtype=torch.long)
+        self.indices = torch.as_tensor(indices, dtype=torch.int32)
+        self.num_nodes = num_nodes
+        self.dtype = dtype
+        assert self.indptr.numel() == num_nodes + 1
+
+    @classmethod
+    def from_edges(cls, origins, destinations, num_nodes=None, add_eos=True, dtype=torch.float32):
+        """
+        Build the CSR arrays from parallel origin/destination index arrays. With add_eos an extra
+        end-of-sequence node is appended that may follow every node and be followed by every
+        node, i.e. the extra row and column of ones the dense adjacency matrix carries.
+        """
+        origins = torch.as_tensor(origins, dtype=torch.long).reshape(-1)
+        destinations = torch.as_tensor(destinations, dtype=torch.long).reshape(-1)
+        if num_nodes is None:
+            num_nodes = int(max(origins.max(), destinations.max())) + 1
+
+        if add_eos:
+            eos = num_nodes
+            nodes = torch.arange(num_nodes + 1)
+            origins = torch.cat((origins, torch.arange(num_nodes), torch.full((num_nodes + 1,), eos)))
+            destinations = torch.cat((destinations, torch.full((num_nodes,), eos), nodes))
+            num_nodes += 1
+
+        # drop duplicate edges and sort by (origin, destination)
+        keys = torch.unique(origins * num_nodes + destinations)
+        origins, destinations = keys // num_nodes, keys % num_nodes
+        counts = torch.bincount(origins, minlength=num_nodes)
+        indptr = torch.zeros(num_nodes + 1, dtype=torch.long)
+        indptr[1:] = torch.cumsum(counts, dim=0)
+        return cls(indptr, destinations, num_nodes, dtype=dtype)
+
+    @classmethod
+    def from_dense(cls, matrix, dtype=torch.float32):
+        origins, destinations = torch.as_tensor(matrix).nonzero(as_tuple=True)
+        return cls.from_edges(origins, destinations, num_nodes=matrix.shape[0], add_eos=False, dtype=dtype)
+
+    @property
+    def shape(self):
+        return (self.num_nodes, self.num_nodes)
+
+    @property
+    def device(self):
+        return self.indptr.device
+
+    @property
+    def nnz(self):
+        return self.indices.numel()
+
+    @property
+    def nbytes(self):
+        return self.indptr.element_size() * self.indptr.numel() + self.indices.element_size() * self.indices.numel()
+
+    def to(self, device):
+        return SparseAdjacency(self.indptr.to(device), self.indices.to(device), self.num_nodes, dtype=self.dtype)
+
+    def successors(self, node):
+        """ neighbor indices of a single node """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]].long()
+
+    def degrees(self):
+        return self.indptr[1:] - self.indptr[:-1]
+
+    def __getitem__(self, rows):
+        rows = torch.as_tensor(rows, dtype=torch.long, device=self.device)
+        flat = rows.reshape(-1)
+        starts = self.indptr[flat]
+        counts = self.indptr[flat + 1] - starts
+
+        # position of every requested neighbor in self.indices, and the output row it belongs to
+        out_rows = torch.repeat_interleave(torch.arange(flat.numel(), device=self.device), counts)
+        row_offsets = torch.cumsum(counts, dim=0) - counts
+        positions = torch.arange(out_rows.numel(), device=self.device) \
+            - torch.repeat_interleave(row_offsets, counts) + torch.repeat_interleave(starts, counts)
+
+        mask = torch.zeros(flat.numel(), self.num_nodes, dtype=self.dtype, device=self.device)
+        mask[out_rows, self.indices[positions].long()] = 1
+        return mask.reshape(*rows.shape, self.num_nodes)
+
+    def to_dense(self):
+        return self[torch.arange(self.num_nodes, device=self.device)]
+
+    def __repr__(self):
+        return f"SparseAdjacency(num_nodes={self.num_nodes}, nnz={self.nnz})"
@@ -11,6 +11,51 @@ def get_base_config():
     C.system.device = 'cuda' if torch.cuda.is_available() else 'cpu'
     C.system.work_dir = None  # Will be set based on dataset
     
+    # Local inference server (dynamic request batching)
+    C.server = CN()
+    C.server.host = '127.0.0.1'
+    C.server.port = 8765
+    C.server.max_batch_size = 256  # Maximum number of trajectories decoded in one batch
+    C.server.max_wait_ms = 10.0  # How long the first request of a batch waits for others to join
+    
+    # Google Maps Directions access shared by the tools
+    C.maps = CN()
+    C.maps.directions_url = 'https://maps.googleapis.com/maps/api/directions/json'
+    C.maps.geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
+    C.maps.request_timeout = 10.0  # Seconds per Directions request
+    C.maps.max_retries = 3  # Retries of failed or rate-limited requests
+    C.maps.retry_backoff = 0.5  # Seconds before the first retry, doubled on every further retry
+    C.maps.max_concurrent_requests = 8  # Directions requests in flight at once (and pooled connections)
+    C.maps.use_waypoints = False  # Pack trajectories into multi-leg requests (the API returns no traffic for those, the traffic impact is then N/A)
+    C.maps.max_waypoints = 23  # Intermediate waypoints per Directions request
+    C.maps.cache_path = '.cache/directions.sqlite'  # SQLite tier of the response cache, None for memory only
+    C.maps.memory_cache_size = 4096  # Entries in the in-memory LRU tier
+    C.maps.traffic_ttl = 300  # Seconds a cached duration_in_traffic stays valid
+    C.maps.static_ttl = 7 * 24 * 3600  # Seconds cached distances/steps/addresses stay valid
+    C.maps.prefetch = False  # Keep the traffic of frequently queried pairs warm in a background thread
+    C.maps.prefetch_interval = 60.0  # Seconds between prefetch cycles
+    C.maps.prefetch_max_pairs = 100  # Number of hot origin/destination pairs kept warm
+    C.maps.prefetch_min_hits = 2  # Queries (halved every cycle) before a pair is prefetched
+    C.maps.stale_ttl = 900  # With prefetching, expired traffic up to this age is served while it is refreshed
+    
+    # Offline routing over the road graph, a network-free stand-in for the Directions API
+    C.routing = CN()
+    C.routing.backend = 'google'  # 'google' for the Directions API, 'offline' for the road graph router
+    C.routing.algorithm = 'astar'  # 'dijkstra', 'astar' or 'ch' (contraction hierarchy, built on first query)
+    C.routing.speed_kmh = 30.0  # Constant travel speed of offline durations
+    C.routing.hierarchy_path = None  # .npz cache of the contraction hierarchy (rebuild it when the graph changes)
+    
+    # Profiling of model forward passes and generation (disabled: no hooks and no timers)
+    C.profiling = CN()
+    C.profiling.enabled = False
+    C.profiling.layer_hooks = True  # Time every transformer block and lm_head through forward hooks
+    C.profiling.trace_dir = None  # Directory for a torch.profiler trace of every generation call
+    
+    # Batch runs of the crew over many locations (main.py batch)
+    C.batch = CN()
+    C.batch.concurrency = 4  # Crews running at once, all sharing one set of tools (model, graph, caches)
+    C.batch.num_trajectories = 3  # Trajectories generated per location
+    
     # Policy (PPO) settings
     C.policy = CN()
     C.policy.seq_length = 81
@@ -35,6 +80,8 @@ def get_base_config():
     C.data.block_size = 81
     C.data.max_length = 81
     C.data.random_trajs = False
+    C.data.graph_cache = True  # Load the road graph from a compiled artifact instead of re-parsing the CSVs
+    C.data.spatial_cell_size = 100.0  # Grid cell size in meters of the segment spatial index
     
     # Model
     C.model = CN()
@@ -42,6 +89,7 @@ def get_base_config():
     C.model.use_lora = False  
     C.model.load_path = None
     C.model.use_adjacency = True  # Use adjacency matrix by default
+    C.model.sparse_adjacency = True  # Keep the adjacency in CSR form instead of a dense VxV matrix
     C.model.vocab_size = None  # Will be set based on dataset
     C.model.block_size = None  # Will be set based on dataset
     C.model.n_layer = None
@@ -51,6 +99,12 @@ def get_base_config():
     C.model.resid_pdrop = 0.1
     C.model.attn_pdrop = 0.1
     C.model.bias = False
+    C.model.attn_backend = 'sdpa'  # 'sdpa' for fused scaled_dot_product_attention, 'explicit' for the reference path
+    C.model.quantization = None  # 'int8' for dynamic int8 CPU inference (LoRA merged into the weights)
+    C.model.inference_backend = 'eager'  # 'eager', 'compile' (torch.compile'd decode step), or an exported 'torchscript'/'onnx' artifact
+    C.model.draft_path = None  # Checkpoint of a small draft model for speculative decoding, None to decode without
+    C.model.draft_model_type = 'gpt-nano'  # model_configs entry of the draft model
+    C.model.num_draft_tokens = 4  # Tokens the draft model proposes per forward pass of the target model
     # LoRA parameters
     C.model.lora_rank = 8
     C.model.lora_alpha = 16.0
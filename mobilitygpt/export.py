@@ -0,0 +1,176 @@
+"""
+Export of the GPT decode step as a self-contained inference artifact.
+
+The exported graph covers one incremental decoding step: the embedding of a single new token, all
+transformer blocks attending over the kv cache, and lm_head. It is written either as TorchScript
+or as ONNX, together with a meta.json describing the model shape, and can be executed without the
+GPT class by ExportedGPT, which keeps the adjacency masking and sampling loop in Python.
+"""
+
+import os
+import json
+import math
+
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from mobilitygpt.model import GPT
+
+# -----------------------------------------------------------------------------
+
+class DecodeStep(nn.Module):
+    """
+    forward(idx, pos, k_0, v_0, ..., k_{L-1}, v_{L-1}) -> (logits, k_0', v_0', ...)
+
+    idx: (B, 1) token of every row, pos: (1, 1) its position, k_i/v_i: (B, nh, T_past, hs) cache
+    of layer i. The outputs are the unmasked next-token logits (B, vocab_size) and the caches with
+    the new token appended. Written without data-dependent control flow so that it traces cleanly.
+    """
+
+    def __init__(self, model: GPT):
+        super().__init__()
+        self.transformer = model.transformer
+        self.lm_head = model.lm_head
+        self.n_head = model.config.n_head
+        self.n_embd = model.config.n_embd
+
+    def forward(self, idx, pos, *past):
+        B = idx.size(0)
+        hs = self.n_embd // self.n_head
+        x = self.transformer.wte(idx) + self.transformer.wpe(pos) # (B, 1, n_embd)
+        present = []
+        for i, block in enumerate(self.transformer.h):
+            attn = block.attn
+            q, k, v = attn.c_attn(block.ln_1(x)).split(self.n_embd, dim=2)
+            q = q.view(B, 1, self.n_head, hs).transpose(1, 2) # (B, nh, 1, hs)
+            k = torch.cat((past[2 * i], k.view(B, 1, self.n_head, hs).transpose(1, 2)), dim=2)
+            v = torch.cat((past[2 * i + 1], v.view(B, 1, self.n_head, hs).transpose(1, 2)), dim=2)
+            # a single query may attend to the whole cache, so no causal mask is needed
+            att = F.softmax((q @ k.transpose(-2, -1)) * (1.0 / math.sqrt(hs)), dim=-1)
+            y = (att @ v).transpose(1, 2).reshape(B, 1, self.n_embd)
+            x = x + attn.c_proj(y)
+            x = x + block.mlpf(block.ln_2(x))
+            present += [k, v]
+        logits = self.lm_head(self.transformer.ln_f(x))[:, -1, :]
+        return (logits, *present)
+
+def export_decode_step(model: GPT, path: str, format: str = 'torchscript') -> str:
+    """
+    Write the decode step of model to the directory path as 'torchscript' (decode_step.pt) or
+    'onnx' (decode_step.onnx, requires the onnx package), plus meta.json.
+    """
+    assert format in ('torchscript', 'onnx'), f"unknown export format {format}"
+    config = model.config
+    step = DecodeStep(model).to('cpu').eval()
+    os.makedirs(path, exist_ok=True)
+
+    # example inputs with a non-empty cache and batch > 1, both are dynamic in the exported graph
+    B, T_past, hs = 2, 3, config.n_embd // config.n_head
+    idx = torch.zeros((B, 1), dtype=torch.long)
+    pos = torch.full((1, 1), T_past, dtype=torch.long)
+    past = tuple(torch.zeros(B, config.n_head, T_past, hs) for _ in range(2 * config.n_layer))
+
+    with torch.no_grad():
+        if format == 'torchscript':
+            filename = 'decode_step.pt'
+            traced = torch.jit.trace(step, (idx, pos, *past))
+            torch.jit.save(traced, os.path.join(path, filename))
+        else:
+            filename = 'decode_step.onnx'
+            past_names = [f'{kv}_{i}' for i in range(config.n_layer) for kv in ('k', 'v')]
+            dynamic_axes = {'idx': {0: 'batch'}, 'logits': {0: 'batch'}}
+            for name in past_names:
+                dynamic_axes[f'past_{name}'] = {0: 'batch', 2: 'past'}
+                dynamic_axes[f'present_{name}'] = {0: 'batch', 2: 'present'}
+            torch.onnx.export(
+                step, (idx, pos, *past), os.path.join(path, filename),
+                input_names=['idx', 'pos'] + [f'past_{name}' for name in past_names],
+                output_names=['logits'] + [f'present_{name}' for name in past_names],
+                dynamic_axes=dynamic_axes,
+                dynamo=False,
+            )
+
+    meta = dict(
+        format=format,
+        filename=filename,
+        vocab_size=config.vocab_size,
+        block_size=config.block_size,
+        n_layer=config.n_layer,
+        n_head=config.n_head,
+        n_embd=config.n_embd,
+    )
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    return path
+
+class ExportedGPT:
+    """
+    Runs an exported decode step (TorchScript, or ONNX through onnxruntime) on the CPU, with the
+    same generate_batch interface as GPT. Only the kv-cached decoding path is available.
+    """
+
+    def __init__(self, path: str, adj_matrix=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.block_size = self.meta['block_size']
+        self.adj_matrix = adj_matrix
+        self.profiler = None
+        self.format = self.meta['format']
+        if self.format == 'torchscript':
+            self.step = torch.jit.load(os.path.join(path, self.meta['filename']), map_location='cpu')
+        else:
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(os.path.join(path, self.meta['filename']),
+                                                        providers=['CPUExecutionProvider'])
+
+    def _run_step(self, idx, pos, past):
+        if self.format == 'torchscript':
+            return self.step(idx, pos, *past)
+        inputs = {'idx': idx.numpy(), 'pos': pos.numpy()}
+        for i in range(self.meta['n_layer']):
+            inputs[f'past_k_{i}'] = past[2 * i].numpy()
+            inputs[f'past_v_{i}'] = past[2 * i + 1].numpy()
+        return [torch.from_numpy(out) for out in self.session.run(None, inputs)]
+
+    @torch.no_grad()
+    def decode_step(self, idx, past_key_values=None):
+        """ Same contract as GPT.decode_step; a multi-token idx (the prompt) is fed one token at a time. """
+        b, t = idx.size()
+        if past_key_values is None:
+            hs = self.meta['n_embd'] // self.meta['n_head']
+            empty = torch.zeros(b, self.meta['n_head'], 0, hs)
+            past = [empty] * (2 * self.meta['n_layer'])
+        else:
+            past = [kv for layer in past_key_values for kv in layer]
+        t_past = past[0].size(2)
+        assert t_past + t <= self.block_size, f"Cannot forward sequence of length {t_past + t}, block size is only {self.block_size}"
+
+        logits = []
+        for i in range(t):
+            pos = torch.full((1, 1), t_past + i, dtype=torch.long)
+            logits_i, *past = self._run_step(idx[:, i:i+1].contiguous(), pos, past)
+            logits.append(logits_i)
+        logits = torch.stack(logits, dim=1)
+
+        # crop the logits based on the adjacency matrix
+        if self.adj_matrix is not None:
+            with self._mask_timer():
+                c_token_adj = self.adj_matrix[idx.reshape(-1,1)].reshape(idx.shape[0], idx.shape[1], -1)
+                logits = logits*c_token_adj
+
+        presents = [(past[2 * i], past[2 * i + 1]) for i in range(self.meta['n_layer'])]
+        return logits, presents
+
+    _mask_timer = GPT._mask_timer
+
+    def set_adapter(self, adapter):
+        assert adapter is None, "LoRA adapters are not available on an exported model"
+
+    def generate_batch(self, idx, *args, use_cache=True, **kwargs):
+        """ see GPT.generate_batch """
+        return GPT.generate_batch(self, idx, *args, use_cache=True, **kwargs)
+
+    def generate_batch_stream(self, idx, *args, use_cache=True, **kwargs):
+        """ see GPT.generate_batch_stream """
+        return GPT.generate_batch_stream(self, idx, *args, use_cache=True, **kwargs)
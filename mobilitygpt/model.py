@@ -9,6 +9,7 @@ https://github.com/huggingface/transformers/blob/main/src/transformers/models/gp
 """
 
 import math
+from contextlib import nullcontext
 
 import torch
 import torch.nn as nn
@@ -16,6 +17,9 @@ from torch.nn import functional as F
 
 from mobilitygpt.config_utils import CfgNode as CN
 
+# stands in for the profiler's timers when no profiler is attached
+_NOT_PROFILED = nullcontext()
+
 # -----------------------------------------------------------------------------
 
 class LoRALinear(nn.Linear):
@@ -43,6 +47,10 @@ class LoRALinear(nn.Linear):
 
         # LoRA stuff
         self.has_weights_merged = False
+        # named adapters served on top of the (possibly merged) weights, see GPT.load_adapter;
+        # kept out of the state_dict so the base checkpoint is unaffected
+        self.adapters = {}
+        self.active_adapters = None
         if lora_rank > 0:
             self.lora_dropout = nn.Dropout(lora_dropout)
 
@@ -75,6 +83,19 @@ class LoRALinear(nn.Linear):
                 ),
                 self.lora_B
             )
+        if self.active_adapters:
+            x = self._apply_adapters(input, x)
+        return x
+
+    def _apply_adapters(self, input: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        # active_adapters is a list of (name, rows) with rows=None meaning the whole batch
+        for name, rows in self.active_adapters:
+            lora_A, lora_B, scaling = self.adapters[name]
+            if rows is None:
+                x = x + scaling * F.linear(F.linear(input, lora_A), lora_B)
+            else:
+                delta = scaling * F.linear(F.linear(input[rows], lora_A), lora_B)
+                x = x.index_add(0, rows, delta)
         return x
 
     def extra_repr(self) -> str:
@@ -188,8 +209,16 @@ class CausalSelfAttention(nn.Module):
                                      .view(1, 1, config.block_size, config.block_size))
         self.n_head = config.n_head
         self.n_embd = config.n_embd
+        # 'explicit' materializes the attention matrix below, 'sdpa' uses PyTorch's fused kernel
+        assert config.attn_backend in ('explicit', 'sdpa'), f"unknown attention backend {config.attn_backend}"
+        self.attn_backend = config.attn_backend
 
-    def forward(self, x):
+    def forward(self, x, layer_past=None, use_cache=False):
+        """
+        If use_cache is set, also return the (k, v) pair of this layer so that the next decoding
+        step only has to process the newly sampled tokens. layer_past is the (k, v) pair returned
+        by the previous step, each of shape (B, nh, T_past, hs).
+        """
         B, T, C = x.size() # batch size, sequence length, embedding dimensionality (n_embd)
 
         # calculate query, key, values for all heads in batch and move head forward to be the batch dim
@@ -198,16 +227,39 @@ class CausalSelfAttention(nn.Module):
         q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
         v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
 
-        # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, T) -> (B, nh, T, T)
-        att = (q @ k.transpose(-2, -1)) * (1.0 / math.sqrt(k.size(-1)))
-        att = att.masked_fill(self.bias[:,:,:T,:T] == 0, float('-inf'))
-        att = F.softmax(att, dim=-1)
-        att = self.attn_dropout(att)
-        y = att @ v # (B, nh, T, T) x (B, nh, T, hs) -> (B, nh, T, hs)
+        # prepend the cached keys and values of the previous steps
+        T_past = 0
+        if layer_past is not None:
+            past_k, past_v = layer_past
+            T_past = past_k.size(2)
+            k = torch.cat((past_k, k), dim=2) # (B, nh, T_past + T, hs)
+            v = torch.cat((past_v, v), dim=2)
+        present = (k, v) if use_cache else None
+
+        if self.attn_backend == 'sdpa':
+            # fused attention; a single new token may attend to everything in the cache, a full
+            # prompt uses the built-in causal mask, and a chunk after a cache needs the offset mask
+            dropout_p = self.attn_dropout.p if self.training else 0.0
+            if T_past == 0:
+                y = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, is_causal=True)
+            elif T == 1:
+                y = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            else:
+                attn_mask = self.bias[:,:,T_past:T_past+T,:T_past+T] != 0
+                y = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+        else:
+            # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, T_past + T) -> (B, nh, T, T_past + T)
+            att = (q @ k.transpose(-2, -1)) * (1.0 / math.sqrt(k.size(-1)))
+            att = att.masked_fill(self.bias[:,:,T_past:T_past+T,:T_past+T] == 0, float('-inf'))
+            att = F.softmax(att, dim=-1)
+            att = self.attn_dropout(att)
+            y = att @ v # (B, nh, T, T_past + T) x (B, nh, T_past + T, hs) -> (B, nh, T, hs)
         y = y.transpose(1, 2).contiguous().view(B, T, C) # re-assemble all head outputs side by side
 
         # output projection
         y = self.resid_dropout(self.c_proj(y))
+        if use_cache:
+            return y, present
         return y
 
 class Block(nn.Module):
@@ -224,10 +276,17 @@ class Block(nn.Module):
             act     = NewGELU(),
             dropout = nn.Dropout(config.resid_pdrop),
         ))
-        m = self.mlp
-        self.mlpf = lambda x: m.dropout(m.c_proj(m.act(m.c_fc(x)))) # MLP forward
 
-    def forward(self, x):
+    def mlpf(self, x):
+        m = self.mlp
+        return m.dropout(m.c_proj(m.act(m.c_fc(x)))) # MLP forward
+
+    def forward(self, x, layer_past=None, use_cache=False):
+        if use_cache:
+            a, present = self.attn(self.ln_1(x), layer_past=layer_past, use_cache=True)
+            x = x + a
+            x = x + self.mlpf(self.ln_2(x))
+            return x, present
         x = x + self.attn(self.ln_1(x))
         x = x + self.mlpf(self.ln_2(x))
         return x
@@ -256,10 +315,14 @@ class GPT(nn.Module):
         C.lora_alpha: float = 0.0
         C.lora_dropout: float = 0.0
         C.bias: bool =  False
+        # attention implementation, 'sdpa' (fused) or 'explicit' (reference)
+        C.attn_backend = 'sdpa'
 
         return C
 
     def __init__(self, config, adj_matrix = None, reward_model=False):
+        # adj_matrix is either a dense (V, V) tensor or a mobilitygpt.adjacency.SparseAdjacency,
+        # both are indexed by token ids to get the successor mask of each token
         super().__init__()
         assert config.vocab_size is not None
         assert config.block_size is not None
@@ -267,6 +330,8 @@ class GPT(nn.Module):
         self.adj_matrix = adj_matrix
         self.config = config
         self.reward_model = reward_model
+        # mobilitygpt.profiling.GenerationProfiler while one is attached
+        self.profiler = None
         
         # Ensure LoRA parameters are set if using LoRA
         if config.use_lora and config.lora_rank == 0:
@@ -300,6 +365,59 @@ class GPT(nn.Module):
         n_params = sum(p.numel() for p in self.transformer.parameters())
         print("number of parameters: %.2fM" % (n_params/1e6,))
 
+    def load_adapter(self, name, adapter, lora_alpha=None):
+        """
+        Register a named LoRA adapter on top of the loaded base weights. adapter is a state_dict
+        (or a path to one) of a LoRA fine-tuned model; only its lora_A/lora_B entries are used.
+        The adapter is not merged, so any number of them can be served from one base model.
+        """
+        if isinstance(adapter, str):
+            adapter = torch.load(adapter, map_location='cpu', weights_only=True)
+        lora_alpha = self.config.lora_alpha if lora_alpha is None else lora_alpha
+        n_loaded = 0
+        for mn, m in self.named_modules():
+            if isinstance(m, LoRALinear) and mn + '.lora_A' in adapter:
+                lora_A = adapter[mn + '.lora_A'].to(device=m.weight.device, dtype=m.weight.dtype)
+                lora_B = adapter[mn + '.lora_B'].to(device=m.weight.device, dtype=m.weight.dtype)
+                m.adapters[name] = (lora_A, lora_B, lora_alpha / lora_A.shape[0])
+                n_loaded += 1
+        if n_loaded == 0:
+            raise ValueError(f"adapter {name} contains no lora_A/lora_B weights for this model")
+
+    def unload_adapter(self, name):
+        for m in self.modules():
+            if isinstance(m, LoRALinear):
+                m.adapters.pop(name, None)
+
+    def list_adapters(self):
+        names = set()
+        for m in self.modules():
+            if isinstance(m, LoRALinear):
+                names.update(m.adapters)
+        return sorted(names)
+
+    def set_adapter(self, adapter):
+        """
+        Select the adapter(s) used by the following forward passes: None for the base model, a
+        name for the whole batch, or a list with one name (or None) per batch row.
+        """
+        if adapter is None:
+            active = None
+        elif isinstance(adapter, str):
+            active = [(adapter, None)]
+        else:
+            device = self.lm_head.weight.device
+            active = []
+            for name in sorted(set(a for a in adapter if a is not None)):
+                rows = torch.tensor([i for i, a in enumerate(adapter) if a == name], dtype=torch.long, device=device)
+                active.append((name, rows))
+        available = self.list_adapters()
+        for name, _ in active or []:
+            assert name in available, f"adapter {name} is not loaded"
+        for m in self.modules():
+            if isinstance(m, LoRALinear):
+                m.active_adapters = active
+
     def _init_weights(self, module):
         if isinstance(module, nn.Linear):
             torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
@@ -420,8 +538,9 @@ class GPT(nn.Module):
 
         # crop the logits based on the adjacency matrix
         if self.adj_matrix is not None:# and not self.reward_model:
-            c_token_adj = self.adj_matrix[idx.reshape(-1,1)].reshape(idx.shape[0], idx.shape[1], -1)
-            logits = logits*c_token_adj
+            with self._mask_timer():
+                c_token_adj = self.adj_matrix[idx.reshape(-1,1)].reshape(idx.shape[0], idx.shape[1], -1)
+                logits = logits*c_token_adj
 
             
         if self.reward_model:
@@ -456,18 +575,68 @@ class GPT(nn.Module):
 
         return logits, x
 
+    def decode_step(self, idx, past_key_values=None):
+        """
+        Incremental forward pass used for decoding. idx (LongTensor of shape (b,t)) holds only the
+        tokens that are not yet in past_key_values, i.e. the whole prompt on the first step and
+        the newly sampled token afterwards. Returns the (masked) logits of idx and the updated
+        per-layer (k, v) cache to pass into the next call.
+        """
+        device = idx.device
+        b, t = idx.size()
+        t_past = 0 if past_key_values is None else past_key_values[0][0].size(2)
+        assert t_past + t <= self.block_size, f"Cannot forward sequence of length {t_past + t}, block size is only {self.block_size}"
+        pos = torch.arange(t_past, t_past + t, dtype=torch.long, device=device).unsqueeze(0) # shape (1, t)
+
+        # forward the GPT model itself
+        tok_emb = self.transformer.wte(idx) # token embeddings of shape (b, t, n_embd)
+        pos_emb = self.transformer.wpe(pos) # position embeddings of shape (1, t, n_embd)
+        x = self.transformer.drop(tok_emb + pos_emb)
+        presents = []
+        for i, block in enumerate(self.transformer.h):
+            layer_past = None if past_key_values is None else past_key_values[i]
+            x, present = block(x, layer_past=layer_past, use_cache=True)
+            presents.append(present)
+        x = self.transformer.ln_f(x)
+        logits = self.lm_head(x)
+
+        # crop the logits based on the adjacency matrix
+        if self.adj_matrix is not None:
+            with self._mask_timer():
+                c_token_adj = self.adj_matrix[idx.reshape(-1,1)].reshape(idx.shape[0], idx.shape[1], -1)
+                logits = logits*c_token_adj
+
+        return logits, presents
+
+    def _mask_timer(self):
+        return self.profiler.mask() if self.profiler is not None else _NOT_PROFILED
+
     @torch.no_grad()
-    def generate_test(self, idx, itos=None, end_token=None, temperature=1.0, do_sample=False, top_k=None, max_token=None):
+    def generate_test(self, idx, itos=None, end_token=None, temperature=1.0, do_sample=False, top_k=None, max_token=None, use_cache=True):
         """
         Take a conditioning sequence of indices idx (LongTensor of shape (b,t)) and complete
         the sequence max_new_tokens times, feeding the predictions back into the model each time.
         Most likely you'll want to make sure to be in model.eval() mode of operation for this.
+        With use_cache the keys/values of the prefix are kept between steps so that only the
+        newly sampled token is forwarded; use_cache=False re-runs the full prefix every step.
         """
+        past_key_values = None
+        idx_cond = idx
+        profiler = self.profiler
         while True:
-            # if the sequence context is growing too long we must crop it at block_size
-            idx_cond = idx if idx.size(1) <= self.block_size else idx[:, -self.block_size:]
-            # forward the model to get the logits for the index in the sequence
-            logits, _ = self(idx_cond)
+            if profiler is not None:
+                step_start = profiler.step_start()
+            if use_cache:
+                # the cache stores absolute positions, so once the context outgrows block_size
+                # it is dropped and rebuilt from the cropped sequence
+                if past_key_values is None:
+                    idx_cond = idx if idx.size(1) <= self.block_size else idx[:, -self.block_size:]
+                logits, past_key_values = self.decode_step(idx_cond, past_key_values)
+            else:
+                # if the sequence context is growing too long we must crop it at block_size
+                idx_cond = idx if idx.size(1) <= self.block_size else idx[:, -self.block_size:]
+                # forward the model to get the logits for the index in the sequence
+                logits, _ = self(idx_cond)
             # pluck the logits at the final step and scale by desired temperature
             logits = logits[:, -1, :] / temperature
             # optionally crop the logits to only the top k options
@@ -477,10 +646,11 @@ class GPT(nn.Module):
 
             # crop the logits based on the adjacency matrix
             if self.adj_matrix is not None:
-                c_token_adj = self.adj_matrix[idx[0][-1].item()]
-                logits=logits*c_token_adj
-                # Ensure that the logits are very large negative numbers to have them zero probability after softmax
-                logits[logits == 0] = -1e9
+                with self._mask_timer():
+                    c_token_adj = self.adj_matrix[idx[:, -1]]
+                    logits=logits*c_token_adj
+                    # Ensure that the logits are very large negative numbers to have them zero probability after softmax
+                    logits[logits == 0] = -1e9
 
             # apply softmax to convert logits to (normalized) probabilities
             probs = F.softmax(logits, dim=-1)
@@ -489,9 +659,244 @@ class GPT(nn.Module):
                 idx_next = torch.multinomial(probs, num_samples=1)
             else:
                 _, idx_next = torch.topk(probs, k=1, dim=-1)
+            if profiler is not None:
+                profiler.record_step(step_start, idx_next.size(0))
             # append sampled index to the running sequence and continue
             if itos[idx_next.item()] == end_token  or idx.shape[1]==max_token:
                 break
 
             idx = torch.cat((idx, idx_next), dim=1)
+            if use_cache:
+                if past_key_values[0][0].size(2) < self.block_size:
+                    idx_cond = idx_next
+                else:
+                    past_key_values = None
         return idx
+
+    @torch.no_grad()
+    def generate_batch(self, idx, end_token=None, temperature=1.0, do_sample=False, top_k=None, max_token=None, use_cache=True, adapter=None,
+                       destination=None, hops_to_destination=None):
+        """
+        Batched counterpart of generate_test. Every row of idx (LongTensor of shape (b,t)) is
+        completed independently: the adjacency mask is taken from each row's own last token, and
+        a row is finished once it samples end_token (a token index) or reaches max_token tokens.
+        Finished rows are dropped from the active batch (and from the kv cache), so the remaining
+        rows keep decoding without wasted work. Returns a list of b LongTensors of shape (t_i,),
+        which, like generate_test, do not include the final end_token.
+        adapter selects a loaded LoRA adapter for the whole batch (a name) or per row (a list).
+        With a destination token and hops_to_destination (LongTensor of shape (vocab_size,), the
+        number of segments each token still needs to reach the destination), successors that can
+        not reach it within the remaining max_token budget are masked out, and a row is finished
+        as soon as it samples the destination, which is kept as the last token of the output.
+        """
+        outputs = [None] * idx.size(0)
+        for row, output in self.generate_batch_stream(idx, end_token=end_token, temperature=temperature, do_sample=do_sample,
+                                                      top_k=top_k, max_token=max_token, use_cache=use_cache, adapter=adapter,
+                                                      destination=destination, hops_to_destination=hops_to_destination):
+            outputs[row] = output
+        return outputs
+
+    @torch.no_grad()
+    def generate_batch_stream(self, idx, end_token=None, temperature=1.0, do_sample=False, top_k=None, max_token=None, use_cache=True,
+                              adapter=None, destination=None, hops_to_destination=None):
+        """
+        Generator form of generate_batch: yields (row, LongTensor of shape (t_i,)) as soon as a row
+        of idx is finished, so the rows come in the order they finish rather than the input order.
+        Closing the generator early (e.g. after the first k rows) stops decoding the rest.
+        """
+        assert hops_to_destination is None or (destination is not None and max_token is not None)
+        active = torch.arange(idx.size(0), device=idx.device) # row of each active sequence in the input batch
+        per_row_adapter = adapter is not None and not isinstance(adapter, str)
+        profiler = self.profiler
+        try:
+            past_key_values = None
+            idx_cond = idx
+            while True:
+                # selected every step, other generations may run between two rows of this one
+                if adapter is not None:
+                    self.set_adapter(adapter)
+                if profiler is not None:
+                    step_start = profiler.step_start()
+                if use_cache:
+                    if past_key_values is None:
+                        idx_cond = idx if idx.size(1) <= self.block_size else idx[:, -self.block_size:]
+                    logits, past_key_values = self.decode_step(idx_cond, past_key_values)
+                else:
+                    idx_cond = idx if idx.size(1) <= self.block_size else idx[:, -self.block_size:]
+                    logits, _ = self(idx_cond)
+                # pluck the logits at the final step and scale by desired temperature
+                logits = logits[:, -1, :] / temperature
+                # optionally crop the logits to only the top k options
+                if top_k is not None:
+                    v, _ = torch.topk(logits, top_k)
+                    logits[logits < v[:, [-1]]] = -float('Inf')
+
+                # crop the logits based on the adjacency matrix of every row's current segment
+                if self.adj_matrix is not None:
+                    with self._mask_timer():
+                        c_token_adj = self.adj_matrix[idx[:, -1]]
+                        logits = logits*c_token_adj
+                        logits[logits == 0] = -1e9
+
+                # prune successors that can no longer reach the destination: after appending the next
+                # token there are max_token - (t + 1) positions left
+                if hops_to_destination is not None:
+                    budget = max_token - idx.size(1) - 1
+                    logits = logits.masked_fill(hops_to_destination[None, :] > budget, -float('Inf'))
+
+                probs = F.softmax(logits, dim=-1)
+                if do_sample:
+                    idx_next = torch.multinomial(probs, num_samples=1)
+                else:
+                    _, idx_next = torch.topk(probs, k=1, dim=-1)
+                if profiler is not None:
+                    profiler.record_step(step_start, idx_next.size(0))
+
+                # rows that sampled the end token or hit the length limit are finished
+                done = torch.zeros(idx.size(0), dtype=torch.bool, device=idx.device)
+                if end_token is not None:
+                    done |= idx_next[:, 0] == end_token
+                if max_token is not None and idx.size(1) >= max_token:
+                    done[:] = True
+                for row in done.nonzero().flatten().tolist():
+                    yield active[row].item(), idx[row]
+                # rows that arrived at the destination are finished including it
+                if destination is not None:
+                    arrived = (idx_next[:, 0] == destination) & ~done
+                    for row in arrived.nonzero().flatten().tolist():
+                        yield active[row].item(), torch.cat((idx[row], idx_next[row]))
+                    done |= arrived
+                if done.all():
+                    break
+
+                keep = ~done
+                active = active[keep]
+                if per_row_adapter:
+                    adapter = [adapter[i] for i in keep.nonzero().flatten().tolist()]
+                idx_next = idx_next[keep]
+                idx = torch.cat((idx[keep], idx_next), dim=1)
+                if use_cache:
+                    if past_key_values[0][0].size(2) < self.block_size:
+                        past_key_values = [(k[keep], v[keep]) for k, v in past_key_values]
+                        idx_cond = idx_next
+                    else:
+                        past_key_values = None
+        finally:
+            # also runs when the caller closes the generator early
+            if adapter is not None:
+                self.set_adapter(None)
+
+    def _next_token_probs(self, logits, prev, temperature=1.0, do_sample=False, top_k=None):
+        """
+        Distribution of the next token as generate_batch samples it: logits (..., V) predicted after
+        the tokens prev (...) are scaled, top-k cropped and masked to the successors of prev. Without
+        do_sample it is the one-hot distribution of the most likely token.
+        """
+        logits = logits / temperature
+        if top_k is not None:
+            v, _ = torch.topk(logits, top_k)
+            logits[logits < v[..., [-1]]] = -float('Inf')
+        if self.adj_matrix is not None:
+            with self._mask_timer():
+                logits = logits*self.adj_matrix[prev]
+                logits[logits == 0] = -1e9
+        probs = F.softmax(logits, dim=-1)
+        if not do_sample:
+            probs = F.one_hot(probs.argmax(dim=-1), probs.size(-1)).to(probs.dtype)
+        return probs
+
+    @torch.no_grad()
+    def generate_speculative(self, idx, draft_model, num_draft=4, end_token=None, temperature=1.0, do_sample=False,
+                             top_k=None, max_token=None):
+        """ generate_batch with speculative decoding, see generate_speculative_stream """
+        outputs = [None] * idx.size(0)
+        for row, output in self.generate_speculative_stream(idx, draft_model, num_draft=num_draft, end_token=end_token,
+                                                            temperature=temperature, do_sample=do_sample, top_k=top_k,
+                                                            max_token=max_token):
+            outputs[row] = output
+        return outputs
+
+    @torch.no_grad()
+    def generate_speculative_stream(self, idx, draft_model, num_draft=4, end_token=None, temperature=1.0,
+                                    do_sample=False, top_k=None, max_token=None):
+        """
+        Speculative form of generate_batch_stream: every round, the (small) draft_model proposes up
+        to num_draft tokens per row one by one, and this model scores all of them in a single kv
+        cached forward pass. Both distributions are masked to the successors of the preceding
+        token, so drafts are always valid road segments. Draft i is accepted with probability
+        min(1, p_i / q_i) (target over draft probability); at the first rejection a token is
+        sampled from the normalized residual max(p - q, 0), and when all drafts are accepted a
+        bonus token from the target. Every emitted token is thus distributed exactly as in
+        generate_batch, whatever the draft model. The rows of a batch share one kv cache length,
+        so each round keeps the drafts up to the first rejection of any row: the fewer rows, the
+        more tokens per target forward pass. Whole trajectories stay in the kv cache, so max_token
+        must not exceed the block size of either model.
+        """
+        assert max_token is not None and max_token <= min(self.block_size, draft_model.block_size)
+        active = torch.arange(idx.size(0), device=idx.device) # row of each active sequence in the input batch
+        target_past, draft_past = None, None
+        profiler = self.profiler
+        while True:
+            if profiler is not None:
+                step_start = profiler.step_start()
+            b, t = idx.size()
+            k = min(num_draft, max_token - t)
+            if k <= 0:
+                for row in range(b):
+                    yield active[row].item(), idx[row]
+                return
+
+            # draft k tokens one at a time, feeding the draft model whatever its cache is missing
+            drafts, draft_probs = [], []
+            draft_input = idx if draft_past is None else idx[:, draft_past[0][0].size(2):]
+            prev = idx[:, -1]
+            for _ in range(k):
+                logits, draft_past = draft_model.decode_step(draft_input, draft_past)
+                q = draft_model._next_token_probs(logits[:, -1, :], prev, temperature, do_sample, top_k)
+                draft_input = torch.multinomial(q, num_samples=1) if do_sample else q.argmax(dim=-1, keepdim=True)
+                prev = draft_input[:, 0]
+                drafts.append(draft_input)
+                draft_probs.append(q)
+            drafts = torch.cat(drafts, dim=1) # (b, k)
+            q = torch.stack(draft_probs, dim=1) # (b, k, V)
+
+            # score the drafts and the bonus position with one forward pass of the target
+            target_input = torch.cat((idx if target_past is None else idx[:, target_past[0][0].size(2):], drafts), dim=1)
+            logits, target_past = self.decode_step(target_input, target_past)
+            prev = torch.cat((idx[:, -1:], drafts), dim=1)
+            p = self._next_token_probs(logits[:, -(k + 1):, :], prev, temperature, do_sample, top_k) # (b, k+1, V)
+
+            # accept draft i with probability min(1, p_i / q_i), up to the first rejection of each row
+            p_draft = p[:, :k].gather(2, drafts[..., None])[..., 0]
+            q_draft = q.gather(2, drafts[..., None])[..., 0]
+            accepted = (torch.rand_like(p_draft) * q_draft < p_draft).long().cumprod(dim=1).sum(dim=1)
+            m = int(accepted.min())
+            if m < k:
+                # rows that accepted draft m keep it, the others sample the residual distribution
+                residual = (p[:, m] - q[:, m]).clamp(min=0)
+                residual = torch.where(residual.sum(dim=-1, keepdim=True) > 0, residual, p[:, m])
+                resampled = torch.multinomial(residual, num_samples=1) if do_sample else p[:, m].argmax(dim=-1, keepdim=True)
+                next_token = torch.where((accepted > m)[:, None], drafts[:, m:m + 1], resampled)
+            else:
+                next_token = torch.multinomial(p[:, k], num_samples=1) if do_sample else p[:, k].argmax(dim=-1, keepdim=True)
+            new = torch.cat((drafts[:, :m], next_token), dim=1)[:, :max_token - t]
+            n = new.size(1)
+            if profiler is not None:
+                profiler.record_step(step_start, b * n)
+                profiler.record_speculation(b * k, int(accepted.sum()))
+
+            # a row is finished at its first end token (which is not part of the output) or at max_token tokens
+            ends = new == end_token if end_token is not None else torch.zeros_like(new, dtype=torch.bool)
+            first_end = torch.where(ends.any(dim=1), ends.long().argmax(dim=1), n)
+            done = ends.any(dim=1) | (t + n >= max_token)
+            for row in done.nonzero().flatten().tolist():
+                yield active[row].item(), torch.cat((idx[row], new[row, :first_end[row]]))
+            if done.all():
+                return
+
+            # both caches keep the tokens before the last one, which is fed in the next round
+            keep = ~done
+            active = active[keep]
+            idx = torch.cat((idx[keep], new[keep]), dim=1)
+            target_past = [(k_[keep, :, :t + n - 1], v_[keep, :, :t + n - 1]) for k_, v_ in target_past]
+            draft_past = [(k_[keep, :, :t + n - 1], v_[keep, :, :t + n - 1]) for k_, v_ in draft_past]
@@ -0,0 +1,195 @@
+"""
+Opt-in instrumentation of the GPT forward pass and of trajectory generation.
+
+A GenerationProfiler attached to a model records the latency of every decode step, the number of
+sampled tokens, the time spent in every transformer block (through forward hooks), the cost of the
+adjacency masking and the peak memory into a GenerationStats. The model only keeps a reference to
+the profiler while it is attached: detached, no hooks are registered and the decoding loops skip
+all timing.
+"""
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# -----------------------------------------------------------------------------
+
+class GenerationStats:
+    """ Counters collected by a GenerationProfiler, times in seconds and memory in bytes. """
+
+    def __init__(self):
+        self.step_times = []
+        self.tokens = 0
+        self.layer_times = defaultdict(float)
+        self.layer_calls = defaultdict(int)
+        self.mask_time = 0.0
+        self.mask_calls = 0
+        self.draft_tokens = 0
+        self.accepted_draft_tokens = 0
+        self.peak_memory = 0
+
+    @property
+    def steps(self):
+        return len(self.step_times)
+
+    @property
+    def decode_time(self):
+        return sum(self.step_times)
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.decode_time if self.step_times else 0.0
+
+    @property
+    def acceptance_rate(self):
+        """ Fraction of the speculative draft tokens the target model accepted. """
+        return self.accepted_draft_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    def step_percentile(self, q):
+        """ Decode step latency at percentile q (0-100). """
+        if not self.step_times:
+            return 0.0
+        times = sorted(self.step_times)
+        return times[min(len(times) - 1, int(round(q / 100 * (len(times) - 1))))]
+
+    def as_dict(self):
+        return dict(
+            steps=self.steps,
+            tokens=self.tokens,
+            decode_time=self.decode_time,
+            tokens_per_second=self.tokens_per_second,
+            step_p50=self.step_percentile(50),
+            step_p95=self.step_percentile(95),
+            step_max=max(self.step_times, default=0.0),
+            layer_times=dict(self.layer_times),
+            layer_calls=dict(self.layer_calls),
+            mask_time=self.mask_time,
+            mask_calls=self.mask_calls,
+            draft_tokens=self.draft_tokens,
+            acceptance_rate=self.acceptance_rate,
+            peak_memory=self.peak_memory,
+        )
+
+    def report(self):
+        """ Format the stats as a table. """
+        lines = [f"Generation: {self.steps} decode steps, {self.tokens} tokens, {self.tokens_per_second:.1f} tokens/s"]
+        lines.append(f"  {'step p50':<12} {self.step_percentile(50) * 1000:9.3f} ms")
+        lines.append(f"  {'step p95':<12} {self.step_percentile(95) * 1000:9.3f} ms")
+        for name, seconds in self.layer_times.items():
+            lines.append(f"  {name:<12} {seconds * 1000:9.2f} ms in {self.layer_calls[name]} calls")
+        lines.append(f"  {'mask':<12} {self.mask_time * 1000:9.2f} ms in {self.mask_calls} calls")
+        if self.draft_tokens:
+            lines.append(f"  {'drafts':<12} {self.acceptance_rate:9.1%} of {self.draft_tokens} accepted")
+        lines.append(f"  {'peak memory':<12} {self.peak_memory / 2**20:9.1f} MiB")
+        return "\n".join(lines)
+
+
+class GenerationProfiler:
+    """
+    Collects GenerationStats for a GPT (or ExportedGPT) while attached to it. Decode steps and the
+    adjacency mask are timed by the model itself through model.profiler, the transformer blocks and
+    lm_head through forward hooks. On CUDA every measurement synchronizes the device, so that the
+    times include the kernels and not only their launch.
+    """
+
+    def __init__(self, model, layer_hooks=True, trace_dir=None):
+        """
+        Args:
+            model: GPT or ExportedGPT to profile
+            layer_hooks: Time every transformer block and lm_head (not available on exported models)
+            trace_dir: Directory for a torch.profiler trace of every trace() block (default: no traces)
+        """
+        self.model = model
+        self.layer_hooks = layer_hooks
+        self.trace_dir = trace_dir
+        self.stats = GenerationStats()
+        self._handles = []
+        self._starts = {}
+        # exported models run on the CPU and have no parameters
+        parameters = model.parameters() if isinstance(model, torch.nn.Module) else iter(())
+        self.cuda = next(parameters, torch.empty(0)).is_cuda
+
+    def attach(self):
+        self.model.profiler = self
+        modules = []
+        if self.layer_hooks and hasattr(self.model, 'transformer'):
+            modules = [(f"block {i}", block) for i, block in enumerate(self.model.transformer.h)]
+            modules.append(("lm_head", self.model.lm_head))
+        for name, module in modules:
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self._handles.append(module.register_forward_hook(self._post_hook(name)))
+        self.reset()
+        return self
+
+    def detach(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self.model.profiler = None
+
+    def reset(self):
+        self.stats = GenerationStats()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def _now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _pre_hook(self, name):
+        def hook(module, args):
+            self._starts[name] = self._now()
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, args, output):
+            self.stats.layer_times[name] += self._now() - self._starts.pop(name)
+            self.stats.layer_calls[name] += 1
+        return hook
+
+    def step_start(self):
+        return self._now()
+
+    def record_step(self, start, tokens):
+        """ One decode step that began at start (see step_start) and sampled tokens tokens. """
+        self.stats.step_times.append(self._now() - start)
+        self.stats.tokens += tokens
+
+    def record_speculation(self, drafted, accepted):
+        """ drafted speculative tokens of which the target model accepted accepted. """
+        self.stats.draft_tokens += drafted
+        self.stats.accepted_draft_tokens += accepted
+
+    @contextmanager
+    def mask(self):
+        start = self._now()
+        yield
+        self.stats.mask_time += self._now() - start
+        self.stats.mask_calls += 1
+
+    def trace(self):
+        """ torch.profiler context writing a TensorBoard/Chrome trace to trace_dir, a no-op without one. """
+        if self.trace_dir is None:
+            return nullcontext()
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return torch.profiler.profile(activities=activities, profile_memory=True,
+                                      on_trace_ready=torch.profiler.tensorboard_trace_handler(self.trace_dir))
+
+    def collect(self):
+        """ The stats so far, with the peak memory (of the CUDA device, else of the process) filled in. """
+        if self.cuda:
+            self.stats.peak_memory = torch.cuda.max_memory_allocated()
+        elif resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            self.stats.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return self.stats
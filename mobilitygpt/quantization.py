@@ -0,0 +1,88 @@
+"""
+Int8 inference for the GPT model on CPU.
+
+Dynamic quantization stores the weights of the linear layers (attention c_attn/c_proj with any
+LoRA weights merged in, MLP c_fc/c_proj and lm_head) as int8 and quantizes activations on the fly,
+so the matmuls run on the int8 CPU kernels. Embeddings and layer norms stay in fp32.
+"""
+
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+from torch.ao.quantization import quantize_dynamic
+
+from mobilitygpt.model import LoRALinear
+
+# -----------------------------------------------------------------------------
+
+def merge_lora(model: nn.Module) -> nn.Module:
+    """
+    Fold every LoRALinear into a plain nn.Linear with W + BA * scaling as its weight, in place.
+    Runtime adapters registered with GPT.load_adapter are dropped, only the model's own LoRA is kept.
+    """
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, LoRALinear):
+                continue
+            linear = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None,
+                               device=child.weight.device, dtype=child.weight.dtype)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight)
+                if child.is_lora() and not child.has_weights_merged:
+                    linear.weight += child.lora_scaling * child.lora_B @ child.lora_A
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(parent, name, linear)
+    return model
+
+def quantize_model(model: nn.Module, dtype=torch.qint8) -> nn.Module:
+    """
+    Merge LoRA and dynamically quantize all linear layers of model, in place.
+    The model has to live on the CPU.
+    """
+    model.to('cpu')
+    model.eval()
+    merge_lora(model)
+    return quantize_dynamic(model, {nn.Linear}, dtype=dtype, inplace=True)
+
+def is_quantized_state_dict(state_dict) -> bool:
+    return any(k.endswith('_packed_params._packed_params') for k in state_dict)
+
+def save_quantized(model: nn.Module, path: str):
+    torch.save(model.state_dict(), path)
+
+def load_quantized(model: nn.Module, path: str) -> nn.Module:
+    """
+    Load a checkpoint written by save_quantized: model is a freshly constructed fp32 model of the
+    same config, which is converted to the quantized structure before the weights are loaded.
+    """
+    model = quantize_model(model)
+    model.load_state_dict(torch.load(path, map_location='cpu', weights_only=True))
+    return model
+
+@torch.no_grad()
+def compare_next_segment_distributions(reference: nn.Module, quantized: nn.Module, idx: torch.Tensor) -> dict:
+    """
+    Accuracy check of a quantized model against its fp32 reference on the next-segment
+    distributions of every position of idx (LongTensor of shape (b,t)), after the adjacency mask.
+
+    Returns:
+        dict with the mean and max KL(reference || quantized), the max absolute probability
+        difference and the fraction of positions whose most likely next segment agrees
+    """
+    def next_segment_probs(model):
+        logits, _ = model(idx)
+        if model.adj_matrix is not None:
+            # same treatment as generation: masked-out successors get zero probability
+            logits = logits.masked_fill(logits == 0, -1e9)
+        return F.softmax(logits, dim=-1).reshape(-1, logits.size(-1))
+
+    p = next_segment_probs(reference)
+    q = next_segment_probs(quantized)
+    kl = (p * (torch.log(p.clamp_min(1e-12)) - torch.log(q.clamp_min(1e-12)))).sum(dim=-1)
+    return {
+        'kl_mean': kl.mean().item(),
+        'kl_max': kl.max().item(),
+        'prob_abs_diff_max': (p - q).abs().max().item(),
+        'top1_agreement': (p.argmax(dim=-1) == q.argmax(dim=-1)).float().mean().item(),
+    }
@@ -1,5 +1,7 @@
 from crewai import Agent, Task, Crew, Process
 from crewai.project import CrewBase, agent, crew, task
+from crewai.tools import BaseTool
+from typing import Dict, Optional
 from src.mobilityagent.tools.mobility_inference_tool import MobilityInferenceTool
 from src.mobilityagent.tools.google_maps_tool import GoogleMapsTool
 from src.mobilityagent.tools.route_quality_tool import RouteQualityTool
@@ -13,19 +15,40 @@ class MobilityAgentCrew:
     agents_config = 'config/agents.yaml'
     tasks_config = 'config/tasks.yaml'
 
-    def __init__(self):
-        # Initialize the MobilityInference tool
-        self.mobility_tool = MobilityInferenceTool(
-            model_path="mobilitygpt/model.pt",
-            dataset="SF"
-        )
-        self.google_maps_tool = GoogleMapsTool()
-        self.route_quality_tool = RouteQualityTool()
-        self.serper_tool = SerperDevTool()
-        self.location2link_tool = LocationToLinkTool(
-            graph_path="SF-Taxi/graph.csv")
-        self.link2location_tool = LinkToLocationTool(
-             graph_path="SF-Taxi/graph.csv")
+    def __init__(self, num_trajectories: int = 3, tools: Optional[Dict[str, BaseTool]] = None):
+        """
+        Args:
+            num_trajectories: Trajectories generated, and then checked one by one, per run
+            tools: Tools built by build_tools(), to share one loaded model and road graph between
+                many crews (default: build a fresh set)
+        """
+        # one traffic fetch and one route evaluation per generated trajectory, run concurrently
+        self.num_trajectories = num_trajectories
+        tools = tools if tools is not None else self.build_tools()
+        self.mobility_tool = tools['mobility_tool']
+        self.google_maps_tool = tools['google_maps_tool']
+        self.route_quality_tool = tools['route_quality_tool']
+        self.serper_tool = tools['serper_tool']
+        self.location2link_tool = tools['location2link_tool']
+        self.link2location_tool = tools['link2location_tool']
+
+    @staticmethod
+    def build_tools() -> Dict[str, BaseTool]:
+        """Build the tools of a crew; loading the model and the road graph makes this the costly part."""
+        return {
+            # Initialize the MobilityInference tool
+            'mobility_tool': MobilityInferenceTool(
+                model_path="mobilitygpt/model.pt",
+                dataset="SF"
+            ),
+            'google_maps_tool': GoogleMapsTool(),
+            'route_quality_tool': RouteQualityTool(),
+            'serper_tool': SerperDevTool(),
+            'location2link_tool': LocationToLinkTool(
+                graph_path="SF-Taxi/roadmap.geo"),
+            'link2location_tool': LinkToLocationTool(
+                graph_path="SF-Taxi/roadmap.geo"),
+        }
 
     @agent
     def location_translator_agent(self) -> Agent:
@@ -76,39 +99,58 @@ class MobilityAgentCrew:
 
     @task
     def generate_trajectories_task(self) -> Task:
+        config = self.tasks_config['generate_trajectories_task']
         return Task(
-            config=self.tasks_config['generate_trajectories_task'],
+            config=config,
+            description=f"{config['description']} Generate {self.num_trajectories} trajectories "
+                        f"and number them from 1 to {self.num_trajectories}.",
             agent=self.mobility_modeling_agent()
         )
 
-    @task
-    def fetch_traffic_data_task(self) -> Task:
+    def _per_trajectory_task(self, task_name: str, agent_name: str, tools: list, index: int) -> Task:
+        """
+        One asynchronous copy of a per-trajectory task, restricted to trajectory number index.
+        Every copy gets its own agent, so that concurrently running copies share no executor state.
+        """
+        config = self.tasks_config[task_name]
         return Task(
-            config=self.tasks_config['fetch_traffic_data_task'],
-            agent=self.real_time_traffic_integration_agent()
+            config=config,
+            name=f"{task_name}_{index}",
+            description=f"{config['description']} Only handle trajectory number {index} of the generated trajectories.",
+            expected_output=f"{config['expected_output']} (trajectory {index})",
+            agent=Agent(config=self.agents_config[agent_name], tools=tools, verbose=True)
         )
 
-    @task
-    def evaluate_route_quality_task(self) -> Task:
-        return Task(
-            config=self.tasks_config['evaluate_route_quality_task'],
-            agent=self.route_quality_assessment_agent()
-        )
-
-    @task
-    def generate_reports_task(self) -> Task:
-        return Task(
-            config=self.tasks_config['generate_reports_task'],
-            agent=self.information_compiler_agent()
-        )
+    def fetch_traffic_data_tasks(self) -> list:
+        return [
+            self._per_trajectory_task('fetch_traffic_data_task', 'real_time_traffic_integration_agent',
+                                      [self.google_maps_tool, self.link2location_tool], i)
+            for i in range(1, self.num_trajectories + 1)
+        ]
 
+    def evaluate_route_quality_tasks(self) -> list:
+        return [
+            self._per_trajectory_task('evaluate_route_quality_task', 'route_quality_assessment_agent',
+                                      [self.route_quality_tool], i)
+            for i in range(1, self.num_trajectories + 1)
+        ]
 
     @crew
     def crew(self) -> Crew:
         """Creates the MobilityAgents crew"""
+        # traffic fetching and route evaluation of the trajectories are independent of each other:
+        # they all fan out after trajectory generation and are joined by the (synchronous) report
+        fan_out = self.fetch_traffic_data_tasks() + self.evaluate_route_quality_tasks()
+        config = self.tasks_config['generate_reports_task']
+        generate_reports_task = Task(
+            config=config,
+            agent=self.information_compiler_agent(),
+            context=fan_out
+        )
+        tasks = [self.convert_origin_input_task(), self.generate_trajectories_task(), *fan_out, generate_reports_task]
         return Crew(
-            agents=self.agents, # Automatically created by the @agent decorator
-            tasks=self.tasks, # Automatically created by the @task decorator
+            agents=list({id(t.agent): t.agent for t in tasks}.values()),
+            tasks=tasks,
             process=Process.sequential,
             verbose=True,
         )
@@ -0,0 +1,107 @@
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
+
+Points = Union[np.ndarray, Sequence[Tuple[float, float]]]
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distance in meters between (lat1, lon1) and (lat2, lon2), given in degrees.
+    Works elementwise on scalars or arrays of any broadcastable shapes.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def segment_distances(trajectory: Points) -> np.ndarray:
+    """
+    Distances between consecutive points of a trajectory.
+
+    Args:
+        trajectory: (N, 2) array or list of (latitude, longitude) coordinates
+
+    Returns:
+        (N-1,) array of segment distances in meters
+    """
+    points = np.asarray(trajectory, dtype=np.float64).reshape(-1, 2)
+    return haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+
+
+def cumulative_distances(trajectory: Points) -> np.ndarray:
+    """
+    Distance travelled up to every point of a trajectory.
+
+    Returns:
+        (N,) array starting at 0, its last entry is the trajectory length
+    """
+    distances = segment_distances(trajectory)
+    return np.concatenate(([0.0], np.cumsum(distances)))
+
+
+def pack_trajectories(trajectories: Sequence[Points]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ragged batch of trajectories as one flat (sum(lengths), 2) point array plus per-trajectory lengths.
+    """
+    lengths = np.array([len(t) for t in trajectories], dtype=np.int64)
+    if not len(trajectories) or not lengths.sum():
+        return np.empty((0, 2), dtype=np.float64), lengths
+    points = np.concatenate([np.asarray(t, dtype=np.float64).reshape(-1, 2) for t in trajectories])
+    return points, lengths
+
+
+def batch_distances(points: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Segment and cumulative distances of a packed ragged batch (see pack_trajectories) in one pass:
+    distances are computed between all consecutive rows of points, and the pairs that straddle two
+    trajectories are dropped.
+
+    Args:
+        points: (P, 2) array of (latitude, longitude), the trajectories back to back
+        lengths: (B,) number of points of every trajectory
+
+    Returns:
+        segments: (P - B',) segment distances of all trajectories back to back, where B' is the number
+            of non-empty trajectories; trajectory b owns max(lengths[b] - 1, 0) of them
+        cumulative: (P,) distance travelled up to every point, restarting at 0 for every trajectory
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    pair_distances = segment_distances(points)
+    # pair j joins points j and j+1, it is a segment unless j+1 starts a new trajectory
+    within = np.ones(len(pair_distances), dtype=bool)
+    boundaries = starts[(lengths > 0) & (starts > 0)] - 1
+    within[boundaries] = False
+    segments = pair_distances[within]
+
+    # cumulative sum over the whole batch, minus the running total at every trajectory's first point
+    steps = np.concatenate(([0.0], np.where(within, pair_distances, 0.0)))
+    cumulative = np.cumsum(steps)
+    nonempty = lengths > 0
+    offsets = np.repeat(cumulative[starts[nonempty]], lengths[nonempty])
+    return segments, cumulative - offsets
+
+
+def trajectory_distances(trajectories: Sequence[Points]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Segment and cumulative distances of every trajectory of a ragged batch.
+
+    Args:
+        trajectories: List of trajectories, each a list or (N_i, 2) array of (latitude, longitude)
+
+    Returns:
+        Per-trajectory lists of segment distances (N_i - 1,) and cumulative distances (N_i,)
+    """
+    if not len(trajectories):
+        return [], []
+    points, lengths = pack_trajectories(trajectories)
+    segments, cumulative = batch_distances(points, lengths)
+    segment_counts = np.maximum(lengths - 1, 0)
+    return (np.split(segments, np.cumsum(segment_counts)[:-1]),
+            np.split(cumulative, np.cumsum(lengths)[:-1]))
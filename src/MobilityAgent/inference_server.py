@@ -0,0 +1,276 @@
+import json
+import socket
+import asyncio
+import argparse
+from typing import Iterator, List, Optional
+from mobilitygpt.config import get_base_config
+from .mobility_inference import MobilityInference
+
+
+class _GenerationRequest:
+    """A pending generate_trajectories call waiting to be batched."""
+
+    def __init__(self, origin_id, num_trajectories, temperature, max_length, adapter, destination_id, future):
+        self.origin_id = str(origin_id)
+        self.num_trajectories = num_trajectories
+        self.temperature = temperature
+        self.max_length = max_length
+        self.adapter = adapter
+        self.destination_id = None if destination_id is None else str(destination_id)
+        self.future = future
+
+    @property
+    def batch_key(self):
+        # requests can share a decoding batch when they only differ in origin, size and adapter
+        return (self.temperature, self.max_length, self.destination_id)
+
+
+class InferenceServer:
+    """
+    Owns one MobilityInference model and serves generation requests from many callers, coalescing
+    the requests that arrive within max_wait_ms of each other into shared decoding batches.
+
+    Callers in the same process await generate_trajectories directly (an asyncio queue feeds the
+    batcher); other processes connect over TCP, see serve() and InferenceClient.
+    """
+
+    def __init__(self,
+                 inference: MobilityInference,
+                 max_batch_size: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None):
+        config = get_base_config().server
+        self.inference = inference
+        self.max_batch_size = max_batch_size if max_batch_size is not None else config.max_batch_size
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else config.max_wait_ms) / 1000
+        self.queue = None
+        self._batcher = None
+
+    async def start(self):
+        """Start the batching loop on the running event loop."""
+        if self._batcher is None:
+            self.queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+
+    async def generate_trajectories(self,
+                                    origin_id: str,
+                                    num_trajectories: int = 1,
+                                    temperature: float = 1.0,
+                                    max_length: int = 81,
+                                    adapter: Optional[str] = None,
+                                    destination_id: Optional[str] = None) -> List[List[int]]:
+        """Queue a request and wait for its trajectories, see MobilityInference.generate_trajectories."""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_GenerationRequest(
+            origin_id, num_trajectories, temperature, max_length, adapter, destination_id, future
+        ))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            num_rows = batch[0].num_trajectories
+            deadline = loop.time() + self.max_wait
+            # keep collecting until the latency window closes or the batch is full
+            while num_rows < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                num_rows += request.num_trajectories
+
+            # the model runs in a worker thread so that the loop keeps accepting requests
+            try:
+                results = await loop.run_in_executor(None, self._run_batch, batch)
+            except Exception as e:
+                # whatever _run_group does not catch fails this batch, never the loop
+                results = [e] * len(batch)
+            for request, result in zip(batch, results):
+                if request.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    request.future.set_exception(result)
+                else:
+                    request.future.set_result(result)
+
+    def _run_batch(self, batch: List[_GenerationRequest]) -> List:
+        """Decode every group of compatible requests with one generate_from_origins call."""
+        results = [None] * len(batch)
+        groups = {}
+        for i, request in enumerate(batch):
+            # an unknown segment would fail the whole group, so it only fails its own request
+            unknown = [s for s in (request.origin_id, request.destination_id)
+                       if s is not None and s not in self.inference.stoi]
+            if unknown:
+                results[i] = KeyError(unknown[0])
+                continue
+            groups.setdefault(request.batch_key, []).append(i)
+
+        for (temperature, max_length, destination_id), members in groups.items():
+            for i, result in zip(members, self._run_group(batch, members, temperature, max_length, destination_id)):
+                results[i] = result
+        return results
+
+    def _run_group(self, batch: List[_GenerationRequest], members: List[int], temperature: float, max_length: int,
+                   destination_id: Optional[str]) -> List:
+        """Results of the requests batch[i] for i in members, decoded together."""
+        origin_ids, adapters = [], []
+        for i in members:
+            origin_ids += [batch[i].origin_id] * batch[i].num_trajectories
+            adapters += [batch[i].adapter] * batch[i].num_trajectories
+        try:
+            trajectories = self.inference.generate_from_origins(
+                origin_ids,
+                temperature=temperature,
+                max_length=max_length,
+                adapter=adapters if any(a is not None for a in adapters) else None,
+                destination_id=destination_id
+            )
+        except Exception as e:
+            if len(members) == 1:
+                return [e]
+            # e.g. an unknown adapter: retry one by one, so that only the bad request fails
+            return [self._run_group(batch, [i], temperature, max_length, destination_id)[0] for i in members]
+        # hand every request back its own slice of the rows
+        results, start = [], 0
+        for i in members:
+            end = start + batch[i].num_trajectories
+            results.append([t for t in trajectories[start:end] if t is not None])
+            start = end
+        return results
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Newline-delimited JSON: one request object per line, one response object per line."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request.pop('op', 'generate')
+                    if op == 'generate':
+                        response = {'trajectories': await self.generate_trajectories(**request)}
+                    elif op == 'segment_length':
+                        response = {'length': float(self.inference.get_segment_length(request['trajectory']))}
+                    elif op == 'segment_lengths':
+                        response = {'lengths': self.inference.get_segment_lengths(request['trajectories'])}
+                    else:
+                        response = {'error': f"Unknown op: {op}"}
+                except Exception as e:
+                    response = {'error': str(e)}
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: Optional[str] = None, port: Optional[int] = None):
+        """Serve requests over TCP until cancelled."""
+        config = get_base_config().server
+        await self.start()
+        server = await asyncio.start_server(
+            self._handle_connection,
+            host if host is not None else config.host,
+            port if port is not None else config.port
+        )
+        async with server:
+            await server.serve_forever()
+
+
+class InferenceClient:
+    """
+    Blocking client for a running InferenceServer, with the generation interface of MobilityInference.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, timeout: float = 300.0):
+        config = get_base_config().server
+        self.host = host if host is not None else config.host
+        self.port = port if port is not None else config.port
+        self.timeout = timeout
+
+    def _request(self, payload: dict) -> dict:
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall((json.dumps(payload) + '\n').encode())
+            with sock.makefile('r') as f:
+                response = json.loads(f.readline())
+        if 'error' in response:
+            raise RuntimeError(f"Inference server error: {response['error']}")
+        return response
+
+    def generate_trajectories(self,
+                              origin_id: str,
+                              num_trajectories: int = 1,
+                              temperature: float = 1.0,
+                              max_length: int = 81,
+                              adapter: Optional[str] = None,
+                              destination_id: Optional[str] = None) -> List[List[int]]:
+        return self._request({
+            'op': 'generate',
+            'origin_id': str(origin_id),
+            'num_trajectories': num_trajectories,
+            'temperature': temperature,
+            'max_length': max_length,
+            'adapter': adapter,
+            'destination_id': destination_id,
+        })['trajectories']
+
+    def stream_trajectories(self,
+                            origin_id: str,
+                            num_trajectories: int = 1,
+                            temperature: float = 1.0,
+                            max_length: int = 81,
+                            adapter: Optional[str] = None,
+                            destination_id: Optional[str] = None,
+                            max_results: Optional[int] = None) -> Iterator[List[int]]:
+        """
+        Same interface as MobilityInference.stream_trajectories. The server answers with all
+        trajectories at once, so only max_results of them are requested.
+        """
+        if max_results is not None:
+            num_trajectories = min(num_trajectories, max_results)
+        yield from self.generate_trajectories(origin_id, num_trajectories, temperature=temperature, max_length=max_length,
+                                              adapter=adapter, destination_id=destination_id)
+
+    def get_segment_length(self, trajectory: List[int]) -> float:
+        return self._request({'op': 'segment_length', 'trajectory': [int(s) for s in trajectory]})['length']
+
+    def get_segment_lengths(self, trajectories: List[List[int]]) -> List[float]:
+        return self._request({
+            'op': 'segment_lengths',
+            'trajectories': [[int(s) for s in trajectory] for trajectory in trajectories]
+        })['lengths']
+
+
+def main():
+    config = get_base_config().server
+    parser = argparse.ArgumentParser(description="Serve MobilityGPT trajectory generation with dynamic batching")
+    parser.add_argument('--model_path', default="mobilitygpt/model.pt")
+    parser.add_argument('--dataset', default="SF")
+    parser.add_argument('--host', default=config.host)
+    parser.add_argument('--port', type=int, default=config.port)
+    parser.add_argument('--max_batch_size', type=int, default=config.max_batch_size)
+    parser.add_argument('--max_wait_ms', type=float, default=config.max_wait_ms)
+    args = parser.parse_args()
+
+    inference = MobilityInference(model_path=args.model_path, dataset=args.dataset)
+    server = InferenceServer(inference, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    print(f"Serving {args.model_path} on {args.host}:{args.port}")
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mobilitygpt.config import get_base_config
 from crew import MobilityAgentCrew
 
 # This main file is intended to be a way for your to run your
@@ -59,6 +63,69 @@ def test():
     except Exception as e:
         raise Exception(f"An error occurred while testing the crew: {e}")
 
+def _parse_input(line):
+    """
+    Inputs of one batch run: a JSON object with the crew inputs or a plain location description.
+    """
+    return json.loads(line) if line.startswith('{') else {'location_description': line}
+
+def batch():
+    """
+    Run the crew for many locations with bounded concurrency.
+    Usage: main.py batch <input file, or - for stdin> <output file> [<concurrency>]
+    The model, the road graph and the Directions cache are loaded once and shared by all runs, and
+    every result is appended to the output file (JSON lines) as soon as its run finishes.
+    """
+    config = get_base_config().batch
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else config.concurrency
+    tools = MobilityAgentCrew.build_tools()
+
+    def run_one(inputs):
+        start = time.perf_counter()
+        crew = MobilityAgentCrew(num_trajectories=config.num_trajectories, tools=tools).crew()
+        result = crew.kickoff(inputs=inputs)
+        return str(result), time.perf_counter() - start
+
+    def write(record):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+    def finished(future):
+        number, inputs = pending.pop(future)
+        record = {'line': number, 'inputs': inputs}
+        try:
+            record['output'], record['seconds'] = future.result()
+        except Exception as e:
+            record['error'] = str(e)
+        write(record)
+
+    source = sys.stdin if sys.argv[2] == '-' else open(sys.argv[2])
+    pending = {}
+    try:
+        with open(sys.argv[3], 'a') as out, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # one input per line, read lazily: only as fast as runs finish
+            for number, line in enumerate(source, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    inputs = _parse_input(line)
+                except ValueError as e:
+                    write({'line': number, 'inputs': line, 'error': str(e)})
+                    continue
+                while len(pending) >= concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished(future)
+                pending[executor.submit(run_one, inputs)] = (number, inputs)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(future)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: main.py <command> [<args>]")
@@ -73,6 +140,8 @@ if __name__ == "__main__":
         replay()
     elif command == "test":
         test()
+    elif command == "batch":
+        batch()
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
@@ -1,9 +1,17 @@
+import copy
+import time
+import threading
 import torch
-import random
 from mobilitygpt.model import GPT
 from mobilitygpt.config import get_base_config
-import pandas as pd
-from typing import List
+from mobilitygpt.quantization import quantize_model, is_quantized_state_dict
+from mobilitygpt.export import export_decode_step, ExportedGPT
+from mobilitygpt.profiling import GenerationProfiler, GenerationStats
+import numpy as np
+from typing import Iterator, List, Optional, Tuple, Union
+from contextlib import closing, nullcontext
+from itertools import islice
+from .roadmap import load_road_graph, UNREACHABLE
 
 class MobilityInference:
     def __init__(self, 
@@ -22,103 +30,338 @@ class MobilityInference:
         # Initialize model configuration
         self.config = get_base_config()
 
-        self.device = self.config.system.device 
+        # the int8 kernels and the exported runtimes are CPU-only
+        cpu_only = self.config.model.quantization or self.config.model.inference_backend in ('torchscript', 'onnx')
+        self.device = 'cpu' if cpu_only else self.config.system.device 
         self.dataset = dataset
         
-        # Load geography data
-        self.geo = pd.read_csv(f'{dataset}-Taxi/roadmap.geo')
-        self.geo_ids = self.geo['geo_id'].apply(str).tolist()
-        
-        # Load relationship data for adjacency matrix
-        rel = pd.read_csv(f'{dataset}-Taxi/roadmap.rel')
-        rel['combined'] = rel.apply(lambda x: [x['origin_id'], x['destination_id']], axis=1)
-        od_list = rel['combined'].tolist()
+        # Load the road graph (geo_id/length columns and the edge list) as NumPy arrays
+        self.graph = load_road_graph(dataset, use_cache=self.config.data.graph_cache)
+        self.geo = self.graph.geo
+        self.geo_ids = self.graph.geo_ids.astype(str).tolist()
         
         # Create adjacency matrix
-        self.adj_matrix = self._create_adjacency_matrix(od_list)
+        self.adj_matrix = self.graph.build_adjacency(
+            sparse=self.config.model.sparse_adjacency,
+            device=self.device
+        )
         
         # Setup vocabulary
+        start = time.perf_counter()
         self.EOS_TOKEN = '</S>'
-        self.stoi = {ch: i for i, ch in enumerate(self.geo_ids)}
-        self.itos = {i: ch for i, ch in enumerate(self.geo_ids)}
+        self.itos = dict(enumerate(self.geo_ids))
+        self.stoi = dict(zip(self.geo_ids, range(len(self.geo_ids))))
         self.stoi[self.EOS_TOKEN] = len(self.geo_ids)
         self.itos[len(self.geo_ids)] = self.EOS_TOKEN
+        self.graph.timings['vocabulary'] = time.perf_counter() - start
         
         self.config.model.vocab_size = len(self.geo_ids)+1
         self.config.model.block_size = self.config.data.block_size 
         
         # Initialize and load model
         self.model = self._init_model(model_path)
+        # optional draft model that speeds up decoding speculatively, see GPT.generate_speculative_stream
+        self.draft_model = None
+        if self.config.model.draft_path is not None:
+            self.draft_model = self._init_draft_model(self.config.model.draft_path)
+        # opt-in instrumentation of generation, see C.profiling
+        self.profiler = None
+        if self.config.profiling.enabled:
+            self.profiler = GenerationProfiler(
+                self.model,
+                layer_hooks=self.config.profiling.layer_hooks,
+                trace_dir=self.config.profiling.trace_dir
+            ).attach()
+        # the model (and its active adapter) is shared by all threads using this instance,
+        # e.g. the concurrent crews of a batch run
+        self._generate_lock = threading.Lock()
         
-    def _create_adjacency_matrix(self, od_pair_list):
-        """Create adjacency matrix from OD pairs."""
-        max_index = max(max(pair) for pair in od_pair_list)
-        adjacency_matrix = torch.zeros((max_index + 1, max_index + 1), dtype=int)
-        
-        for origin, destination in od_pair_list:
-            adjacency_matrix[origin, destination] = 1
-            
-        # Add boundary rows and columns
-        adjacency_matrix = torch.cat((adjacency_matrix, torch.ones(1, adjacency_matrix.size(0))), 0)
-        adjacency_matrix = torch.cat((adjacency_matrix, torch.ones(adjacency_matrix.size(0), 1)), 1)
+    def timing_report(self) -> str:
+        """Per-stage cost of loading the road graph."""
+        return self.graph.timing_report()
+
+    def profile_stats(self, reset: bool = False) -> Optional[GenerationStats]:
+        """
+        Generation stats collected since loading (or the last reset), None unless config.profiling.enabled.
         
-        return adjacency_matrix.to(self.device)
+        Args:
+            reset: Start a new collection after returning this one
+        """
+        if self.profiler is None:
+            return None
+        with self._generate_lock:
+            stats = self.profiler.collect()
+            if reset:
+                self.profiler.reset()
+        return stats
 
     def _init_model(self, model_path: str):
         """Initialize and load the model."""
+        backend = self.config.model.inference_backend
+        if backend in ('torchscript', 'onnx'):
+            # model_path is an artifact directory written by export_model
+            model = ExportedGPT(model_path, adj_matrix=self.adj_matrix)
+            assert model.meta['vocab_size'] == self.config.model.vocab_size, "exported model does not match the road graph"
+            return model
+        elif backend not in ('eager', 'compile'):
+            raise ValueError(f"Unknown inference backend: {backend}")
+        
         model = GPT(self.config.model, adj_matrix=self.adj_matrix)
-        model.load_state_dict(torch.load(model_path, map_location=self.device, weights_only=True))
+        state_dict = torch.load(model_path, map_location=self.device, weights_only=True)
+        if self.config.model.quantization == 'int8':
+            # accept both fp32 checkpoints (quantized after loading) and saved quantized ones
+            if is_quantized_state_dict(state_dict):
+                model = quantize_model(model)
+                model.load_state_dict(state_dict)
+            else:
+                model.load_state_dict(state_dict)
+                model = quantize_model(model)
+            return model
+        elif self.config.model.quantization is not None:
+            raise ValueError(f"Unknown quantization mode: {self.config.model.quantization}")
+        elif is_quantized_state_dict(state_dict):
+            raise ValueError(f"{model_path} is a quantized checkpoint, set config.model.quantization = 'int8'")
+        model.load_state_dict(state_dict)
         model.to(self.device)
         model.eval()
+        if backend == 'compile':
+            # compile the incremental decode step that generation spends its time in
+            model.decode_step = torch.compile(model.decode_step, dynamic=True)
         return model
 
+    def _init_draft_model(self, draft_path: str) -> GPT:
+        """Load the draft model of speculative decoding, a small config.model.draft_model_type GPT."""
+        if not isinstance(self.model, GPT):
+            raise ValueError("Speculative decoding needs an eager target model, not an exported one")
+        draft_config = copy.deepcopy(self.config.model)
+        draft_config.model_type = self.config.model.draft_model_type
+        draft_config.use_lora = False
+        draft = GPT(draft_config, adj_matrix=self.adj_matrix)
+        draft.load_state_dict(torch.load(draft_path, map_location=self.device, weights_only=True))
+        draft.to(self.device)
+        draft.eval()
+        return draft
+
+    def export_model(self, path: str, format: str = 'torchscript') -> str:
+        """
+        Export the decode step of the loaded model as a deployable artifact.
+        
+        Args:
+            path: Output directory, usable as model_path with config.model.inference_backend = format
+            format: 'torchscript' or 'onnx'
+            
+        Returns:
+            The artifact directory
+        """
+        return export_decode_step(self.model, path, format=format)
+
+    def load_adapter(self, name: str, adapter_path: str, lora_alpha: Optional[float] = None):
+        """
+        Load a named LoRA adapter (e.g. a district or time window fine-tune) on top of the base model.
+        
+        Args:
+            name: Name used to select the adapter in generate_trajectories
+            adapter_path: Path to the checkpoint of the LoRA fine-tuned model
+            lora_alpha: LoRA alpha the adapter was trained with (default: config.model.lora_alpha)
+        """
+        self.model.load_adapter(name, adapter_path, lora_alpha=lora_alpha)
+
+    def unload_adapter(self, name: str):
+        """Remove a named LoRA adapter."""
+        self.model.unload_adapter(name)
+
     def generate_trajectories(self, 
                             origin_id: str, 
                             num_trajectories: int = 1,
                             temperature: float = 1.0,
-                            max_length: int = 81) -> List[List[int]]:
+                            max_length: int = 81,
+                            adapter: Optional[str] = None,
+                            destination_id: Optional[str] = None) -> List[List[int]]:
         """
         Generate synthetic trajectories from a given origin point.
         
+        With a destination_id only trajectories that end at the destination are generated: successors
+        that cannot reach it within the remaining length budget are never sampled.
+        
         Args:
             origin_id: Starting road segment ID
             num_trajectories: Number of trajectories to generate
             temperature: Sampling temperature (higher = more random)
             max_length: Maximum trajectory length
+            adapter: Name of a loaded LoRA adapter to generate with (default: base model)
+            destination_id: Road segment ID the trajectories must end at (default: free-running)
             
         Returns:
             List of generated trajectories (each trajectory is a list of road segment IDs)
         """
-        synthetic_trajectories = []
+        trajectories = self.generate_from_origins(
+            [str(origin_id)] * num_trajectories,
+            temperature=temperature,
+            max_length=max_length,
+            adapter=adapter,
+            destination_id=destination_id
+        )
+        return [trajectory for trajectory in trajectories if trajectory is not None]
+
+    def generate_from_origins(self,
+                              origin_ids: List[str],
+                              temperature: float = 1.0,
+                              max_length: int = 81,
+                              adapter: Optional[Union[str, List[Optional[str]]]] = None,
+                              destination_id: Optional[str] = None) -> List[Optional[List[int]]]:
+        """
+        Generate one trajectory per entry of origin_ids in a single batched call, so that requests
+        for different origins can share the decoding work.
         
-        for _ in range(num_trajectories):
-            # Prepare context
-            context = [self.EOS_TOKEN, str(origin_id)]
-            x = torch.tensor([self.stoi[s] for s in context], dtype=torch.long)[None,...].to(self.device)
+        Args:
+            origin_ids: Starting road segment ID of every row
+            temperature: Sampling temperature (higher = more random)
+            max_length: Maximum trajectory length
+            adapter: Name of a loaded LoRA adapter for all rows, or one name (or None) per row
+            destination_id: Road segment ID the trajectories must end at (default: free-running)
             
-            # Generate trajectory
-            with torch.no_grad():
-                y = self.model.generate_test(
-                    x, 
-                    self.itos, 
-                    self.EOS_TOKEN, 
-                    max_token=max_length,
-                    temperature=temperature,
-                    do_sample=True,
-                    top_k=None
-                )[0]
+        Returns:
+            One trajectory per row, or None for rows whose origin cannot reach the destination
+        """
+        results = [None] * len(origin_ids)
+        trace = self.profiler.trace() if self.profiler is not None else nullcontext()
+        # nothing runs between the rows here, so the model is held for the whole batch
+        with self._generate_lock, trace:
+            for row, trajectory in self._decode(origin_ids, temperature, max_length, adapter, destination_id,
+                                                step_lock=nullcontext()):
+                results[row] = trajectory
+        return results
+
+    def stream_trajectories(self,
+                            origin_id: str,
+                            num_trajectories: int = 1,
+                            temperature: float = 1.0,
+                            max_length: int = 81,
+                            adapter: Optional[str] = None,
+                            destination_id: Optional[str] = None,
+                            max_results: Optional[int] = None) -> Iterator[List[int]]:
+        """
+        Streaming form of generate_trajectories: yields every trajectory as soon as it is finished,
+        while the others are still being decoded. Trajectories come in the order they finish, so
+        short ones tend to come first; decoding stops after max_results of them.
+        
+        Args:
+            origin_id: Starting road segment ID
+            num_trajectories: Number of trajectories decoded together
+            temperature: Sampling temperature (higher = more random)
+            max_length: Maximum trajectory length
+            adapter: Name of a loaded LoRA adapter to generate with (default: base model)
+            destination_id: Road segment ID the trajectories must end at (default: free-running)
+            max_results: Stop after this many trajectories (default: all of them)
             
-            # Convert to road segment IDs
-            trajectory = []
-            for i in y[1:]:  # Skip first token
-                if self.itos[int(i)] == self.EOS_TOKEN:
+        Yields:
+            Trajectories (lists of road segment IDs)
+        """
+        stream = self.stream_from_origins([str(origin_id)] * num_trajectories, temperature=temperature,
+                                          max_length=max_length, adapter=adapter, destination_id=destination_id)
+        # islice stops pulling once max_results are out, and closing the stream ends the decoding
+        with closing(stream):
+            for _, trajectory in islice(stream, max_results):
+                yield trajectory
+
+    def stream_from_origins(self,
+                            origin_ids: List[str],
+                            temperature: float = 1.0,
+                            max_length: int = 81,
+                            adapter: Optional[Union[str, List[Optional[str]]]] = None,
+                            destination_id: Optional[str] = None) -> Iterator[Tuple[int, List[int]]]:
+        """
+        Streaming form of generate_from_origins: yields (row, trajectory) as soon as a row is finished.
+        Rows whose origin cannot reach the destination are skipped. The model is only held while the
+        next row is decoded, so other callers can generate while the consumer works on a row; with
+        profiling.trace_dir set the trace covers the whole stream, which then holds the model until
+        it is exhausted or closed.
+        """
+        if self.profiler is not None and self.profiler.trace_dir is not None:
+            with self._generate_lock, self.profiler.trace():
+                yield from self._decode(origin_ids, temperature, max_length, adapter, destination_id,
+                                        step_lock=nullcontext())
+        else:
+            yield from self._decode(origin_ids, temperature, max_length, adapter, destination_id,
+                                    step_lock=self._generate_lock)
+
+    def _decode(self, origin_ids, temperature, max_length, adapter, destination_id, step_lock):
+        """ The body of stream_from_origins, advancing the model's generator under step_lock. """
+        origins = [self.stoi[str(origin_id)] for origin_id in origin_ids]
+        rows = list(range(len(origins)))
+        
+        destination, hops_to_destination = None, None
+        if destination_id is not None:
+            destination = self.stoi[str(destination_id)]
+            hops = self.graph.hops_to(destination)
+            for row in list(rows):
+                if origins[row] == destination:
+                    yield row, [int(origin_ids[row])]
+                    rows.remove(row)
+                # the context holds two tokens, so at most max_length - 2 segments can follow the origin
+                elif hops[origins[row]] > max_length - 2:
+                    rows.remove(row)
+            # the end token is never a valid step towards the destination
+            hops_to_destination = torch.tensor(np.append(hops, UNREACHABLE), dtype=torch.long, device=self.device)
+        if not rows:
+            return
+        if adapter is not None and not isinstance(adapter, str):
+            adapter = [adapter[row] for row in rows]
+        
+        # Prepare context, one row per trajectory
+        x = torch.tensor([[self.stoi[self.EOS_TOKEN], origins[row]] for row in rows], dtype=torch.long).to(self.device)
+        
+        # Generate all trajectories in a single batched call
+        # the draft model knows neither adapters nor destinations
+        if self.draft_model is not None and adapter is None and destination is None and max_length <= self.model.block_size:
+            ys = self.model.generate_speculative_stream(
+                x,
+                self.draft_model,
+                num_draft=self.config.model.num_draft_tokens,
+                end_token=self.stoi[self.EOS_TOKEN],
+                max_token=max_length,
+                temperature=temperature,
+                do_sample=True,
+                top_k=None
+            )
+        else:
+            ys = self.model.generate_batch_stream(
+                x, 
+                end_token=self.stoi[self.EOS_TOKEN], 
+                max_token=max_length,
+                temperature=temperature,
+                do_sample=True,
+                top_k=None,
+                adapter=adapter,
+                destination=destination,
+                hops_to_destination=hops_to_destination
+            )
+        try:
+            while True:
+                with step_lock:
+                    step = next(ys, None)
+                    # the model selects the adapter again on the next step, other callers get the base model
+                    if adapter is not None:
+                        self.model.set_adapter(None)
+                if step is None:
                     break
-                trajectory.append(int(self.itos[int(i)]))
-            
-            synthetic_trajectories.append(trajectory)
-            
-        return synthetic_trajectories
+                i, y = step
+                # Convert to road segment IDs
+                trajectory = []
+                for token in y[1:].tolist():  # Skip first token
+                    if self.itos[token] == self.EOS_TOKEN:
+                        break
+                    trajectory.append(int(self.itos[token]))
+                yield rows[i], trajectory
+        finally:
+            # closing the model's generator resets its adapter, which must not happen mid-step of another caller
+            with step_lock:
+                ys.close()
 
     def get_segment_length(self, trajectory: List[int]) -> float:
         """Calculate the total length of a trajectory."""
-        return self.geo[self.geo['geo_id'].isin(trajectory)].length.sum()
\ No newline at end of file
+        return float(self.graph.trajectory_lengths([trajectory])[0])
+
+    def get_segment_lengths(self, trajectories: List[List[int]]) -> List[float]:
+        """Calculate the total lengths of many trajectories at once."""
+        return self.graph.trajectory_lengths(trajectories).tolist()
\ No newline at end of file
@@ -0,0 +1,396 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from mobilitygpt.adjacency import SparseAdjacency
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+ARTIFACT_VERSION = 1
+SOURCE_FILES = ('roadmap.geo', 'roadmap.rel')
+ARTIFACT_ARRAYS = ('geo_ids', 'lengths', 'origins', 'destinations', 'indptr', 'indices')
+UNREACHABLE = np.iinfo(np.int32).max
+
+
+class RoadGraph:
+    """
+    Road network of a dataset as flat NumPy arrays: token id -> geo_id / segment length, and the
+    (origin_id, destination_id) edge list, plus the adjacency built from it for the model.
+    """
+
+    def __init__(self,
+                 geo_ids: np.ndarray,
+                 lengths: np.ndarray,
+                 origins: np.ndarray,
+                 destinations: np.ndarray,
+                 indptr: Optional[np.ndarray] = None,
+                 indices: Optional[np.ndarray] = None,
+                 timings: Dict[str, float] = None):
+        self.geo_ids = geo_ids
+        self.lengths = lengths
+        self.origins = origins
+        self.destinations = destinations
+        # precomputed CSR arrays (EOS row included), only present when loaded from a compiled artifact
+        self.indptr = indptr
+        self.indices = indices
+        self.timings = timings if timings is not None else {}
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.geo_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.origins)
+
+    @property
+    def geo(self) -> pd.DataFrame:
+        """The geo_id/length columns of roadmap.geo as a DataFrame."""
+        return pd.DataFrame({'geo_id': self.geo_ids, 'length': self.lengths})
+
+    def build_adjacency(self, sparse: bool = True, device: str = 'cpu'):
+        """
+        Build the model's adjacency from the edge list, with a trailing EOS row and column of ones.
+
+        Args:
+            sparse: Return a CSR SparseAdjacency instead of a dense (V+1, V+1) tensor
+            device: Device to place the adjacency on
+        """
+        start = time.perf_counter()
+        if sparse and self.indptr is not None:
+            adjacency = SparseAdjacency(torch.from_numpy(self.indptr), torch.from_numpy(self.indices), self.num_nodes + 1)
+        elif sparse:
+            adjacency = SparseAdjacency.from_edges(self.origins, self.destinations, num_nodes=self.num_nodes)
+        else:
+            adjacency = torch.zeros((self.num_nodes + 1, self.num_nodes + 1))
+            adjacency[torch.from_numpy(self.origins), torch.from_numpy(self.destinations)] = 1
+            adjacency[-1, :] = 1
+            adjacency[:, -1] = 1
+        adjacency = adjacency.to(device)
+        self.timings['adjacency'] = time.perf_counter() - start
+        return adjacency
+
+    def _reverse_csr(self):
+        """Predecessor lists of every segment in CSR form, built once on first use."""
+        if getattr(self, '_reverse', None) is None:
+            order = np.argsort(self.destinations, kind='stable')
+            indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(np.bincount(self.destinations, minlength=self.num_nodes))
+            self._reverse = (indptr, self.origins[order])
+        return self._reverse
+
+    def hops_to(self, destination: int, max_hops: Optional[int] = None) -> np.ndarray:
+        """
+        Number of segments needed to reach destination from every segment, found with a breadth-first
+        search over the reversed edges.
+
+        Args:
+            destination: Token index of the destination segment
+            max_hops: Stop searching after this many hops
+
+        Returns:
+            int64 array of shape (num_nodes,), UNREACHABLE where the destination cannot be reached
+        """
+        indptr, indices = self._reverse_csr()
+        hops = np.full(self.num_nodes, UNREACHABLE, dtype=np.int64)
+        hops[destination] = 0
+        frontier = np.array([destination], dtype=np.int64)
+        hop = 0
+        while frontier.size and (max_hops is None or hop < max_hops):
+            hop += 1
+            # gather the predecessors of the whole frontier at once
+            starts = indptr[frontier]
+            counts = indptr[frontier + 1] - starts
+            offsets = np.cumsum(counts) - counts
+            positions = np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+            predecessors = indices[positions]
+            frontier = np.unique(predecessors[hops[predecessors] == UNREACHABLE])
+            hops[frontier] = hop
+        return hops
+
+    def token_indices(self, geo_ids) -> np.ndarray:
+        """
+        Token index of every road segment ID, through a dense geo_id -> token table built on first use.
+
+        Raises:
+            KeyError if an ID is not part of the road graph
+        """
+        if getattr(self, '_token_lookup', None) is None:
+            lookup = np.full(int(self.geo_ids.max()) + 1 if self.num_nodes else 0, -1, dtype=np.int64)
+            lookup[self.geo_ids] = np.arange(self.num_nodes)
+            self._token_lookup = lookup
+        geo_ids = np.asarray(geo_ids, dtype=np.int64)
+        known = (geo_ids >= 0) & (geo_ids < len(self._token_lookup))
+        tokens = np.where(known, self._token_lookup[np.where(known, geo_ids, 0)], -1)
+        if (tokens < 0).any():
+            raise KeyError(f"Unknown road segment IDs: {geo_ids[tokens < 0][:5].tolist()}")
+        return tokens
+
+    def trajectory_lengths(self, trajectories: List[List[int]]) -> np.ndarray:
+        """
+        Total length of every trajectory (lists of road segment IDs) with one gather over the
+        length array; a segment traversed twice counts twice.
+
+        Returns:
+            float64 array of shape (len(trajectories),)
+        """
+        counts = np.array([len(trajectory) for trajectory in trajectories], dtype=np.int64)
+        if not counts.sum():
+            return np.zeros(len(trajectories))
+        tokens = self.token_indices(np.concatenate([np.asarray(t, dtype=np.int64) for t in trajectories if len(t)]))
+        rows = np.repeat(np.arange(len(trajectories)), counts)
+        return np.bincount(rows, weights=self.lengths[tokens], minlength=len(trajectories))
+
+    def timing_report(self) -> str:
+        """Format the per-stage ingest cost."""
+        total = sum(self.timings.values())
+        lines = [f"Road graph ingest ({self.num_nodes} segments, {self.num_edges} edges):"]
+        for stage, seconds in self.timings.items():
+            lines.append(f"  {stage:<12} {seconds * 1000:9.2f} ms")
+        lines.append(f"  {'total':<12} {total * 1000:9.2f} ms")
+        return "\n".join(lines)
+
+
+def load_road_graph(dataset: str = "SF", use_cache: bool = False, artifact_dir: Optional[str] = None) -> RoadGraph:
+    """
+    Read {dataset}-Taxi/roadmap.geo and roadmap.rel, keeping only the columns the model needs.
+
+    Args:
+        dataset: Dataset name (default: "SF")
+        use_cache: Load the compiled artifact instead of parsing the CSVs, compiling it first
+            if it is missing or the source files changed
+        artifact_dir: Location of the compiled artifact (default: {dataset}-Taxi/roadmap.compiled)
+
+    Returns:
+        RoadGraph with the per-stage ingest times recorded in its timings
+    """
+    if use_cache:
+        graph = load_compiled_road_graph(dataset, artifact_dir)
+        if graph is None:
+            start = time.perf_counter()
+            try:
+                # processes starting together compile once, the others wait and map that artifact
+                compile_road_graph(dataset, artifact_dir, force=False)
+            except OSError:
+                # e.g. a read-only data directory
+                return load_road_graph(dataset)
+            compile_time = time.perf_counter() - start
+            graph = load_compiled_road_graph(dataset, artifact_dir)
+            if graph is None:
+                return load_road_graph(dataset)
+            graph.timings = {'compile': compile_time, **graph.timings}
+        return graph
+
+    timings = {}
+
+    start = time.perf_counter()
+    geo = pd.read_csv(f'{dataset}-Taxi/roadmap.geo', usecols=['geo_id', 'length'])
+    timings['read_geo'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rel = pd.read_csv(f'{dataset}-Taxi/roadmap.rel', usecols=['origin_id', 'destination_id'])
+    timings['read_rel'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    geo_ids = geo['geo_id'].to_numpy(copy=True)
+    lengths = geo['length'].to_numpy(dtype=np.float64, copy=True)
+    origins = rel['origin_id'].to_numpy(dtype=np.int64, copy=True)
+    destinations = rel['destination_id'].to_numpy(dtype=np.int64, copy=True)
+    timings['columns'] = time.perf_counter() - start
+
+    return RoadGraph(geo_ids, lengths, origins, destinations, timings=timings)
+
+
+def load_segment_geometry(dataset: str = "SF", path: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the LineString coordinates of every segment from {dataset}-Taxi/roadmap.geo.
+
+    Args:
+        dataset: Dataset name (default: "SF")
+        path: Another CSV in the roadmap.geo format to read instead
+
+    Returns:
+        points: (P, 2) float64 array of (latitude, longitude), the polylines of all segments back
+            to back in token order
+        counts: (V,) number of points of every segment's polyline
+    """
+    path = path if path is not None else f'{dataset}-Taxi/roadmap.geo'
+    coordinates = pd.read_csv(path, usecols=['coordinates'])['coordinates']
+    # "[[lng, lat], [lng, lat], ...]": one '[' per point plus the outer one
+    counts = coordinates.str.count(r'\[').to_numpy(dtype=np.int64) - 1
+    flat = ",".join(coordinates.str.replace(r'[\[\]\s]', '', regex=True))
+    lng_lat = np.array(flat.split(','), dtype=np.float64).reshape(-1, 2)
+    return lng_lat[:, ::-1].copy(), counts
+
+
+def _artifact_dir(dataset: str, artifact_dir: Optional[str]) -> str:
+    return artifact_dir if artifact_dir is not None else f'{dataset}-Taxi/roadmap.compiled'
+
+
+def _source_stats(dataset: str) -> Dict[str, Dict[str, int]]:
+    stats = {}
+    for name in SOURCE_FILES:
+        st = os.stat(f'{dataset}-Taxi/{name}')
+        stats[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    return stats
+
+
+def _source_hash(dataset: str) -> str:
+    """sha256 over the contents of the source CSVs."""
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        digest.update(name.encode())
+        with open(f'{dataset}-Taxi/{name}', 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _compile_lock(artifact_dir: str):
+    """Exclusive lock on {artifact_dir}.lock, so that only one process at a time writes the artifact."""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{artifact_dir}.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def compile_road_graph(dataset: str = "SF", artifact_dir: Optional[str] = None, force: bool = True) -> str:
+    """
+    Parse the roadmap CSVs once and write the vocabulary, segment lengths, edge list and CSR
+    adjacency as .npy arrays, together with a content hash of the sources in meta.json.
+
+    Args:
+        dataset: Dataset name (default: "SF")
+        artifact_dir: Output directory (default: {dataset}-Taxi/roadmap.compiled)
+        force: Rewrite the artifact even if it is up to date, e.g. because another process
+            compiled it while this one waited for the lock
+
+    Returns:
+        Path of the written artifact
+
+    Raises:
+        OSError: If the artifact directory cannot be written
+    """
+    artifact_dir = _artifact_dir(dataset, artifact_dir)
+    with _compile_lock(artifact_dir):
+        if force or load_compiled_road_graph(dataset, artifact_dir) is None:
+            _write_artifact(dataset, artifact_dir)
+    return artifact_dir
+
+
+def _write_artifact(dataset: str, artifact_dir: str):
+    stats = _source_stats(dataset)
+    graph = load_road_graph(dataset)
+    adjacency = SparseAdjacency.from_edges(graph.origins, graph.destinations, num_nodes=graph.num_nodes)
+    arrays = {
+        'geo_ids': graph.geo_ids,
+        'lengths': graph.lengths,
+        'origins': graph.origins,
+        'destinations': graph.destinations,
+        'indptr': adjacency.indptr.numpy(),
+        'indices': adjacency.indices.numpy(),
+    }
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'dataset': dataset,
+        'num_nodes': graph.num_nodes,
+        'num_edges': graph.num_edges,
+        'source_sha256': _source_hash(dataset),
+        'source_stats': stats,
+    }
+
+    # write next to the final location and swap it in, so readers never see a partial artifact
+    tmp_dir = f'{artifact_dir}.tmp-{os.getpid()}'
+    old_dir = f'{artifact_dir}.old-{os.getpid()}'
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), array, allow_pickle=False)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=4)
+        # a directory cannot be renamed onto a non-empty one: move the old artifact aside first,
+        # readers that already mapped its arrays keep them
+        if os.path.isdir(artifact_dir):
+            os.rename(artifact_dir, old_dir)
+        os.replace(tmp_dir, artifact_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_compiled_road_graph(dataset: str = "SF", artifact_dir: Optional[str] = None) -> Optional[RoadGraph]:
+    """
+    Memory-map a compiled road graph artifact.
+
+    Args:
+        dataset: Dataset name (default: "SF")
+        artifact_dir: Artifact directory (default: {dataset}-Taxi/roadmap.compiled)
+
+    Returns:
+        RoadGraph backed by the mapped arrays, or None if the artifact is missing or unreadable
+        (e.g. replaced by another process meanwhile), was written by another version, or the
+        source CSVs no longer match its content hash
+    """
+    artifact_dir = _artifact_dir(dataset, artifact_dir)
+    try:
+        return _map_artifact(dataset, artifact_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _map_artifact(dataset: str, artifact_dir: str) -> Optional[RoadGraph]:
+    meta_path = os.path.join(artifact_dir, 'meta.json')
+    timings = {}
+
+    start = time.perf_counter()
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != ARTIFACT_VERSION:
+        return None
+    # unchanged size and mtime are taken as unchanged content, otherwise fall back to the hash
+    stats = _source_stats(dataset)
+    if stats != meta['source_stats']:
+        if _source_hash(dataset) != meta['source_sha256']:
+            return None
+        meta['source_stats'] = stats
+        tmp_path = f'{meta_path}.tmp-{os.getpid()}'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f, indent=4)
+            os.replace(tmp_path, meta_path)
+        except OSError:
+            # read-only artifact: the hash is checked again next time
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    timings['validate'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # copy-on-write mapping: pages are read lazily and the arrays stay writable for torch
+    arrays = {name: np.load(os.path.join(artifact_dir, f'{name}.npy'), mmap_mode='c') for name in ARTIFACT_ARRAYS}
+    timings['mmap'] = time.perf_counter() - start
+
+    return RoadGraph(arrays['geo_ids'], arrays['lengths'], arrays['origins'], arrays['destinations'],
+                     indptr=arrays['indptr'], indices=arrays['indices'], timings=timings)
+
+
+if __name__ == "__main__":
+    import sys
+    dataset = sys.argv[1] if len(sys.argv) > 1 else "SF"
+    artifact_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"Compiled road graph written to {compile_road_graph(dataset, artifact_dir)}")
@@ -0,0 +1,398 @@
+import math
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from mobilitygpt.config import get_base_config
+from .geodesic import EARTH_RADIUS
+from .roadmap import RoadGraph, load_road_graph, load_segment_geometry
+from .spatial_index import SegmentIndex
+
+ALGORITHMS = ('dijkstra', 'astar', 'ch')
+
+
+def _adjacency_lists(indptr: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> List[List[Tuple[int, float]]]:
+    """CSR arrays as one list of (target, weight) pairs per node."""
+    pairs = list(zip(targets.tolist(), weights.tolist()))
+    bounds = indptr.tolist()
+    return [pairs[bounds[u]:bounds[u + 1]] for u in range(len(bounds) - 1)]
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a weighted directed graph, for repeated shortest path queries.
+
+    Nodes are contracted one by one in order of importance (edge difference, number of contracted
+    neighbours and depth in the hierarchy); whenever the only shortest path between two neighbours of a contracted
+    node runs through it, a shortcut edge is added. A query is then a bidirectional Dijkstra that
+    only ever moves up the hierarchy, which settles a few hundred nodes instead of the whole graph.
+    """
+
+    def __init__(self,
+                 rank: np.ndarray,
+                 up_indptr: np.ndarray, up_targets: np.ndarray, up_weights: np.ndarray,
+                 down_indptr: np.ndarray, down_targets: np.ndarray, down_weights: np.ndarray,
+                 shortcuts: np.ndarray):
+        """
+        Args:
+            rank: (V,) contraction order of every node
+            up_indptr, up_targets, up_weights: CSR of the edges u -> x with rank[x] > rank[u]
+            down_indptr, down_targets, down_weights: CSR of the reversed edges x <- u with
+                rank[u] > rank[x], indexed by x
+            shortcuts: (S, 3) int64 rows (u, x, middle) of the shortcut edges
+        """
+        self.rank = rank
+        self.up = (up_indptr, up_targets, up_weights)
+        self.down = (down_indptr, down_targets, down_weights)
+        self.shortcuts = shortcuts
+        self._middle = {(int(u), int(x)): int(m) for u, x, m in shortcuts.tolist()}
+        # per-node Python adjacency lists, the query loop is far faster on these than on array scalars
+        self._adjacency = tuple(_adjacency_lists(*csr) for csr in (self.up, self.down))
+
+    @classmethod
+    def build(cls, num_nodes: int, origins: np.ndarray, destinations: np.ndarray, weights: np.ndarray,
+              max_settled: int = 500) -> "ContractionHierarchy":
+        """
+        Contract the graph given as an edge list.
+
+        Args:
+            num_nodes: Number of nodes
+            origins, destinations, weights: Edges and their non-negative weights
+            max_settled: Node budget of every witness search; a search that runs out adds the
+                shortcut, which costs query time but never correctness
+        """
+        out_edges = [dict() for _ in range(num_nodes)]
+        in_edges = [dict() for _ in range(num_nodes)]
+        for u, v, w in zip(origins.tolist(), destinations.tolist(), weights.tolist()):
+            if u != v and w < out_edges[u].get(v, np.inf):
+                out_edges[u][v] = w
+                in_edges[v][u] = w
+        middle = {}
+        contracted = np.zeros(num_nodes, dtype=bool)
+        contracted_neighbours = np.zeros(num_nodes, dtype=np.int64)
+        level = np.zeros(num_nodes, dtype=np.int64)
+        rank = np.zeros(num_nodes, dtype=np.int64)
+        up = [[] for _ in range(num_nodes)]
+        down = [[] for _ in range(num_nodes)]
+
+        def witness_search(source, avoid, limit):
+            # Dijkstra from source in the remaining graph without avoid, up to distance limit
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < max_settled:
+                d, u = heapq.heappop(heap)
+                if d > limit:
+                    break
+                if d > dist[u]:
+                    continue
+                settled += 1
+                for x, w in out_edges[u].items():
+                    nd = d + w
+                    if x != avoid and nd < dist.get(x, np.inf):
+                        dist[x] = nd
+                        heapq.heappush(heap, (nd, x))
+            return dist
+
+        def needed_shortcuts(v):
+            # one witness search per incoming neighbour covers all outgoing neighbours
+            shortcuts = []
+            for u, w_in in in_edges[v].items():
+                candidates = [(x, w_in + w_out) for x, w_out in out_edges[v].items() if x != u]
+                if not candidates:
+                    continue
+                dist = witness_search(u, v, max(weight for _, weight in candidates))
+                shortcuts += [(u, x, weight) for x, weight in candidates if dist.get(x, np.inf) > weight]
+            return shortcuts
+
+        def priority(v):
+            edge_difference = len(needed_shortcuts(v)) - len(in_edges[v]) - len(out_edges[v])
+            return 2 * edge_difference + contracted_neighbours[v] + level[v]
+
+        # lazy updates: a popped node whose priority went up is pushed back
+        heap = [(priority(v), v) for v in range(num_nodes)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            current = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            for u, x, weight in needed_shortcuts(v):
+                out_edges[u][x] = weight
+                in_edges[x][u] = weight
+                middle[(u, x)] = v
+            # every remaining edge of v leads up the hierarchy
+            for x, w in out_edges[v].items():
+                up[v].append((x, w))
+                in_edges[x].pop(v)
+                contracted_neighbours[x] += 1
+                level[x] = max(level[x], level[v] + 1)
+            for u, w in in_edges[v].items():
+                down[v].append((u, w))
+                out_edges[u].pop(v)
+                contracted_neighbours[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            out_edges[v], in_edges[v] = {}, {}
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+
+        def to_csr(adjacency):
+            counts = np.array([len(edges) for edges in adjacency], dtype=np.int64)
+            indptr = np.concatenate(([0], np.cumsum(counts)))
+            targets = np.array([x for edges in adjacency for x, _ in edges], dtype=np.int64)
+            weights = np.array([w for edges in adjacency for _, w in edges], dtype=np.float64)
+            return indptr, targets, weights
+
+        # keep only the shortcuts that made it into the hierarchy (later ones may replace earlier ones)
+        used = {(v, x) for v in range(num_nodes) for x, _ in up[v]} | {(u, v) for v in range(num_nodes) for u, _ in down[v]}
+        shortcuts = np.array([(u, x, m) for (u, x), m in middle.items() if (u, x) in used], dtype=np.int64).reshape(-1, 3)
+        return cls(rank, *to_csr(up), *to_csr(down), shortcuts)
+
+    def save(self, path: str):
+        np.savez(path, rank=self.rank,
+                 up_indptr=self.up[0], up_targets=self.up[1], up_weights=self.up[2],
+                 down_indptr=self.down[0], down_targets=self.down[1], down_weights=self.down[2],
+                 shortcuts=self.shortcuts)
+
+    @classmethod
+    def load(cls, path: str) -> "ContractionHierarchy":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['rank'],
+                       data['up_indptr'], data['up_targets'], data['up_weights'],
+                       data['down_indptr'], data['down_targets'], data['down_weights'],
+                       data['shortcuts'])
+
+    def shortest_path(self, source: int, target: int) -> Tuple[float, List[int]]:
+        """
+        Returns:
+            Distance and node sequence of the shortest path, (inf, []) if target is unreachable
+        """
+        if source == target:
+            return 0.0, [source]
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: None}, {target: None})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best, meeting = np.inf, None
+        while heaps[0] or heaps[1]:
+            # stop once neither search can improve the best meeting point
+            if min(heap[0][0] if heap else np.inf for heap in heaps) >= best:
+                break
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, u = heapq.heappop(heaps[side])
+            if d > dist[side][u]:
+                continue
+            if u in dist[1 - side] and d + dist[1 - side][u] < best:
+                best, meeting = d + dist[1 - side][u], u
+            # stall-on-demand: u is reached shorter through a higher node, so its edges can wait
+            if any(dist[side].get(x, np.inf) + w < d for x, w in self._adjacency[1 - side][u]):
+                continue
+            for x, w in self._adjacency[side][u]:
+                nd = d + w
+                if nd < dist[side].get(x, np.inf):
+                    dist[side][x] = nd
+                    parent[side][x] = u
+                    heapq.heappush(heaps[side], (nd, x))
+        if meeting is None:
+            return np.inf, []
+
+        path = [meeting]
+        while parent[0][path[0]] is not None:
+            path.insert(0, parent[0][path[0]])
+        u = meeting
+        while parent[1][u] is not None:
+            u = parent[1][u]
+            path.append(u)
+        return best, self._unpack(path)
+
+    def _unpack(self, path: List[int]) -> List[int]:
+        """Replace every shortcut of path by the original edges it stands for."""
+        nodes = [path[0]]
+        stack = [(u, x) for u, x in zip(path[-2::-1], path[:0:-1])]
+        while stack:
+            u, x = stack.pop()
+            m = self._middle.get((u, x))
+            if m is None:
+                nodes.append(x)
+            else:
+                stack += [(m, x), (u, m)]
+        return nodes
+
+
+class OfflineRouter:
+    """
+    Network-free stand-in for the Google Directions API over the dataset's road graph.
+
+    Nodes are road segments and a route moves from the middle of one segment to the middle of the
+    next, so every transition u -> v costs (length[u] + length[v]) / 2 and a route between two
+    segments is measured from midpoint to midpoint. Query coordinates are snapped to the nearest
+    segment through a SegmentIndex. Durations assume a constant speed and no traffic.
+    """
+
+    def __init__(self,
+                 graph: RoadGraph,
+                 geometry: Tuple[np.ndarray, np.ndarray],
+                 algorithm: Optional[str] = None,
+                 speed_kmh: Optional[float] = None,
+                 hierarchy_path: Optional[str] = None):
+        """
+        Args:
+            graph: Road graph (segment lengths and transitions)
+            geometry: Segment polylines as returned by load_segment_geometry
+            algorithm: 'dijkstra', 'astar' or 'ch' (contraction hierarchy, built on first use)
+            speed_kmh: Travel speed used for the durations
+            hierarchy_path: .npz file the contraction hierarchy is loaded from, or saved to once built
+        """
+        config = get_base_config().routing
+        self.graph = graph
+        self.algorithm = algorithm if algorithm is not None else config.algorithm
+        assert self.algorithm in ALGORITHMS, f"unknown routing algorithm {self.algorithm}"
+        self.speed = (speed_kmh if speed_kmh is not None else config.speed_kmh) / 3.6  # m/s
+        self.hierarchy_path = hierarchy_path if hierarchy_path is not None else config.hierarchy_path
+        self._hierarchy = None
+
+        points, counts = geometry
+        last = np.cumsum(counts) - 1
+        self.starts = points[last - counts + 1]
+        self.ends = points[last]
+        self.midpoints = (self.starts + self.ends) / 2
+        self.index = SegmentIndex(points, counts)
+        # segment ends in radians as Python floats, for the per-node A* heuristic
+        self._end_lat = np.radians(self.ends[:, 0]).tolist()
+        self._end_lng = np.radians(self.ends[:, 1]).tolist()
+        self._end_cos = np.cos(np.radians(self.ends[:, 0])).tolist()
+
+        lengths = np.asarray(graph.lengths, dtype=np.float64)
+        order = np.argsort(graph.origins, kind='stable')
+        self.indptr = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(graph.origins, minlength=graph.num_nodes))
+        self.targets = np.asarray(graph.destinations)[order]
+        self.weights = (lengths[graph.origins[order]] + lengths[self.targets]) / 2
+        self._adjacency = _adjacency_lists(self.indptr, self.targets, self.weights)
+
+    @classmethod
+    def from_dataset(cls, dataset: str = "SF", **kwargs) -> "OfflineRouter":
+        graph = load_road_graph(dataset, use_cache=get_base_config().data.graph_cache)
+        return cls(graph, load_segment_geometry(dataset), **kwargs)
+
+    @property
+    def hierarchy(self) -> ContractionHierarchy:
+        if self._hierarchy is None:
+            try:
+                self._hierarchy = ContractionHierarchy.load(self.hierarchy_path)
+            except (OSError, TypeError, ValueError):
+                origins = np.repeat(np.arange(self.graph.num_nodes), np.diff(self.indptr))
+                self._hierarchy = ContractionHierarchy.build(self.graph.num_nodes, origins, self.targets, self.weights)
+                if self.hierarchy_path is not None:
+                    self._hierarchy.save(self.hierarchy_path)
+        return self._hierarchy
+
+    def snap(self, location) -> int:
+        """Token index of the segment whose midpoint is nearest to a (latitude, longitude) or "lat,lng" location."""
+        if isinstance(location, str):
+            lat, lng = (float(part) for part in location.split(','))
+        else:
+            lat, lng = float(location[0]), float(location[1])
+        segments, _ = self.index.nearest((lat, lng))
+        return int(segments[0])
+
+    def shortest_path(self, source: int, target: int, algorithm: Optional[str] = None) -> Tuple[float, List[int]]:
+        """
+        Shortest route between two segments.
+
+        Args:
+            source: Token index of the first segment
+            target: Token index of the last segment
+            algorithm: Overrides the router's algorithm for this query
+
+        Returns:
+            Distance in meters and the token indices of the traversed segments, (inf, []) if there is no route
+        """
+        algorithm = algorithm if algorithm is not None else self.algorithm
+        if algorithm == 'ch':
+            return self.hierarchy.shortest_path(source, target)
+        return self._search(source, target, astar=algorithm == 'astar')
+
+    def _search(self, source: int, target: int, astar: bool) -> Tuple[float, List[int]]:
+        if astar:
+            # straight line from the end of a segment to the start of the target: the rest of the
+            # segment and every segment in between are at least as long as their chords. Computed
+            # when the search first reaches a segment, so a query never touches the whole graph
+            target_lat, target_lng = (math.radians(value) for value in self.starts[target])
+            target_cos = math.cos(target_lat)
+            end_lat, end_lng, end_cos = self._end_lat, self._end_lng, self._end_cos
+            sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        adjacency = self._adjacency
+        dist = {source: 0.0}
+        heuristic = {source: 0.0, target: 0.0}
+        parent = {source: None}
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == target:
+                path = [u]
+                while parent[path[-1]] is not None:
+                    path.append(parent[path[-1]])
+                return d, path[::-1]
+            for x, w in adjacency[u]:
+                nd = d + w
+                known = dist.get(x)
+                if known is not None and nd >= known:
+                    continue
+                dist[x] = nd
+                parent[x] = u
+                if not astar:
+                    heapq.heappush(heap, (nd, nd, x))
+                    continue
+                h = heuristic.get(x)
+                if h is None:
+                    a = sin((target_lat - end_lat[x]) / 2) ** 2 + end_cos[x] * target_cos * sin((target_lng - end_lng[x]) / 2) ** 2
+                    h = heuristic[x] = 2 * EARTH_RADIUS * asin(sqrt(min(a, 1.0)))
+                heapq.heappush(heap, (nd + h, nd, x))
+        return np.inf, []
+
+    def get_route(self, origin, destination) -> Optional[Dict]:
+        """
+        Route between two locations in the format of RouteQualityTool.get_google_maps_route.
+
+        Args:
+            origin: Starting point (latitude, longitude)
+            destination: Ending point (latitude, longitude)
+
+        Returns:
+            Dictionary with duration, duration_in_traffic, distance, start/end address and steps,
+            or None if there is no route
+        """
+        source, target = self.snap(origin), self.snap(destination)
+        distance, path = self.shortest_path(source, target)
+        if not path:
+            print(f"Offline routing error: no route from segment {source} to segment {target}")
+            return None
+
+        geo_ids = self.graph.geo_ids
+        steps = []
+        for u, v in zip(path[:-1], path[1:]):
+            step_distance = (float(self.graph.lengths[u]) + float(self.graph.lengths[v])) / 2
+            steps.append({
+                'geo_id': int(geo_ids[v]),
+                'distance': {'value': int(round(step_distance))},
+                'duration': {'value': int(round(step_distance / self.speed))},
+                'start_location': {'lat': float(self.midpoints[u, 0]), 'lng': float(self.midpoints[u, 1])},
+                'end_location': {'lat': float(self.midpoints[v, 0]), 'lng': float(self.midpoints[v, 1])},
+            })
+        duration = int(round(distance / self.speed))
+        return {
+            'duration': duration,
+            'duration_in_traffic': duration,
+            'distance': int(round(distance)),
+            'start_address': f"segment {geo_ids[source]}",
+            'end_address': f"segment {geo_ids[target]}",
+            'steps': steps
+        }
@@ -0,0 +1,175 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from mobilitygpt.config import get_base_config
+from .geodesic import EARTH_RADIUS
+from .roadmap import load_segment_geometry
+
+# cell offsets of a 3x3 block around the home cell
+_NEIGHBOURHOOD = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=np.int64)
+# widest band of rings scanned in one pass of a nearest query
+_MAX_BAND_WIDTH = 16
+
+
+def _ring_band(first: int, last: int) -> np.ndarray:
+    """Cell offsets of the rings first..last (Chebyshev distance) around a cell."""
+    side = np.arange(-last, last + 1)
+    dx, dy = np.meshgrid(side, side, indexing='ij')
+    keep = np.maximum(np.abs(dx), np.abs(dy)) >= first
+    return np.stack((dx[keep], dy[keep]), axis=1)
+
+
+class SegmentIndex:
+    """
+    Uniform grid over the road segment polylines for nearest-segment queries.
+
+    Coordinates are projected to a local equirectangular plane in meters (accurate to well below a
+    meter at city scale). Every piece of a polyline (two consecutive points) is registered in all grid
+    cells its bounding box overlaps, and a query scans rings of cells around the query point (outside
+    the grid: around the nearest cell on its boundary), outwards, until no unscanned cell can hold
+    anything closer than the best piece found so far. All queries of a batch advance ring by ring
+    together, so a batch costs a handful of NumPy calls per ring.
+    """
+
+    def __init__(self, points: np.ndarray, counts: np.ndarray, cell_size: Optional[float] = None):
+        """
+        Args:
+            points: (P, 2) (latitude, longitude) of all segment polylines back to back, in token order
+            counts: (V,) number of points of every polyline, see roadmap.load_segment_geometry
+            cell_size: Grid cell edge length in meters
+        """
+        self.cell_size = cell_size if cell_size is not None else get_base_config().data.spatial_cell_size
+        self.num_segments = len(counts)
+        self.origin = points.mean(axis=0) if len(points) else np.zeros(2)
+        xy = self.project(points)
+
+        # pieces between consecutive points of the same polyline; single-point polylines become
+        # degenerate pieces so that every segment can be found
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        owner = np.repeat(np.arange(len(counts)), counts)
+        is_last = np.zeros(len(points), dtype=bool)
+        is_last[ends[counts > 0] - 1] = True
+        single = np.zeros(len(points), dtype=bool)
+        single[starts[counts == 1]] = True
+        first = np.flatnonzero(~is_last | single)
+        second = np.where(single[first], first, first + 1)
+        self.piece_a = xy[first]
+        self.piece_b = xy[second]
+        self.piece_segment = owner[first]
+
+        # cell ranges covered by every piece's bounding box
+        low = np.minimum(self.piece_a, self.piece_b)
+        high = np.maximum(self.piece_a, self.piece_b)
+        self.grid_min = low.min(axis=0) if len(low) else np.zeros(2)
+        low_cell = self._cell(low)
+        high_cell = self._cell(high)
+        self.shape = (high_cell.max(axis=0) + 1) if len(high_cell) else np.ones(2, dtype=np.int64)
+
+        # enumerate (cell, piece) pairs and sort them into a CSR table over the flattened cells
+        spans = high_cell - low_cell + 1
+        per_piece = spans[:, 0] * spans[:, 1]
+        piece = np.repeat(np.arange(len(per_piece)), per_piece)
+        k = np.arange(per_piece.sum()) - np.repeat(np.cumsum(per_piece) - per_piece, per_piece)
+        cx = low_cell[piece, 0] + k // spans[piece, 1]
+        cy = low_cell[piece, 1] + k % spans[piece, 1]
+        cell = cx * self.shape[1] + cy
+        order = np.argsort(cell, kind='stable')
+        self.cell_pieces = piece[order]
+        self.cell_indptr = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        self.cell_indptr[1:] = np.cumsum(np.bincount(cell, minlength=self.shape[0] * self.shape[1]))
+
+    @classmethod
+    def from_dataset(cls, dataset: str = "SF", path: Optional[str] = None,
+                     cell_size: Optional[float] = None) -> "SegmentIndex":
+        """Index the segments of {dataset}-Taxi/roadmap.geo, or of another roadmap.geo-format CSV at path."""
+        return cls(*load_segment_geometry(dataset, path), cell_size=cell_size)
+
+    def project(self, lat_lng: np.ndarray) -> np.ndarray:
+        """(latitude, longitude) in degrees -> local planar (x, y) in meters."""
+        lat_lng = np.asarray(lat_lng, dtype=np.float64).reshape(-1, 2)
+        scale = np.pi / 180 * EARTH_RADIUS
+        x = (lat_lng[:, 1] - self.origin[1]) * scale * np.cos(np.radians(self.origin[0]))
+        y = (lat_lng[:, 0] - self.origin[0]) * scale
+        return np.stack((x, y), axis=1)
+
+    def _cell(self, xy: np.ndarray) -> np.ndarray:
+        return np.floor((xy - self.grid_min) / self.cell_size).astype(np.int64)
+
+    def _distances(self, queries: np.ndarray, pieces: np.ndarray) -> np.ndarray:
+        """Distance from every query point to the matching piece (closest point on the piece)."""
+        a, b = self.piece_a[pieces], self.piece_b[pieces]
+        ab = b - a
+        length2 = (ab ** 2).sum(axis=1)
+        t = np.clip(((queries - a) * ab).sum(axis=1) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        closest = a + t[:, None] * ab
+        return np.sqrt(((queries - closest) ** 2).sum(axis=1))
+
+    def nearest(self, lat_lng: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest road segment of every query point.
+
+        Args:
+            lat_lng: (N, 2) array of (latitude, longitude), or a single pair
+
+        Returns:
+            Token indices (N,) of the nearest segments and their distances (N,) in meters
+        """
+        queries = self.project(lat_lng)
+        n = len(queries)
+        best = np.full(n, np.inf)
+        best_segment = np.full(n, -1, dtype=np.int64)
+        if not len(self.piece_segment):
+            return best_segment, best
+
+        # queries outside the grid search around the nearest cell on its boundary: with p the closest
+        # point of the grid box, everything in the box is at least hypot(|x - p|, |q - p|) from q
+        grid_max = self.grid_min + self.shape * self.cell_size
+        outside = np.sqrt(((queries - np.clip(queries, self.grid_min, grid_max)) ** 2).sum(axis=1))
+        home = np.clip(self._cell(queries), 0, self.shape - 1)
+        # last ring that still reaches into the grid
+        last_ring = np.maximum(home, self.shape - 1 - home).max(axis=1)
+        active = np.arange(n)
+        scanned = -1  # rings up to this one are done
+        width = 1
+        while len(active):
+            active = active[last_ring[active] > scanned]
+            if not len(active):
+                break
+            if scanned < 0:
+                # the first pass covers the home cell and its 8 neighbours, which settles most queries
+                offsets, scanned = _NEIGHBOURHOOD, 1
+            else:
+                # then bands of rings, wider every pass, so that queries needing many rings (far outside
+                # the grid, or in empty areas) take few passes
+                offsets = _ring_band(scanned + 1, scanned + width)
+                scanned += width
+                width = min(2 * width, _MAX_BAND_WIDTH)
+            cells = home[active, None, :] + offsets[None, :, :]  # (A, O, 2)
+            inside = ((cells >= 0) & (cells < self.shape)).all(axis=2)
+            query_index = np.broadcast_to(active[:, None], inside.shape)[inside]
+            flat_cells = cells[inside][:, 0] * self.shape[1] + cells[inside][:, 1]
+
+            # gather the pieces of all (query, cell) pairs at once, grouped by query
+            starts = self.cell_indptr[flat_cells]
+            counts = self.cell_indptr[flat_cells + 1] - starts
+            total = counts.sum()
+            if total:
+                pair_query = np.repeat(query_index, counts)
+                positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+                pieces = self.cell_pieces[positions]
+                distances = self._distances(queries[pair_query], pieces)
+                segments = self.piece_segment[pieces]
+                # closest piece per query; ties go to the lowest token index
+                group = np.flatnonzero(np.concatenate(([True], pair_query[1:] != pair_query[:-1])))
+                q = pair_query[group]
+                d = np.minimum.reduceat(distances, group)
+                is_min = distances == np.repeat(d, np.diff(np.append(group, total)))
+                s = np.minimum.reduceat(np.where(is_min, segments, self.num_segments), group)
+                better = (d < best[q]) | ((d == best[q]) & (s < best_segment[q]))
+                best[q[better]] = d[better]
+                best_segment[q[better]] = s[better]
+
+            # everything in the rings beyond is at least scanned * cell_size away from the home cell
+            active = active[best[active] > np.hypot(scanned * self.cell_size, outside[active])]
+        return best_segment, best
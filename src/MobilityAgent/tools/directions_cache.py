@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+from mobilitygpt.config import get_base_config
+
+Location = Union[str, Tuple[float, float]]
+
+
+def normalize_location(location: Location) -> str:
+    """
+    Canonical form of an origin/destination: coordinates are rounded to 5 decimals (about a meter),
+    addresses are lower-cased with collapsed whitespace.
+    """
+    if isinstance(location, str):
+        parts = location.split(',')
+        try:
+            # "lat,lng" strings share entries with coordinate tuples
+            if len(parts) == 2:
+                location = (float(parts[0]), float(parts[1]))
+        except ValueError:
+            pass
+    if isinstance(location, (tuple, list)):
+        return f"{float(location[0]):.5f},{float(location[1]):.5f}"
+    return " ".join(str(location).lower().split())
+
+
+def make_key(origin: Location, destination: Location, departure_time: str = "now", **params) -> str:
+    """Cache key of a Directions query; extra request parameters (e.g. waypoints) are included."""
+    parts = [normalize_location(origin), normalize_location(destination), str(departure_time).strip().lower()]
+    parts += [f"{k}={params[k]}" for k in sorted(params)]
+    return "|".join(parts)
+
+
+class DirectionsCache:
+    """
+    Two-tier cache of Google Directions API responses shared by the maps tools: an in-memory LRU in
+    front of an SQLite table, so entries survive restarts and are shared between processes.
+
+    Responses carry live traffic (duration_in_traffic), so by default an entry is only served for
+    traffic_ttl seconds; callers that only need the static route fields (distance, steps, addresses)
+    can ask for require_traffic=False and get entries up to static_ttl seconds old.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 traffic_ttl: Optional[float] = None,
+                 static_ttl: Optional[float] = None,
+                 memory_size: Optional[int] = None):
+        """
+        Args:
+            path: SQLite file of the persistent tier, None to keep the cache in memory only
+            traffic_ttl: Lifetime in seconds of traffic-sensitive fields
+            static_ttl: Lifetime in seconds of the static route fields
+            memory_size: Number of entries kept in the in-memory LRU tier
+        """
+        config = get_base_config().maps
+        self.traffic_ttl = traffic_ttl if traffic_ttl is not None else config.traffic_ttl
+        self.static_ttl = static_ttl if static_ttl is not None else config.static_ttl
+        self.memory_size = memory_size if memory_size is not None else config.memory_cache_size
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'expired': 0, 'writes': 0}
+
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS directions '
+                '(key TEXT PRIMARY KEY, response TEXT NOT NULL, fetched_at REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> "DirectionsCache":
+        """Process-wide cache at the configured location, used by the tools by default."""
+        if cls._shared is None:
+            cls._shared = cls(path=get_base_config().maps.cache_path)
+        return cls._shared
+
+    def get(self, key: str, require_traffic: bool = True) -> Optional[Dict]:
+        """Return the cached response for key if it is fresh enough, else None."""
+        entry = self.lookup(key, self.traffic_ttl if require_traffic else self.static_ttl)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, key: str, max_age: float) -> Optional[Tuple[Dict, float]]:
+        """Return the cached response for key and its age in seconds if it is at most max_age old, else None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                if now - entry[1] <= max_age:
+                    self._stats['memory_hits'] += 1
+                    return entry[0], now - entry[1]
+
+            if self._db is not None:
+                row = self._db.execute('SELECT response, fetched_at FROM directions WHERE key = ?', (key,)).fetchone()
+                if row is not None and (entry is None or row[1] > entry[1]):
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, entry)
+                    if now - entry[1] <= max_age:
+                        self._stats['disk_hits'] += 1
+                        return entry[0], now - entry[1]
+
+            self._stats['expired' if entry is not None else 'misses'] += 1
+            return None
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since key was fetched, None if it is not cached; not counted in the stats."""
+        with self._lock:
+            entry = self._memory.get(key)
+            fetched_at = entry[1] if entry is not None else None
+            if self._db is not None:
+                row = self._db.execute('SELECT fetched_at FROM directions WHERE key = ?', (key,)).fetchone()
+                if row is not None and (fetched_at is None or row[0] > fetched_at):
+                    fetched_at = row[0]
+        return time.time() - fetched_at if fetched_at is not None else None
+
+    def put(self, key: str, response: Dict, fetched_at: Optional[float] = None):
+        """Store a successful API response."""
+        entry = (response, fetched_at if fetched_at is not None else time.time())
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO directions (key, response, fetched_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(response), entry[1])
+                )
+                self._db.commit()
+            self._stats['writes'] += 1
+
+    def _remember(self, key: str, entry: Tuple[Dict, float]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Drop entries older than static_ttl from both tiers; returns the number of disk rows removed."""
+        cutoff = time.time() - self.static_ttl
+        with self._lock:
+            for key in [k for k, (_, fetched_at) in self._memory.items() if fetched_at < cutoff]:
+                del self._memory[key]
+            if self._db is None:
+                return 0
+            removed = self._db.execute('DELETE FROM directions WHERE fetched_at < ?', (cutoff,)).rowcount
+            self._db.commit()
+            return removed
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters; expired counts lookups that found only a stale entry."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses'] + stats['expired']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM directions')
+                self._db.commit()
@@ -0,0 +1,151 @@
+import time
+from typing import Dict, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from mobilitygpt.config import get_base_config
+from .directions_cache import DirectionsCache, Location, make_key, normalize_location
+from .traffic_prefetcher import TrafficPrefetcher
+
+# HTTP statuses and Directions API statuses worth another attempt
+RETRY_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRY_API_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+
+class DirectionsClient:
+    """
+    Google Directions API access for the maps tools: a pooled HTTP session that is safe to use
+    from several threads, per-request timeouts, retries with exponential backoff, and the shared
+    response cache in front of it.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 cache: Optional[DirectionsCache] = None,
+                 base_url: Optional[str] = None,
+                 timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None,
+                 retry_backoff: Optional[float] = None,
+                 pool_size: Optional[int] = None,
+                 prefetcher: Optional[TrafficPrefetcher] = None):
+        """
+        Args:
+            api_key: Google Maps API key
+            cache: Response cache (default: the process-wide DirectionsCache)
+            base_url: Directions endpoint, e.g. a local stand-in for tests
+            timeout: Seconds to wait for each HTTP request
+            max_retries: Additional attempts after a failed request
+            retry_backoff: Delay before the first retry, doubled on every further retry
+            pool_size: Number of pooled connections, i.e. concurrent requests without reconnecting
+            prefetcher: Background refresher of hot queries, which also lets fetch serve stale
+                traffic while revalidating (default: the shared one if maps.prefetch is set)
+        """
+        config = get_base_config().maps
+        self.api_key = api_key
+        self.cache = cache if cache is not None else DirectionsCache.shared()
+        self.base_url = base_url if base_url is not None else config.directions_url
+        self.geocode_url = config.geocode_url
+        self.timeout = timeout if timeout is not None else config.request_timeout
+        self.max_retries = max_retries if max_retries is not None else config.max_retries
+        self.retry_backoff = retry_backoff if retry_backoff is not None else config.retry_backoff
+        pool_size = pool_size if pool_size is not None else config.max_concurrent_requests
+        if prefetcher is None and config.prefetch:
+            prefetcher = TrafficPrefetcher.shared()
+        self.prefetcher = prefetcher
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self,
+              origin: Location,
+              destination: Location,
+              departure_time: str = "now",
+              require_traffic: bool = True,
+              **params) -> Dict:
+        """
+        Directions API response for a query, from the cache when fresh enough.
+
+        Args:
+            origin: Starting point, an address or (latitude, longitude)
+            destination: Ending point, an address or (latitude, longitude)
+            departure_time: Time of departure (default: "now")
+            require_traffic: Only accept cached entries whose traffic data is still valid
+            **params: Further query parameters, e.g. waypoints
+
+        Returns:
+            The parsed JSON response; check its 'status'. Only 'OK' responses are cached.
+
+        Raises:
+            requests.exceptions.RequestException if the request still fails after the retries
+        """
+        key = make_key(origin, destination, departure_time, **params)
+        ttl = self.cache.traffic_ttl if require_traffic else self.cache.static_ttl
+        max_age = ttl
+        if self.prefetcher is not None:
+            self.prefetcher.record(self, origin, destination, departure_time, **params)
+            if require_traffic:
+                max_age = max(ttl, self.prefetcher.stale_ttl)
+        entry = self.cache.lookup(key, max_age)
+        if entry is not None:
+            data, age = entry
+            if age > ttl:
+                # stale-while-revalidate: answer now, refresh in the background
+                self.prefetcher.revalidate(key)
+            return data
+        return self.refresh(origin, destination, departure_time, **params)
+
+    def refresh(self, origin: Location, destination: Location, departure_time: str = "now", **params) -> Dict:
+        """Request a query from the API regardless of the cache, and cache the response if it is OK."""
+        key = make_key(origin, destination, departure_time, **params)
+        query = {
+            'origin': normalize_location(origin) if not isinstance(origin, str) else origin,
+            'destination': normalize_location(destination) if not isinstance(destination, str) else destination,
+            'departure_time': departure_time,
+            'key': self.api_key,
+            **params,
+        }
+        data = self._request(query)
+        if data['status'] == 'OK':
+            self.cache.put(key, data)
+        return data
+
+    def geocode(self, address: str) -> Optional[Tuple[float, float]]:
+        """
+        (latitude, longitude) of an address from the Geocoding API, cached like static route fields.
+
+        Returns:
+            The location of the best match, or None if the address was not found
+
+        Raises:
+            requests.exceptions.RequestException if the request still fails after the retries
+        """
+        key = f"geocode|{normalize_location(address)}"
+        data = self.cache.get(key, require_traffic=False)
+        if data is None:
+            data = self._request({'address': address, 'key': self.api_key}, url=self.geocode_url)
+            if data['status'] != 'OK':
+                return None
+            self.cache.put(key, data)
+        location = data['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+    def _request(self, query: Dict, url: Optional[str] = None) -> Dict:
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.get(url or self.base_url, params=query, timeout=self.timeout)
+                if response.status_code in RETRY_HTTP_STATUSES and not last_attempt:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+                    continue
+                response.raise_for_status()
+                data = response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if last_attempt:
+                    raise
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                continue
+            if data.get('status') in RETRY_API_STATUSES and not last_attempt:
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                continue
+            return data
@@ -4,6 +4,8 @@ from pydantic import BaseModel, Field, ConfigDict
 import requests
 import os
 from dotenv import load_dotenv
+from .directions_cache import DirectionsCache
+from .directions_client import DirectionsClient
 
 class GoogleMapsInput(BaseModel):
     """Input schema for GoogleMapsTool."""
@@ -20,37 +22,33 @@ class GoogleMapsTool(BaseTool):
     )
     args_schema: Type[BaseModel] = GoogleMapsInput
     api_key: Optional[str] = None
+    directions_client: Optional[DirectionsClient] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
     
-    def __init__(self):
+    def __init__(self, directions_cache: Optional[DirectionsCache] = None):
         super().__init__()
         load_dotenv()
         self.api_key = os.getenv('GOOGLE_MAPS_API_KEY')
         if not self.api_key:
             raise ValueError("Google Maps API key not found in environment variables")
+        # responses are shared with the other maps tools through the same cache
+        self.directions_client = DirectionsClient(self.api_key, cache=directions_cache)
 
-    def _get_traffic_info(self, origin: str, destination: str) -> Optional[Dict]:
+    def _get_traffic_info(self, origin: str, destination: str, departure_time: str = "now") -> Optional[Dict]:
         """
         Fetches traffic information using Google Maps Directions API.
         
         Args:
             origin: Starting point
             destination: Ending point
+            departure_time: Time of departure (default: "now")
             
         Returns:
             Dictionary containing traffic information or None if request fails
         """
-        url = (
-            f"https://maps.googleapis.com/maps/api/directions/json"
-            f"?origin={origin}&destination={destination}"
-            f"&departure_time=now&key={self.api_key}"
-        )
-        
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            data = self.directions_client.fetch(origin, destination, departure_time)
 
             if data['status'] == 'OK':
                 route = data['routes'][0]
@@ -98,7 +96,7 @@ class GoogleMapsTool(BaseTool):
             Formatted string containing traffic information
         """
         try:
-            traffic_data = self._get_traffic_info(origin, destination)
+            traffic_data = self._get_traffic_info(origin, destination, departure_time)
             
             if not traffic_data:
                 return "Error: Unable to fetch traffic data from Google Maps API"
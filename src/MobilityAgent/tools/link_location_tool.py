@@ -0,0 +1,74 @@
+from crewai.tools import BaseTool
+from typing import Type, List, Optional, Dict, Tuple
+from pydantic import BaseModel, Field, ConfigDict
+import numpy as np
+import pandas as pd
+from ..roadmap import load_segment_geometry
+
+class LinkToLocationInput(BaseModel):
+    """Input schema for LinkToLocationTool."""
+    link_ids: List[str] = Field(..., description="Road segment IDs (link_id) to locate")
+
+class LinkToLocationTool(BaseTool):
+    name: str = "Road Segment to Location Resolver"
+    description: str = (
+        "A tool for converting road segment IDs (link_id) into coordinates. "
+        "Returns the start, middle and end point of every segment as 'latitude,longitude'."
+    )
+    args_schema: Type[BaseModel] = LinkToLocationInput
+    starts: Optional[np.ndarray] = None
+    ends: Optional[np.ndarray] = None
+    tokens: Optional[Dict[str, int]] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def __init__(self, graph_path: Optional[str] = None, dataset: str = "SF"):
+        """
+        Args:
+            graph_path: Segment geometries in the roadmap.geo format (default: {dataset}-Taxi/roadmap.geo)
+            dataset: Dataset name (default: "SF")
+        """
+        super().__init__()
+        graph_path = graph_path if graph_path is not None else f'{dataset}-Taxi/roadmap.geo'
+        points, counts = load_segment_geometry(dataset, path=graph_path)
+        last = np.cumsum(counts) - 1
+        self.starts = points[last - counts + 1]
+        self.ends = points[last]
+        geo_ids = pd.read_csv(graph_path, usecols=['geo_id'])['geo_id'].astype(str)
+        self.tokens = dict(zip(geo_ids, range(len(geo_ids))))
+
+    def locate(self, link_ids: List[str]) -> List[Optional[Tuple[Tuple[float, float], Tuple[float, float]]]]:
+        """(start, end) (latitude, longitude) of every road segment, None for unknown IDs."""
+        locations = []
+        for link_id in link_ids:
+            token = self.tokens.get(str(link_id).strip())
+            if token is None:
+                locations.append(None)
+            else:
+                locations.append((tuple(self.starts[token].tolist()), tuple(self.ends[token].tolist())))
+        return locations
+
+    def _run(self, link_ids: List[str]) -> str:
+        """
+        Resolve road segment IDs to coordinates.
+
+        Args:
+            link_ids: Road segment IDs
+
+        Returns:
+            One line per segment with its start, middle and end point
+        """
+        if isinstance(link_ids, str):
+            link_ids = link_ids.split(',')
+        lines = []
+        for link_id, location in zip(link_ids, self.locate(link_ids)):
+            if location is None:
+                lines.append(f"{link_id}: unknown link_id")
+                continue
+            (start_lat, start_lng), (end_lat, end_lng) = location
+            lines.append(
+                f"{link_id}: start {start_lat:.6f},{start_lng:.6f}; "
+                f"middle {(start_lat + end_lat) / 2:.6f},{(start_lng + end_lng) / 2:.6f}; "
+                f"end {end_lat:.6f},{end_lng:.6f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,107 @@
+from crewai.tools import BaseTool
+from typing import Type, List, Optional, Tuple
+from pydantic import BaseModel, Field, ConfigDict
+import requests
+import os
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from ..spatial_index import SegmentIndex
+from .directions_cache import DirectionsCache
+from .directions_client import DirectionsClient
+
+class LocationToLinkInput(BaseModel):
+    """Input schema for LocationToLinkTool."""
+    locations: List[str] = Field(
+        ...,
+        description="Locations to resolve, each as 'latitude,longitude' or a street address "
+                    "(e.g., 'Columbus Ave & Union St, San Francisco, CA')"
+    )
+
+class LocationToLinkTool(BaseTool):
+    name: str = "Location to Road Segment Resolver"
+    description: str = (
+        "A tool for converting locations (coordinates or addresses) into road segment IDs (link_id). "
+        "Returns the nearest road segment of every location and its distance in meters."
+    )
+    args_schema: Type[BaseModel] = LocationToLinkInput
+    index: Optional[SegmentIndex] = None
+    geo_ids: Optional[np.ndarray] = None
+    directions_client: Optional[DirectionsClient] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def __init__(self,
+                 graph_path: Optional[str] = None,
+                 dataset: str = "SF",
+                 cell_size: Optional[float] = None,
+                 directions_cache: Optional[DirectionsCache] = None):
+        """
+        Args:
+            graph_path: Segment geometries in the roadmap.geo format (default: {dataset}-Taxi/roadmap.geo)
+            dataset: Dataset name (default: "SF")
+            cell_size: Grid cell size in meters of the spatial index
+            directions_cache: Cache of geocoding responses (default: the shared cache)
+        """
+        super().__init__()
+        graph_path = graph_path if graph_path is not None else f'{dataset}-Taxi/roadmap.geo'
+        self.index = SegmentIndex.from_dataset(dataset, path=graph_path, cell_size=cell_size)
+        self.geo_ids = pd.read_csv(graph_path, usecols=['geo_id'])['geo_id'].to_numpy()
+        # addresses are geocoded through the Google Maps API when a key is available
+        load_dotenv()
+        api_key = os.getenv('GOOGLE_MAPS_API_KEY')
+        if api_key:
+            self.directions_client = DirectionsClient(api_key, cache=directions_cache)
+
+    def resolve(self, points: List[Tuple[float, float]]) -> Tuple[List[int], List[float]]:
+        """
+        Nearest road segment of many (latitude, longitude) points with one batched index query.
+
+        Returns:
+            Road segment IDs and distances in meters
+        """
+        tokens, distances = self.index.nearest(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        return self.geo_ids[tokens].tolist(), distances.tolist()
+
+    def _parse_location(self, location: str) -> Optional[Tuple[float, float]]:
+        parts = location.split(',')
+        if len(parts) == 2:
+            try:
+                return float(parts[0]), float(parts[1])
+            except ValueError:
+                pass
+        if self.directions_client is None:
+            raise ValueError("Google Maps API key not found in environment variables, addresses cannot be geocoded")
+        return self.directions_client.geocode(location)
+
+    def _run(self, locations: List[str]) -> str:
+        """
+        Resolve locations to road segment IDs.
+
+        Args:
+            locations: 'latitude,longitude' strings or addresses
+
+        Returns:
+            One line per location with its road segment ID and distance
+        """
+        if isinstance(locations, str):
+            locations = [locations]
+        try:
+            points, resolved = [], []
+            lines = [None] * len(locations)
+            for i, location in enumerate(locations):
+                point = self._parse_location(location)
+                if point is None:
+                    lines[i] = f"{location}: location not found"
+                else:
+                    points.append(point)
+                    resolved.append(i)
+
+            if points:
+                link_ids, distances = self.resolve(points)
+                for i, link_id, distance in zip(resolved, link_ids, distances):
+                    lines[i] = f"{locations[i]}: link_id {link_id} ({distance:.1f} meters away)"
+            return "\n".join(lines)
+
+        except (ValueError, requests.exceptions.RequestException) as e:
+            return f"Error resolving locations: {str(e)}"
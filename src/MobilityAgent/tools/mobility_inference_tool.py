@@ -1,7 +1,11 @@
 from crewai.tools import BaseTool
-from typing import Type, List, Optional, Any
+from typing import Type, List, Optional, Any, Dict, Union
 from pydantic import BaseModel, Field, ConfigDict
 from ..mobility_inference import MobilityInference
+from ..inference_server import InferenceClient
+
+# trajectories returned by one tool call
+MAX_SHOWN = 5
 
 class MobilityInferenceInput(BaseModel):
     """Input schema for MobilityInferenceTool."""
@@ -9,6 +13,7 @@ class MobilityInferenceInput(BaseModel):
     num_trajectories: int = Field(default=3, description="Number of trajectories to generate")
     temperature: float = Field(default=1.0, description="Sampling temperature (higher = more random)")
     max_length: int = Field(default=81, description="Maximum trajectory length")
+    adapter: Optional[str] = Field(default=None, description="Name of a loaded scenario adapter to use (default: base model)")
 
 class MobilityInferenceTool(BaseTool):
     name: str = "Mobility Trajectory Generator"
@@ -18,23 +23,43 @@ class MobilityInferenceTool(BaseTool):
         "Input should be a road segment ID, and it will return a list of possible trajectories."
     )
     args_schema: Type[BaseModel] = MobilityInferenceInput
-    inference_model: Optional[MobilityInference] = None
+    inference_model: Optional[Union[MobilityInference, InferenceClient]] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
-    def __init__(self, model_path: str, dataset: str = "SF"):
+    def __init__(self,
+                 model_path: Optional[str] = None,
+                 dataset: str = "SF",
+                 adapters: Optional[Dict[str, str]] = None,
+                 server_address: Optional[str] = None):
+        """
+        Args:
+            model_path: Path to the trained model checkpoint, loaded in this process
+            dataset: Dataset name (default: "SF")
+            adapters: Named LoRA adapter checkpoints to load on top of the model
+            server_address: "host:port" of a running InferenceServer; in this client mode no model
+                is loaded and requests are batched with those of other tools on the server
+        """
         super().__init__()
+        if server_address is not None:
+            host, port = server_address.rsplit(':', 1)
+            self.inference_model = InferenceClient(host=host, port=int(port))
+            return
         self.inference_model = MobilityInference(
             model_path=model_path,
             dataset=dataset
         )
+        # named LoRA adapters served from the same base model
+        for name, adapter_path in (adapters or {}).items():
+            self.inference_model.load_adapter(name, adapter_path)
 
     def _run(
         self, 
         origin_id: str, 
         num_trajectories: int = 5,
         temperature: float = 1.0,
-        max_length: int = 81
+        max_length: int = 81,
+        adapter: Optional[str] = None
     ) -> str:
         """
         Generate trajectories using MobilityGPT model.
@@ -44,27 +69,31 @@ class MobilityInferenceTool(BaseTool):
             num_trajectories: Number of trajectories to generate
             temperature: Sampling temperature
             max_length: Maximum trajectory length
+            adapter: Name of a loaded LoRA adapter
             
         Returns:
             A formatted string containing the generated trajectories and their lengths
         """
         try:
+            # only MAX_SHOWN trajectories are returned, so no more are decoded (stopping a larger
+            # batch early with stream_trajectories would favour the short ones)
             trajectories = self.inference_model.generate_trajectories(
                 origin_id=origin_id,
-                num_trajectories=num_trajectories,
+                num_trajectories=min(num_trajectories, MAX_SHOWN),
                 temperature=temperature,
-                max_length=max_length
+                max_length=max_length,
+                adapter=adapter
             )
             
             # Format the output
             output = f"Generated {len(trajectories)} trajectories from origin {origin_id}:\n\n"
-            for i, trajectory in enumerate(trajectories[:5], 1):  # Show first 5 trajectories
-                length = self.inference_model.get_segment_length(trajectory)
+            lengths = self.inference_model.get_segment_lengths(trajectories)
+            for i, (trajectory, length) in enumerate(zip(trajectories, lengths), 1):
                 output += f"Trajectory {i}: {trajectory}\n"
                 output += f"Length: {length:.2f} units\n\n"
             
-            if len(trajectories) > 5:
-                output += f"... and {len(trajectories) - 5} more trajectories\n"
+            if num_trajectories > MAX_SHOWN:
+                output += f"(at most {MAX_SHOWN} trajectories are generated per request)\n"
                 
             return output
             
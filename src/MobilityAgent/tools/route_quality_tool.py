@@ -2,9 +2,14 @@ from crewai.tools import BaseTool
 from typing import List, Tuple, Dict, Optional, Type
 from pydantic import BaseModel, Field, ConfigDict
 import requests
-from math import radians, cos, sin, asin, sqrt
 import os
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from mobilitygpt.config import get_base_config
+from .directions_cache import DirectionsCache, normalize_location
+from .directions_client import DirectionsClient
+from ..geodesic import haversine, segment_distances
+from ..routing import OfflineRouter
 
 class Coordinate(BaseModel):
     """Schema for coordinate pairs"""
@@ -32,15 +37,39 @@ class RouteQualityTool(BaseTool):
     )
     args_schema: Type[BaseModel] = RouteQualityInput
     api_key: Optional[str] = None
+    directions_client: Optional[DirectionsClient] = None
+    max_concurrent_requests: int = 1
+    use_waypoints: bool = False
+    max_waypoints: int = 23
+    router: Optional[OfflineRouter] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
-    def __init__(self):
+    def __init__(self,
+                 directions_cache: Optional[DirectionsCache] = None,
+                 max_concurrent_requests: Optional[int] = None,
+                 use_waypoints: Optional[bool] = None,
+                 router: Optional[OfflineRouter] = None):
         super().__init__()
         load_dotenv()
+        # offline routing over the road graph replaces the Directions API, see OfflineRouter
+        base_config = get_base_config()
+        if router is None and base_config.routing.backend == 'offline':
+            router = OfflineRouter.from_dataset(base_config.data.dataset)
+        self.router = router
         self.api_key = os.getenv('GOOGLE_MAPS_API_KEY')
-        if not self.api_key:
+        if not self.api_key and self.router is None:
             raise ValueError("Google Maps API key not found in environment variables")
+        # segments are fetched concurrently over one pooled session, with responses shared
+        # with the other maps tools through the same cache
+        config = base_config.maps
+        if max_concurrent_requests is None:
+            max_concurrent_requests = config.max_concurrent_requests
+        self.max_concurrent_requests = max_concurrent_requests
+        # optionally pack whole trajectories into multi-leg waypoint requests
+        self.use_waypoints = use_waypoints if use_waypoints is not None else config.use_waypoints
+        self.max_waypoints = config.max_waypoints
+        self.directions_client = DirectionsClient(self.api_key, cache=directions_cache, pool_size=max_concurrent_requests)
 
     def _run(
         self,
@@ -75,8 +104,8 @@ class RouteQualityTool(BaseTool):
             output = "Route Quality Analysis:\n\n"
             output += f"Total Distance (Actual): {metrics['total_distance_actual']:.2f} meters\n"
             output += f"Total Distance (Google): {metrics['total_distance_google']:.2f} meters\n"
-            output += f"Route Efficiency: {metrics.get('route_efficiency', 'N/A'):.2f}\n"
-            output += f"Traffic Impact: {metrics.get('traffic_impact', 'N/A'):.2f}\n\n"
+            output += f"Route Efficiency: {self._format_ratio(metrics.get('route_efficiency'))}\n"
+            output += f"Traffic Impact: {self._format_ratio(metrics.get('traffic_impact'))}\n\n"
             
             output += "Segment Analysis:\n"
             for segment in metrics['segments'][:5]:  # Show first 5 segments
@@ -86,7 +115,10 @@ class RouteQualityTool(BaseTool):
                 output += f"  Distance (Actual): {segment['actual_distance']:.2f} meters\n"
                 output += f"  Distance (Google): {segment['google_distance']:.2f} meters\n"
                 output += f"  Duration: {segment['google_duration'] // 60} minutes\n"
-                output += f"  Duration with Traffic: {segment['traffic_duration'] // 60} minutes\n"
+                if segment['traffic_duration'] is None:
+                    output += "  Duration with Traffic: N/A\n"
+                else:
+                    output += f"  Duration with Traffic: {segment['traffic_duration'] // 60} minutes\n"
             
             if len(metrics['segments']) > 5:
                 output += f"\n... and {len(metrics['segments']) - 5} more segments"
@@ -96,6 +128,10 @@ class RouteQualityTool(BaseTool):
         except Exception as e:
             return f"Error analyzing route quality: {str(e)}"
 
+    @staticmethod
+    def _format_ratio(value: Optional[float]) -> str:
+        return 'N/A' if value is None else f"{value:.2f}"
+
     def get_google_maps_route(self, origin: Tuple[float, float], 
                             destination: Tuple[float, float]) -> Optional[Dict]:
         """
@@ -108,27 +144,14 @@ class RouteQualityTool(BaseTool):
         Returns:
             Dictionary with route information or None if request fails
         """
-        url = (f"https://maps.googleapis.com/maps/api/directions/json?"
-               f"origin={origin[0]},{origin[1]}&"
-               f"destination={destination[0]},{destination[1]}&"
-               f"departure_time=now&key={self.api_key}")
-        
+        if self.router is not None:
+            return self.router.get_route(origin, destination)
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            data = self.directions_client.fetch(origin, destination)
             
             if data['status'] == 'OK':
                 route = data['routes'][0]
-                leg = route['legs'][0]
-                return {
-                    'duration': leg['duration']['value'],
-                    'duration_in_traffic': leg['duration_in_traffic']['value'],
-                    'distance': leg['distance']['value'],
-                    'start_address': leg['start_address'],
-                    'end_address': leg['end_address'],
-                    'steps': leg['steps']
-                }
+                return self._leg_info(route['legs'][0])
             print(f"Google Maps API Error: {data['status']}")
             return None
             
@@ -136,6 +159,74 @@ class RouteQualityTool(BaseTool):
             print(f"Request Error: {e}")
             return None
 
+    @staticmethod
+    def _leg_info(leg: Dict) -> Dict:
+        """Route information of one leg of a Directions response."""
+        return {
+            'duration': leg['duration']['value'],
+            # not returned for routes with stopover waypoints: unknown rather than the free-flow duration
+            'duration_in_traffic': leg['duration_in_traffic']['value'] if 'duration_in_traffic' in leg else None,
+            'distance': leg['distance']['value'],
+            'start_address': leg['start_address'],
+            'end_address': leg['end_address'],
+            'steps': leg['steps']
+        }
+
+    def get_google_maps_routes(self, segments: List[Tuple[Tuple[float, float], Tuple[float, float]]]) -> List[Optional[Dict]]:
+        """
+        Fetches the routes of many (origin, destination) segments with up to max_concurrent_requests
+        requests in flight.
+        
+        Args:
+            segments: List of (origin, destination) coordinate pairs
+            
+        Returns:
+            Route information of every segment (see get_google_maps_route), in segment order
+        """
+        # offline routes are CPU-bound, threads would only contend for the GIL
+        if self.max_concurrent_requests <= 1 or len(segments) <= 1 or self.router is not None:
+            return [self.get_google_maps_route(start, end) for start, end in segments]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(segments))) as executor:
+            return list(executor.map(lambda segment: self.get_google_maps_route(*segment), segments))
+
+    def get_google_maps_routes_waypoints(self, trajectory: List[Tuple[float, float]]) -> List[Optional[Dict]]:
+        """
+        Fetches the routes of all consecutive segments of a trajectory with as few requests as the
+        waypoint limit allows: each request covers up to max_waypoints + 1 segments, one leg each.
+        
+        Args:
+            trajectory: List of (latitude, longitude) coordinates
+            
+        Returns:
+            Route information of every segment (see get_google_maps_route), in segment order
+        """
+        legs_per_request = self.max_waypoints + 1
+        chunks = [trajectory[i:i + legs_per_request + 1] for i in range(0, len(trajectory) - 1, legs_per_request)]
+        if self.max_concurrent_requests <= 1 or len(chunks) <= 1:
+            chunk_routes = [self._get_chunk_routes(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrent_requests, len(chunks))) as executor:
+                chunk_routes = list(executor.map(self._get_chunk_routes, chunks))
+        return [route_info for routes in chunk_routes for route_info in routes]
+
+    def _get_chunk_routes(self, points: List[Tuple[float, float]]) -> List[Optional[Dict]]:
+        """One waypoint request for len(points) - 1 segments, split back into per-segment route information."""
+        if len(points) == 2:
+            return [self.get_google_maps_route(points[0], points[1])]
+        waypoints = '|'.join(normalize_location(point) for point in points[1:-1])
+        try:
+            data = self.directions_client.fetch(points[0], points[-1], waypoints=waypoints)
+            if data['status'] == 'OK':
+                legs = data['routes'][0]['legs']
+                if len(legs) == len(points) - 1:
+                    return [self._leg_info(leg) for leg in legs]
+            else:
+                print(f"Google Maps API Error: {data['status']}")
+        except requests.exceptions.RequestException as e:
+            print(f"Request Error: {e}")
+        # fall back to one request per segment
+        return self.get_google_maps_routes(list(zip(points[:-1], points[1:])))
+
     @staticmethod
     def haversine_distance(coord1: Tuple[float, float], 
                           coord2: Tuple[float, float]) -> float:
@@ -149,18 +240,7 @@ class RouteQualityTool(BaseTool):
         Returns:
             Distance in meters
         """
-        R = 6371000  # Earth's radius in meters
-
-        lat1, lon1 = map(radians, coord1)
-        lat2, lon2 = map(radians, coord2)
-
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-
-        return R * c
+        return float(haversine(coord1[0], coord1[1], coord2[0], coord2[1]))
 
     def evaluate_route_quality(self, trajectory: List[Tuple[float, float]], 
                              actual_times: Optional[List[float]] = None) -> Dict:
@@ -185,20 +265,32 @@ class RouteQualityTool(BaseTool):
             'segments': []
         }
 
+        # Get Google Maps route data of all segments concurrently, in segment order
+        if self.use_waypoints and self.router is None:
+            route_infos = self.get_google_maps_routes_waypoints(trajectory)
+        else:
+            route_infos = self.get_google_maps_routes(list(zip(trajectory[:-1], trajectory[1:])))
+
+        # Haversine distances of all segments in one vectorized call
+        actual_distances = segment_distances(trajectory).tolist()
+        # waypoint requests come without traffic, the traffic impact is then left out
+        traffic_known = True
+
         for i in range(len(trajectory) - 1):
             start = trajectory[i]
             end = trajectory[i + 1]
             
-            # Calculate actual distance using Haversine
-            actual_distance = self.haversine_distance(start, end)
+            actual_distance = actual_distances[i]
             metrics['total_distance_actual'] += actual_distance
 
-            # Get Google Maps route data
-            route_info = self.get_google_maps_route(start, end)
+            route_info = route_infos[i]
             if route_info:
                 metrics['total_distance_google'] += route_info['distance']
                 metrics['total_time_google'] += route_info['duration']
-                metrics['total_time_traffic'] += route_info['duration_in_traffic']
+                if route_info['duration_in_traffic'] is None:
+                    traffic_known = False
+                else:
+                    metrics['total_time_traffic'] += route_info['duration_in_traffic']
                 
                 segment_metrics = {
                     'segment_id': i,
@@ -222,8 +314,11 @@ class RouteQualityTool(BaseTool):
             metrics['route_efficiency'] = (
                 metrics['total_distance_google'] / metrics['total_distance_actual']
             )
-            metrics['traffic_impact'] = (
-                metrics['total_time_traffic'] / metrics['total_time_google']
-            )
+            if traffic_known:
+                metrics['traffic_impact'] = (
+                    metrics['total_time_traffic'] / metrics['total_time_google']
+                )
+            else:
+                del metrics['total_time_traffic']
 
         return metrics
\ No newline at end of file
@@ -0,0 +1,165 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import requests
+from mobilitygpt.config import get_base_config
+from .directions_cache import Location, make_key
+
+
+class _TrackedQuery:
+    """A departure_time="now" Directions query seen by a client, and how often it was asked for."""
+
+    def __init__(self, client, origin, destination, params):
+        self.client = client
+        self.origin = origin
+        self.destination = destination
+        self.params = params
+        self.hits = 0.0
+
+    def refresh(self):
+        self.client.refresh(self.origin, self.destination, "now", **self.params)
+
+
+class TrafficPrefetcher:
+    """
+    Keeps the live traffic of frequently queried origin/destination pairs warm in the response
+    cache, so the tools find a fresh snapshot instead of paying the API latency inside a crew run.
+
+    DirectionsClient.fetch reports every "now" query here. A background thread wakes up every
+    interval seconds, picks the max_pairs most queried pairs (with at least min_hits, counts halve
+    every cycle so that cold pairs drop out) and re-fetches those whose traffic would expire before
+    the next cycle. When a client finds only a stale entry (older than traffic_ttl but younger than
+    stale_ttl) it serves it right away and asks the prefetcher to revalidate it in the background.
+    """
+
+    def __init__(self,
+                 interval: Optional[float] = None,
+                 max_pairs: Optional[int] = None,
+                 min_hits: Optional[int] = None,
+                 stale_ttl: Optional[float] = None,
+                 max_workers: Optional[int] = None):
+        """
+        Args:
+            interval: Seconds between refresh cycles
+            max_pairs: Number of hot pairs kept warm
+            min_hits: Queries a pair needs (decayed) before it is prefetched
+            stale_ttl: Age in seconds up to which an expired traffic snapshot is still served
+            max_workers: Concurrent refresh requests
+        """
+        config = get_base_config().maps
+        self.interval = interval if interval is not None else config.prefetch_interval
+        self.max_pairs = max_pairs if max_pairs is not None else config.prefetch_max_pairs
+        self.min_hits = min_hits if min_hits is not None else config.prefetch_min_hits
+        self.stale_ttl = stale_ttl if stale_ttl is not None else config.stale_ttl
+        max_workers = max_workers if max_workers is not None else config.max_concurrent_requests
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='traffic-prefetch')
+        self._queries: Dict[str, _TrackedQuery] = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'refreshes': 0, 'revalidations': 0, 'errors': 0}
+
+    _shared = None
+
+    @classmethod
+    def shared(cls) -> "TrafficPrefetcher":
+        """Process-wide prefetcher, started on first use, used by the tools when maps.prefetch is set."""
+        if cls._shared is None:
+            cls._shared = cls()
+            cls._shared.start()
+        return cls._shared
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='traffic-prefetcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh_once()
+            except Exception as e:
+                # one failed cycle (e.g. a cache read error) must not end prefetching for the process
+                print(f"Traffic prefetch error: {e!r}")
+
+    def record(self, client, origin: Location, destination: Location, departure_time: str = "now", **params):
+        """Count a query; only live ("now") traffic is worth prefetching."""
+        if str(departure_time).strip().lower() != "now":
+            return
+        key = make_key(origin, destination, "now", **params)
+        with self._lock:
+            query = self._queries.get(key)
+            if query is None:
+                query = self._queries[key] = _TrackedQuery(client, origin, destination, params)
+            query.hits += 1
+
+    def hot_pairs(self) -> List[str]:
+        """Cache keys of the pairs currently kept warm, most queried first."""
+        with self._lock:
+            ranked = sorted(self._queries.items(), key=lambda item: item[1].hits, reverse=True)
+        return [key for key, query in ranked[:self.max_pairs] if query.hits >= self.min_hits]
+
+    def revalidate(self, key: str):
+        """Refresh a stale entry in the background, unless a refresh of it is already running."""
+        with self._lock:
+            query = self._queries.get(key)
+            if query is None or key in self._in_flight:
+                return
+            self._in_flight.add(key)
+            self._stats['revalidations'] += 1
+        self._executor.submit(self._refresh, key, query)
+
+    def refresh_once(self) -> int:
+        """
+        Run one refresh cycle and wait for it to finish.
+
+        Returns:
+            Number of pairs re-fetched
+        """
+        futures = []
+        for key in self.hot_pairs():
+            with self._lock:
+                query = self._queries[key]
+                age = query.client.cache.age(key)
+                # refresh what would expire before the next cycle
+                if key in self._in_flight or (age is not None and age + self.interval < query.client.cache.traffic_ttl):
+                    continue
+                self._in_flight.add(key)
+            futures.append(self._executor.submit(self._refresh, key, query))
+        for future in futures:
+            future.result()
+
+        # decay the counts so that pairs nobody asks for anymore drop out
+        with self._lock:
+            for key in list(self._queries):
+                self._queries[key].hits /= 2
+                if self._queries[key].hits < 0.5 and key not in self._in_flight:
+                    del self._queries[key]
+        return len(futures)
+
+    def _refresh(self, key: str, query: _TrackedQuery):
+        outcome = 'errors'
+        try:
+            query.refresh()
+            outcome = 'refreshes'
+        except requests.exceptions.RequestException:
+            pass
+        except Exception as e:
+            # e.g. a response without a status or a failing cache write; the pair is tried again next cycle
+            print(f"Traffic prefetch error: {e!r}")
+        finally:
+            with self._lock:
+                self._stats[outcome] += 1
+                self._in_flight.discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, 'tracked_pairs': len(self._queries), 'in_flight': len(self._in_flight)}
@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from mobilitygpt.adjacency import SparseAdjacency
+from mobilitygpt.config import get_base_config
+from mobilitygpt.model import GPT
+
+NUM_NODES = 12
+
+
+@pytest.fixture
+def adjacency():
+    """Sparse adjacency (EOS row and column included) of a random road graph, 2-3 successors per segment."""
+    generator = torch.Generator().manual_seed(0)
+    origins, destinations = [], []
+    for node in range(NUM_NODES):
+        successors = torch.randperm(NUM_NODES, generator=generator)[:2 + node % 2]
+        origins += [node] * len(successors)
+        destinations += successors.tolist()
+    return SparseAdjacency.from_edges(origins, destinations, num_nodes=NUM_NODES)
+
+
+@pytest.fixture
+def make_model():
+    """Randomly initialized GPT in eval mode over the NUM_NODES segments and the end token."""
+    def make(adj_matrix, model_type='gpt-nano', block_size=16, seed=0):
+        config = get_base_config().model
+        config.model_type = model_type
+        config.vocab_size = NUM_NODES + 1
+        config.block_size = block_size
+        torch.manual_seed(seed)
+        model = GPT(config, adj_matrix=adj_matrix)
+        model.eval()
+        return model
+    return make
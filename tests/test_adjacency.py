@@ -0,0 +1,54 @@
+import torch
+
+from mobilitygpt.adjacency import SparseAdjacency
+from MobilityAgent.roadmap import RoadGraph
+from conftest import NUM_NODES
+
+EOS = NUM_NODES
+
+
+def _dense(adjacency):
+    """The dense matrix MobilityInference builds without sparse_adjacency."""
+    dense = torch.zeros(NUM_NODES + 1, NUM_NODES + 1)
+    for node in range(NUM_NODES):
+        dense[node, adjacency.successors(node)] = 1
+    dense[-1, :] = 1
+    dense[:, -1] = 1
+    return dense
+
+
+def test_rows_match_dense(adjacency):
+    dense = _dense(adjacency)
+    assert torch.equal(adjacency.to_dense(), dense)
+    rows = torch.tensor([[EOS, 3, 3, 0], [7, EOS, 11, 5]])
+    # the shapes the masking paths index with: (b,), (b, t) and (b*t, 1)
+    assert torch.equal(adjacency[rows[:, -1]], dense[rows[:, -1]])
+    assert torch.equal(adjacency[rows], dense[rows])
+    assert torch.equal(adjacency[rows.reshape(-1, 1)], dense[rows.reshape(-1, 1)])
+
+
+def test_from_dense_round_trip(adjacency):
+    dense = _dense(adjacency)
+    assert torch.equal(SparseAdjacency.from_dense(dense).to_dense(), dense)
+
+
+def test_sparse_masking_matches_dense(adjacency, make_model):
+    sparse_model = make_model(adjacency)
+    dense_model = make_model(_dense(adjacency))
+    idx = torch.tensor([[EOS, 3, 5, 1], [EOS, 8, 2, 0]])
+    with torch.no_grad():
+        torch.testing.assert_close(sparse_model(idx)[0], dense_model(idx)[0])
+    context = torch.tensor([[EOS, origin] for origin in range(NUM_NODES)])
+    torch.manual_seed(1)
+    sparse = sparse_model.generate_batch(context, end_token=EOS, do_sample=True, max_token=16)
+    torch.manual_seed(1)
+    dense = dense_model.generate_batch(context, end_token=EOS, do_sample=True, max_token=16)
+    assert all(torch.equal(a, b) for a, b in zip(sparse, dense))
+
+
+def test_road_graph_sparse_matches_dense():
+    generator = torch.Generator().manual_seed(0)
+    origins = torch.randint(NUM_NODES, (30,), generator=generator).numpy()
+    destinations = torch.randint(NUM_NODES, (30,), generator=generator).numpy()
+    graph = RoadGraph(torch.arange(NUM_NODES).numpy(), torch.ones(NUM_NODES).numpy(), origins, destinations)
+    assert torch.equal(graph.build_adjacency(sparse=True).to_dense(), graph.build_adjacency(sparse=False))
@@ -0,0 +1,89 @@
+import asyncio
+
+from MobilityAgent.inference_server import InferenceServer
+
+
+class FakeInference:
+    """Stands in for MobilityInference: segments '1'-'9', every trajectory is [origin, origin + 1]."""
+
+    def __init__(self, adapters=(None,)):
+        self.stoi = {str(i): i for i in range(1, 10)}
+        self.adapters = adapters
+        self.calls = []
+
+    def generate_from_origins(self, origin_ids, temperature=1.0, max_length=81, adapter=None, destination_id=None):
+        self.calls.append(list(origin_ids))
+        origins = [self.stoi[str(origin_id)] for origin_id in origin_ids]
+        for name in adapter if isinstance(adapter, list) else [adapter]:
+            if name not in self.adapters:
+                raise ValueError(f"Unknown adapter: {name}")
+        return [[origin, origin + 1] for origin in origins]
+
+
+async def _generate_concurrently(server, *requests):
+    return await asyncio.gather(*(server.generate_trajectories(*args, **kwargs) for args, kwargs in requests),
+                                return_exceptions=True)
+
+
+def _run(server, *requests):
+    async def main():
+        try:
+            return await _generate_concurrently(server, *requests)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_requests_are_batched():
+    inference = FakeInference()
+    server = InferenceServer(inference, max_batch_size=16, max_wait_ms=50)
+    results = _run(server, (('3', 3), {}), (('7', 2), {}))
+    assert results == [[[3, 4]] * 3, [[7, 8]] * 2]
+    assert inference.calls == [['3', '3', '3', '7', '7']]
+
+
+def test_unknown_origin_fails_only_its_request():
+    inference = FakeInference()
+    server = InferenceServer(inference, max_batch_size=16, max_wait_ms=50)
+    results = _run(server, (('3', 3), {}), (('7', 2), {}), (('99999', 2), {}))
+    assert results[0] == [[3, 4]] * 3
+    assert results[1] == [[7, 8]] * 2
+    assert isinstance(results[2], KeyError)
+    assert inference.calls == [['3', '3', '3', '7', '7']]
+
+
+def test_unknown_destination_fails_only_its_request():
+    inference = FakeInference()
+    server = InferenceServer(inference, max_batch_size=16, max_wait_ms=50)
+    results = _run(server, (('3', 1), {'destination_id': '5'}), (('4', 1), {'destination_id': '99999'}))
+    assert results[0] == [[3, 4]]
+    assert isinstance(results[1], KeyError)
+
+
+def test_failing_group_is_retried_per_request():
+    inference = FakeInference(adapters=(None, 'weekday'))
+    server = InferenceServer(inference, max_batch_size=16, max_wait_ms=50)
+    results = _run(server, (('3', 2), {'adapter': 'weekday'}), (('7', 1), {'adapter': 'missing'}), (('8', 1), {}))
+    assert results[0] == [[3, 4]] * 2
+    assert isinstance(results[1], ValueError)
+    assert results[2] == [[8, 9]]
+
+
+def test_failing_batch_does_not_stop_the_server():
+    inference = FakeInference()
+    server = InferenceServer(inference, max_batch_size=16, max_wait_ms=50)
+
+    async def main():
+        try:
+            # an unhashable temperature (e.g. a JSON list) fails before any group is decoded
+            # a dead batching task would leave these waiting forever
+            failed = await asyncio.wait_for(
+                _generate_concurrently(server, (('3', 1), {'temperature': [1.0]}), (('7', 1), {})), 5)
+            later = await asyncio.wait_for(server.generate_trajectories('5', 1), 5)
+            return failed, later
+        finally:
+            await server.stop()
+
+    failed, later = asyncio.run(main())
+    assert all(isinstance(result, TypeError) for result in failed)
+    assert later == [[5, 6]]
@@ -0,0 +1,70 @@
+import torch
+
+from mobilitygpt.profiling import GenerationProfiler
+from conftest import NUM_NODES
+
+EOS = NUM_NODES
+
+
+def _context(origins):
+    return torch.tensor([[EOS, origin] for origin in origins], dtype=torch.long)
+
+
+def test_decode_step_matches_forward(adjacency, make_model):
+    model = make_model(adjacency)
+    idx = torch.tensor([[EOS, 3, 5, 1, 7, 2, 9, 4]])
+    with torch.no_grad():
+        expected, _ = model(idx)
+        # prompt first, then one token at a time
+        logits, past = model.decode_step(idx[:, :3])
+        steps = [logits]
+        for t in range(3, idx.size(1)):
+            logits, past = model.decode_step(idx[:, t:t + 1], past)
+            steps.append(logits)
+    torch.testing.assert_close(torch.cat(steps, dim=1), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_generate_test_cache_matches_recompute(adjacency, make_model):
+    # max_token beyond block_size, so the cached path has to rebuild the cache from the cropped context
+    model = make_model(adjacency, block_size=8)
+    itos = dict(enumerate(range(NUM_NODES)))
+    itos[EOS] = '</S>'
+    for origin in range(4):
+        cached = model.generate_test(_context([origin]), itos=itos, end_token=None, max_token=20, use_cache=True)
+        recomputed = model.generate_test(_context([origin]), itos=itos, end_token=None, max_token=20, use_cache=False)
+        assert cached.size(1) == 20
+        assert torch.equal(cached, recomputed)
+
+
+def test_generate_batch_cache_matches_recompute(adjacency, make_model):
+    model = make_model(adjacency)
+    idx = _context(range(6))
+    cached = model.generate_batch(idx, end_token=EOS, max_token=16, use_cache=True)
+    recomputed = model.generate_batch(idx, end_token=EOS, max_token=16, use_cache=False)
+    assert all(torch.equal(a, b) for a, b in zip(cached, recomputed))
+
+
+def test_greedy_speculative_matches_greedy(adjacency, make_model):
+    model = make_model(adjacency, model_type='gpt-micro')
+    draft = make_model(adjacency, model_type='gpt-nano', seed=1)
+    idx = _context(range(NUM_NODES))
+    expected = model.generate_batch(idx, end_token=EOS, max_token=16)
+    for num_draft in (1, 3, 5):
+        speculative = model.generate_speculative(idx, draft, num_draft=num_draft, end_token=EOS, max_token=16)
+        assert all(torch.equal(a, b) for a, b in zip(speculative, expected))
+
+
+def test_same_model_draft_is_always_accepted(adjacency, make_model):
+    model = make_model(adjacency)
+    profiler = GenerationProfiler(model, layer_hooks=False).attach()
+    torch.manual_seed(0)
+    ys = model.generate_speculative(_context(range(4)), model, num_draft=4, end_token=None, do_sample=True,
+                                    max_token=16)
+    profiler.detach()
+    assert [len(y) for y in ys] == [16] * 4
+    assert profiler.stats.draft_tokens > 0
+    assert profiler.stats.acceptance_rate == 1.0
+    # the trajectories stay on the road graph
+    for y in ys:
+        for a, b in zip(y[1:-1].tolist(), y[2:].tolist()):
+            assert b in adjacency.successors(a).tolist()
@@ -0,0 +1,44 @@
+from benchmarks.directions_stub import directions_response
+from MobilityAgent.tools.directions_cache import DirectionsCache, normalize_location
+from MobilityAgent.tools.route_quality_tool import RouteQualityTool
+
+TRAJECTORY = [(37.770, -122.420), (37.772, -122.418), (37.775, -122.415), (37.778, -122.411)]
+
+
+class StubClient:
+    """Straight-line Directions responses which, like the API, carry no traffic for waypoint requests."""
+
+    def fetch(self, origin, destination, departure_time="now", **params):
+        query = {'origin': [normalize_location(origin)], 'destination': [normalize_location(destination)]}
+        if 'waypoints' in params:
+            query['waypoints'] = [params['waypoints']]
+        data = directions_response(query)
+        if 'waypoints' in params:
+            for leg in data['routes'][0]['legs']:
+                del leg['duration_in_traffic']
+        return data
+
+
+def _tool(monkeypatch, use_waypoints):
+    monkeypatch.setenv('GOOGLE_MAPS_API_KEY', 'test')
+    tool = RouteQualityTool(directions_cache=DirectionsCache(path=None), max_concurrent_requests=1,
+                            use_waypoints=use_waypoints)
+    tool.directions_client = StubClient()
+    return tool
+
+
+def test_traffic_impact_per_segment(monkeypatch):
+    metrics = _tool(monkeypatch, use_waypoints=False).evaluate_route_quality(TRAJECTORY)
+    assert len(metrics['segments']) == 3
+    assert metrics['traffic_impact'] > 1
+
+
+def test_waypoint_requests_leave_traffic_unknown(monkeypatch):
+    tool = _tool(monkeypatch, use_waypoints=True)
+    metrics = tool.evaluate_route_quality(TRAJECTORY)
+    assert len(metrics['segments']) == 3
+    assert 'traffic_impact' not in metrics
+    assert all(segment['traffic_duration'] is None for segment in metrics['segments'])
+    output = tool._run([{'latitude': lat, 'longitude': lng} for lat, lng in TRAJECTORY])
+    assert "Traffic Impact: N/A" in output
+    assert "Duration with Traffic: N/A" in output
@@ -0,0 +1,34 @@
+import numpy as np
+
+from benchmarks.synthetic import generate_road_network
+from MobilityAgent.roadmap import load_road_graph, load_segment_geometry
+from MobilityAgent.routing import OfflineRouter
+
+
+def _router(tmp_path, monkeypatch):
+    generate_road_network(str(tmp_path / 'GRID-Taxi'), 8, seed=0)
+    monkeypatch.chdir(tmp_path)
+    return OfflineRouter(load_road_graph('GRID'), load_segment_geometry('GRID'), algorithm='astar')
+
+
+def test_algorithms_agree(tmp_path, monkeypatch):
+    router = _router(tmp_path, monkeypatch)
+    rng = np.random.default_rng(0)
+    for source, target in rng.integers(router.graph.num_nodes, size=(30, 2)).tolist():
+        distance, path = router.shortest_path(source, target, algorithm='dijkstra')
+        for algorithm in ('astar', 'ch'):
+            other, other_path = router.shortest_path(source, target, algorithm=algorithm)
+            assert np.isclose(other, distance)
+            if other_path:
+                assert other_path[0] == source and other_path[-1] == target
+
+
+def test_snap_returns_the_segment_under_the_point(tmp_path, monkeypatch):
+    router = _router(tmp_path, monkeypatch)
+    for segment in (0, 17, router.graph.num_nodes - 1):
+        point = router.starts[segment] * 0.4 + router.ends[segment] * 0.6
+        for location in (tuple(point), f"{point[0]},{point[1]}"):
+            snapped = router.snap(location)
+            # the street is one segment per direction, both share the geometry
+            assert {tuple(router.starts[snapped]), tuple(router.ends[snapped])} == \
+                {tuple(router.starts[segment]), tuple(router.ends[segment])}
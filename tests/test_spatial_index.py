@@ -0,0 +1,28 @@
+import numpy as np
+
+from benchmarks.synthetic import generate_road_network
+from MobilityAgent.roadmap import load_segment_geometry
+from MobilityAgent.spatial_index import SegmentIndex
+
+
+def _brute_force(index, lat_lng):
+    """Distance from every query to its nearest piece, over all pieces."""
+    queries = index.project(lat_lng)
+    pieces = np.arange(len(index.piece_segment))
+    return np.array([index._distances(np.repeat(q[None], len(pieces), axis=0), pieces).min() for q in queries])
+
+
+def test_nearest_matches_brute_force_inside_and_outside(tmp_path):
+    generate_road_network(str(tmp_path / 'GRID-Taxi'), 15, seed=0)
+    points, counts = load_segment_geometry(path=str(tmp_path / 'GRID-Taxi' / 'roadmap.geo'))
+    index = SegmentIndex(points, counts, cell_size=100.0)
+    low, high = points.min(axis=0), points.max(axis=0)
+    rng = np.random.default_rng(0)
+    queries = np.concatenate((
+        low + (high - low) * rng.uniform(0, 1, (50, 2)),  # inside the grid
+        low + (high - low) * rng.uniform(-3, 4, (50, 2)),  # around it
+        [[high[0] + 0.5, high[1] + 0.7], [low[0] + 0.01, low[1] - 1.0], [0.0, 0.0]],  # far outside
+    ))
+    segments, distances = index.nearest(queries)
+    assert (segments >= 0).all()
+    np.testing.assert_allclose(distances, _brute_force(index, queries), rtol=1e-9)
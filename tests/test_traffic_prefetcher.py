@@ -0,0 +1,62 @@
+import requests
+
+from MobilityAgent.tools.directions_cache import DirectionsCache
+from MobilityAgent.tools.traffic_prefetcher import TrafficPrefetcher
+
+
+class FailingClient:
+    """Directions client whose refreshes raise the given exception."""
+
+    def __init__(self, error):
+        self.cache = DirectionsCache(path=None)
+        self.error = error
+        self.refreshes = 0
+
+    def refresh(self, origin, destination, departure_time="now", **params):
+        self.refreshes += 1
+        raise self.error
+
+
+def _prefetcher(client):
+    prefetcher = TrafficPrefetcher(interval=60, max_pairs=10, min_hits=1, max_workers=2)
+    prefetcher.record(client, "37.77,-122.42", "37.79,-122.40")
+    return prefetcher
+
+
+def test_request_error_is_counted():
+    client = FailingClient(requests.exceptions.ConnectionError("down"))
+    prefetcher = _prefetcher(client)
+    assert prefetcher.refresh_once() == 1
+    assert prefetcher.stats()['errors'] == 1
+    assert prefetcher.stats()['in_flight'] == 0
+
+
+def test_unexpected_error_releases_the_pair():
+    client = FailingClient(KeyError('status'))
+    prefetcher = _prefetcher(client)
+    prefetcher.record(client, "37.77,-122.42", "37.79,-122.40")
+    assert prefetcher.refresh_once() == 1
+    stats = prefetcher.stats()
+    assert stats['errors'] == 1 and stats['in_flight'] == 0
+    # the pair is refreshed again in the next cycle instead of staying in flight for good
+    assert prefetcher.refresh_once() == 1
+    assert client.refreshes == 2
+
+
+def test_failed_cycle_does_not_stop_the_thread():
+    client = FailingClient(KeyError('status'))
+    prefetcher = _prefetcher(client)
+    cycles = []
+
+    def refresh_once():
+        cycles.append(1)
+        if len(cycles) == 1:
+            raise RuntimeError("cache unavailable")
+        prefetcher._stop.set()
+
+    prefetcher.interval = 0.01
+    prefetcher.refresh_once = refresh_once
+    prefetcher.start()
+    prefetcher._thread.join(timeout=5)
+    assert len(cycles) == 2
+    prefetcher.stop()